@@ -1,3 +1,5 @@
+from pathlib import Path
+
 from cement import Controller, ex
 from cement.ext.ext_argparse import ArgparseArgumentHandler
 
@@ -106,7 +108,10 @@ class Instance(Controller):
                        {'help': 'The file with changes applied by the repair tool.', 'nargs': '+',
                         'default': None}),
                       (['-B', '--backup'],
-                       {'help': 'Backups the manifest file to a given path.', 'type': str, 'default': None})
+                       {'help': 'Backups the manifest file to a given path.', 'type': str, 'default': None}),
+                      (['-j', '--jobs'],
+                       {'help': 'Number of instrumented files compiled in parallel, 0 uses all the CPUs.',
+                        'type': int, 'default': 0})
                   ] + make_args
     )
     def compile(self):
@@ -117,7 +122,7 @@ class Instance(Controller):
                             link=self.app.pargs.link,
                             replace=self.app.pargs.replace, save_temps=self.app.pargs.save_temps,
                             cpp_files=self.app.pargs.cpp_files, write_build_args=self.app.pargs.write_build_args,
-                            compiler_trail_path=self.app.pargs.compiler_trail_path)
+                            compiler_trail_path=self.app.pargs.compiler_trail_path, jobs=self.app.pargs.jobs)
         compile_handler.run(self.instance, self.working)
         compile_handler.save_outcome(self.instance)
 
@@ -125,6 +130,42 @@ class Instance(Controller):
             self.app.log.error(compile_handler.error)
             exit(1)
 
+    @ex(
+        help='Compiles the candidate versions of a manifest file into a binary each.',
+        arguments=[
+                      (['-mf', '--manifest_file'],
+                       {'help': 'The manifest file replaced by the candidates.', 'type': str, 'required': True}),
+                      (['-cs', '--candidates'],
+                       {'help': 'The candidate versions of the manifest file.', 'nargs': '+', 'required': True}),
+                      (['-od', '--out_dir'],
+                       {'help': 'Directory where the binary of each candidate is linked, in its own directory.',
+                        'type': str, 'required': True}),
+                      (['-j', '--jobs'],
+                       {'help': 'Number of candidates compiled in parallel, 0 uses all the CPUs.', 'type': int,
+                        'default': 0})
+                  ]
+    )
+    def population(self):
+        compile_handler = self.app.handler.get('commands', 'compile', setup=True)
+        compile_handler.set(jobs=self.app.pargs.jobs)
+
+        try:
+            outcomes = compile_handler.build_population(self.instance, self.working,
+                                                        manifest_file=self.app.pargs.manifest_file,
+                                                        candidates=self.app.pargs.candidates,
+                                                        out_dir=Path(self.app.pargs.out_dir))
+        except ValueError as ve:
+            self.app.log.error(str(ve))
+            exit(1)
+        finally:
+            compile_handler.unset()
+
+        for i, (candidate, outcome) in enumerate(zip(self.app.pargs.candidates, outcomes)):
+            print(f"{candidate} | {Path(self.app.pargs.out_dir, str(i), self.working.binary.name)} | {outcome}")
+
+        if any(outcome.error for outcome in outcomes):
+            exit(1)
+
     @ex(
         help='Runs specified tests against challenge binary.',
         arguments=[
@@ -133,12 +174,32 @@ class Instance(Controller):
              {'help': 'Testcase ids are only numbers. Negative tests are counter after the positive.',
               'action': 'store_true'}),
             (['-T', '--timeout'], {'help': 'Timeout for the tests.', 'required': False, 'type': int}),
+            (['-at', '--adaptive_timeout'], {'help': 'Flag for deriving the timeout of each test from the durations '
+                                                     'of its previous runs.', 'action': 'store_true'}),
+            (['-j', '--jobs'], {'help': 'Number of tests to run in parallel.', 'type': int, 'default': 1}),
+            (['-b', '--batch'], {'help': 'Number of tests sent in each cb-test invocation.', 'type': int,
+                                 'default': 1}),
+            (['-c', '--concurrent'], {'help': 'Number of polls thrown concurrently by each cb-test invocation, 0 '
+                                              'sizes it from the CPUs and the free memory.', 'type': int,
+                                      'default': 1}),
             (['-wf', '--write_fail'], {'help': 'Flag for writing the failed test to the specified out_file.',
                                        'action': 'store_true'}),
             (['-np', '--neg_pov'], {'help': 'Flag for reversing the passed result if is a negative test.',
                                     'action': 'store_true'}),
             (['-ef', '--exit_fail'], {'help': 'Flag that makes program exit with error when a test fails.',
-                                      'action': 'store_true'})
+                                      'action': 'store_true'}),
+            (['-ff', '--fail_fast'], {'help': 'Flag for running first the tests most likely to fail and stopping at '
+                                              'the first failed test, the remaining tests are recorded as skipped.',
+                                      'action': 'store_true'}),
+            (['--cache'], {'help': 'Flag for reusing the results of the tests on identical binaries.',
+                           'action': 'store_true'}),
+            (['--seed'], {'help': 'Seed (96 hex characters) for the CBs and POVs, part of the key of cached results.',
+                          'type': str, 'required': False}),
+            (['--impact'], {'help': 'Flag for running only the polls that execute the lines changed by the fix files '
+                                    '(and all POVs), based on the coverage runs of the source of the instance. The '
+                                    'other polls carry the result of their coverage run forward.', 'action': 'store_true'}),
+            (['-ffs', '--fix_files'], {'help': 'The files with changes applied by the repair tool.', 'nargs': '+',
+                                       'default': None})
         ],
         parents=[argparse_handler]
     )
@@ -150,7 +211,11 @@ class Instance(Controller):
         test_handler.set(timeout=self.app.pargs.timeout, neg_pov=self.app.pargs.neg_pov,
                          print_ids=self.app.pargs.print_ids, only_numbers=self.app.pargs.only_numbers,
                          print_class=self.app.pargs.print_class, out_file=self.app.pargs.out_file,
-                         write_fail=self.app.pargs.write_fail)
+                         write_fail=self.app.pargs.write_fail, jobs=self.app.pargs.jobs,
+                         batch=self.app.pargs.batch, adaptive_timeout=self.app.pargs.adaptive_timeout,
+                         fail_fast=self.app.pargs.fail_fast, cache=self.app.pargs.cache, seed=self.app.pargs.seed,
+                         impact=self.app.pargs.impact, fix_files=self.app.pargs.fix_files,
+                         concurrent=self.app.pargs.concurrent)
         tests = Tests(polls_path=challenge_paths.polls, povs_path=challenge_paths.povs, tests=self.app.pargs.tests,
                       pos_tests=self.app.pargs.pos_tests, neg_tests=self.app.pargs.neg_tests,
                       only_numbers=self.app.pargs.only_numbers)
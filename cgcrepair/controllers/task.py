@@ -115,3 +115,30 @@ class Task(Controller):
 
         results = runner_handler(tasks=tasks, threads=self.app.pargs.threads)
         print(results)
+
+    @ex(
+        help='Starts the replay service that keeps warm python2 workers for running the tests.',
+        arguments=[
+            (['--workers'], {'type': int, 'default': None,
+                             'help': 'Number of workers (defaults to the number of CPUs).'})
+        ]
+    )
+    def replay(self):
+        command_handler = self.app.handler.get('commands', 'commands', setup=True)
+        command_handler.set()
+        tools = self.app.config.get_config('tools')
+        replay_socket = self.app.config.get_config('replay_socket')
+
+        if not replay_socket:
+            self.app.log.error("No 'replay_socket' in the configurations.")
+            return
+
+        cmd_str = [self.app.config.get_config('python2'), f"{tools}/cb-replay-server.py", '--socket', replay_socket]
+
+        if self.app.pargs.workers:
+            cmd_str.extend(['--workers', str(self.app.pargs.workers)])
+
+        command_handler(cmd_str=' '.join(cmd_str), cmd_cwd=tools, msg=f"Starting replay service on {replay_socket}.")
+
+        if command_handler.error:
+            self.app.log.error(command_handler.error)
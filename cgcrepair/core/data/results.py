@@ -7,6 +7,8 @@ from datetime import datetime
 class CommandData:
     # env: dict = None
     args: str
+    pid: int = None
+    pgid: int = None
     return_code: int = 0
     duration: float = 0
     start: datetime = None
@@ -1,13 +1,18 @@
+import asyncio
 import subprocess
 import psutil
 import time
+import os
+import signal
 
 from os import environ
+from datetime import datetime
 from typing import Union, AnyStr, List
 from threading import Timer
 
 from cement import Handler
 
+from cgcrepair.core.data.results import CommandData
 from cgcrepair.core.exc import CommandError, CGCRepairError
 from cgcrepair.core.interfaces import CommandsInterface
 
@@ -28,6 +33,10 @@ class CommandsHandler(CommandsInterface, Handler):
         lib_path = self.app.config.get_config('lib32' if "M32" in self.env else 'lib64')
         self.env["CGC_LIB_DIR"] = lib_path
 
+        if self.app.config.get_config('forkserver'):
+            # builds the challenges with the fork server shim and forks them in the tests
+            self.env["FORKSERVER"] = "True"
+
         if "LD_LIBRARY_PATH" in self.env:
             self.env["LD_LIBRARY_PATH"] = lib_path + ":" + self.env["LD_LIBRARY_PATH"]
         else:
@@ -39,75 +48,204 @@ class CommandsHandler(CommandsInterface, Handler):
     def unset(self):
         pass
 
-    def _exec(self, proc: subprocess.Popen):
+    def _exec(self, proc: subprocess.Popen, cmd_data: CommandData, parser=None):
         out = []
 
         for line in proc.stdout:
             decoded = line.decode()
-            out.append(decoded)
+
+            if parser:
+                parser.feed(decoded)
+            else:
+                out.append(decoded)
 
             if self.app.pargs.verbose:
                 self.app.log.debug(decoded)
 
-        self.output = ''.join(out)
+        if not parser:
+            cmd_data.output = ''.join(out)
 
         proc.wait(timeout=1)
 
         if proc.returncode and proc.returncode != 0:
-            self.return_code = proc.returncode
+            cmd_data.return_code = proc.returncode
             proc.kill()
-            self.error = proc.stderr.read().decode()
-
-            if self.error:
-                self.app.log.error(self.error)
-
-    def __call__(self, cmd_str: Union[AnyStr, List[AnyStr]], cmd_cwd: str = None, msg: str = None, timeout: int = None,
-                 raise_err: bool = False, exit_err: bool = False):
-
+            cmd_data.error = proc.stderr.read().decode()
+
+            if cmd_data.error:
+                self.app.log.error(cmd_data.error)
+
+    def execute(self, cmd_str: Union[AnyStr, List[AnyStr]], cmd_cwd: str = None, msg: str = None,
+                timeout: int = None, group: bool = False, parser=None, pass_fds: tuple = (),
+                groups: set = None) -> CommandData:
+        """
+            Runs the command and returns its results without changing the state of the handler, which makes it safe
+            to call from several threads at once. With 'group', the command runs in its own session and process group,
+            which holds every process it launches and is killed as a whole on timeout. With a 'parser', each line of
+            the output is fed to its 'feed' method as it is produced instead of being kept in the results. The
+            'pass_fds' are kept open in the command. With 'groups', the process group of the command is in the set
+            while it runs, which lets the caller kill it from another thread.
+        """
         if msg:
             self.app.log.info(msg)
 
         if self.app.pargs.verbose:
             self.app.log.debug(cmd_str, cmd_cwd)
 
+        cmd_data = CommandData(args=cmd_str)
+
         # based on https://stackoverflow.com/a/28319191
         with subprocess.Popen(args=cmd_str, shell=isinstance(cmd_str, str), stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE, env=self.env, cwd=cmd_cwd) as proc:
+                              stderr=subprocess.PIPE, env=self.env, cwd=cmd_cwd, start_new_session=group,
+                              pass_fds=pass_fds) as proc:
+            cmd_data.pid = proc.pid
+
+            if group:
+                # the session leader is the leader of the process group
+                cmd_data.pgid = proc.pid
 
+                if groups is not None:
+                    groups.add(cmd_data.pgid)
+            cmd_data.start = datetime.now()
             time_start = time.time()
 
-            if timeout:
-                timer = Timer(timeout, _timer_out, args=[proc, self])
-                timer.start()
-                self._exec(proc)
-                proc.stdout.close()
-                timer.cancel()
-            else:
-                self._exec(proc)
+            try:
+                if timeout:
+                    timer = Timer(timeout, _timer_out, args=[proc, cmd_data, self.app.log])
+                    timer.start()
+                    self._exec(proc, cmd_data, parser)
+                    proc.stdout.close()
+                    timer.cancel()
+                else:
+                    self._exec(proc, cmd_data, parser)
+            finally:
+                if groups is not None:
+                    groups.discard(cmd_data.pgid)
+
+            cmd_data.duration = time.time() - time_start
+            cmd_data.end = datetime.now()
+
+        return cmd_data
+
+    async def _exec_async(self, proc: asyncio.subprocess.Process, cmd_data: CommandData, parser=None):
+        out = []
+
+        async def read_stdout():
+            async for line in proc.stdout:
+                decoded = line.decode()
+
+                if parser:
+                    parser.feed(decoded)
+                else:
+                    out.append(decoded)
+
+                if self.app.pargs.verbose:
+                    self.app.log.debug(decoded)
 
-            self.duration = time.time() - time_start
+        # the error is read along the output, a full stderr pipe would block the command
+        _, error = await asyncio.gather(read_stdout(), proc.stderr.read())
 
-            if raise_err and self.error:
-                raise CommandError(self.error)
+        if not parser:
+            cmd_data.output = ''.join(out)
 
-            if exit_err and self.error:
-                exit(proc.returncode)
+        await proc.wait()
+
+        if proc.returncode and proc.returncode != 0:
+            cmd_data.return_code = proc.returncode
+            cmd_data.error = error.decode()
+
+            if cmd_data.error:
+                self.app.log.error(cmd_data.error)
+
+    async def execute_async(self, cmd_str: Union[AnyStr, List[AnyStr]], cmd_cwd: str = None, msg: str = None,
+                            timeout: int = None, group: bool = False, parser=None,
+                            pass_fds: tuple = ()) -> CommandData:
+        """
+            Asyncio counterpart of 'execute', many commands run concurrently from the thread of the event loop. The
+            timeout is awaited natively, and the command is killed on timeout and when the coroutine is cancelled.
+        """
+        if msg:
+            self.app.log.info(msg)
+
+        if self.app.pargs.verbose:
+            self.app.log.debug(cmd_str, cmd_cwd)
+
+        cmd_data = CommandData(args=cmd_str)
+        # the lines of cb-replay --debug outgrow the default limit (64 KiB) of the stream reader
+        kwargs = dict(stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=self.env, cwd=cmd_cwd,
+                      start_new_session=group, pass_fds=pass_fds, limit=2 ** 20)
+
+        if isinstance(cmd_str, str):
+            proc = await asyncio.create_subprocess_shell(cmd_str, **kwargs)
+        else:
+            proc = await asyncio.create_subprocess_exec(*cmd_str, **kwargs)
+
+        cmd_data.pid = proc.pid
+
+        if group:
+            # the session leader is the leader of the process group
+            cmd_data.pgid = proc.pid
+        cmd_data.start = datetime.now()
+        time_start = time.time()
+
+        try:
+            await asyncio.wait_for(self._exec_async(proc, cmd_data, parser), timeout=timeout)
+        except asyncio.TimeoutError:
+            _timer_out(proc, cmd_data, self.app.log)
+            await proc.wait()
+        except asyncio.CancelledError:
+            _timer_out(proc, cmd_data, self.app.log)
+            await proc.wait()
+            raise
+
+        cmd_data.duration = time.time() - time_start
+        cmd_data.end = datetime.now()
+
+        return cmd_data
+
+    def __call__(self, cmd_str: Union[AnyStr, List[AnyStr]], cmd_cwd: str = None, msg: str = None, timeout: int = None,
+                 raise_err: bool = False, exit_err: bool = False):
+
+        cmd_data = self.execute(cmd_str=cmd_str, cmd_cwd=cmd_cwd, msg=msg, timeout=timeout)
+        self.output = cmd_data.output
+        self.duration = cmd_data.duration
+
+        if cmd_data.error is not None:
+            self.error = cmd_data.error
+
+        if cmd_data.return_code:
+            self.return_code = cmd_data.return_code
+
+        if raise_err and self.error:
+            raise CommandError(self.error)
+
+        if exit_err and self.error:
+            exit(cmd_data.return_code)
 
 
 # https://stackoverflow.com/a/54775443
-def _timer_out(p: subprocess.Popen, cmd: CommandsHandler):
-    cmd.error = "Command timed out"
-    process = psutil.Process(p.pid)
-    cmd.return_code = p.returncode if p.returncode else -3
+def _timer_out(p: Union[subprocess.Popen, asyncio.subprocess.Process], cmd_data: CommandData, log):
+    cmd_data.error = "Command timed out"
+    cmd_data.timeout = True
+    cmd_data.return_code = p.returncode if p.returncode else -3
+
+    if cmd_data.pgid:
+        try:
+            os.killpg(cmd_data.pgid, signal.SIGKILL)
+        except ProcessLookupError as ple:
+            log.warning(str(ple))
+        return
 
     try:
+        process = psutil.Process(p.pid)
+
         for proc in process.children(recursive=True):
             if psutil.pid_exists(proc.pid):
                 proc.kill()
 
         process.kill()
     except psutil.NoSuchProcess as npe:
-        cmd.app.log.warning(str(npe))
+        log.warning(str(npe))
 
 
 def load(app):
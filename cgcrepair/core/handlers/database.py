@@ -1,11 +1,13 @@
 import contextlib
 
 from pathlib import Path
-from typing import Union, Dict, Any, Callable
+from datetime import datetime
+from typing import Union, Dict, Any, Callable, List, Set
 
 from cement import Handler
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey
-from sqlalchemy import create_engine
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session, declarative_base, relationship, joinedload
 from sqlalchemy import inspect
 
@@ -18,6 +20,9 @@ from cgcrepair.utils.data import WorkingPaths
 
 Base = declarative_base()
 
+# status of the tests that were not run because the outcome was already decided
+SKIPPED = 'skipped'
+
 
 class TestOutcome(Base):
     __tablename__ = "test_outcome"
@@ -38,6 +43,13 @@ class TestOutcome(Base):
     exit_status = Column('exit_status', Integer, nullable=False)
     sig = Column('sig', Integer, nullable=True)
     duration = Column('duration', Float, nullable=False)
+    # resources used by the CBs: CPU seconds, peak resident set size in KiB and number of processes
+    cpu_user = Column('cpu_user', Float, nullable=True)
+    cpu_sys = Column('cpu_sys', Float, nullable=True)
+    max_rss = Column('max_rss', Integer, nullable=True)
+    procs = Column('procs', Integer, nullable=True)
+    # outcome recorded again from a previous run, e.g. a cached result, instead of running the test
+    reused = Column('reused', Boolean, nullable=True)
 
     def get_clean_error(self):
         return self.error.strip().replace('\n', ' ') if self.error else ''
@@ -50,7 +62,40 @@ class TestOutcome(Base):
         return {'id': self.id, 'compile id': self.co_id, 'name': self.name, 'is pov': self.is_pov,
                 'result': self.result, 'status': self.status, 'total': self.total, 'passed': self.passed,
                 'failed': self.failed, 'error': self.get_clean_error(), 'exit status': self.exit_status,
-                'signal': self.sig, 'duration': self.duration}
+                'signal': self.sig, 'duration': self.duration, 'cpu user': self.cpu_user, 'cpu sys': self.cpu_sys,
+                'max rss': self.max_rss, 'procs': self.procs, 'reused': bool(self.reused)}
+
+
+class TestCache(Base):
+    __tablename__ = "test_cache"
+
+    id = Column('id', Integer, primary_key=True)
+    key = Column('key', String, nullable=False, unique=True)
+    to_id = Column('to_id', Integer, ForeignKey('test_outcome.id'), nullable=False)
+    test_outcome = relationship("TestOutcome")
+    hits = Column('hits', Integer, nullable=False, default=0)
+    last_hit = Column('last_hit', DateTime, nullable=False)
+
+    def __str__(self):
+        return f"{self.id} | {self.key} | {self.to_id} | {self.hits} | {self.last_hit}"
+
+
+class TestCoverage(Base):
+    __tablename__ = "test_coverage"
+
+    id = Column('id', Integer, primary_key=True)
+    challenge = Column('challenge', String, nullable=False, index=True)
+    test = Column('test', String, nullable=False)
+    file = Column('file', String, nullable=False)
+    # comma separated numbers of the lines executed by the test
+    lines = Column('lines', String, nullable=False)
+    # hash of the manifest files of the source the lines refer to
+    digest = Column('digest', String, nullable=True)
+    # outcome of the run that indexed the test, the result of the source the lines refer to
+    to_id = Column('to_id', Integer, ForeignKey('test_outcome.id'), nullable=True)
+
+    def __str__(self):
+        return f"{self.id} | {self.challenge} | {self.test} | {self.file} | {self.lines} | {self.digest} | {self.to_id}"
 
 
 class CompileOutcome(Base):
@@ -63,10 +108,13 @@ class CompileOutcome(Base):
     error = Column('error', String, nullable=True)
     tag = Column('tag', String, nullable=False)
     exit_status = Column('exit_status', Integer)
+    # objects reused from and compiled into the object cache
+    cache_hits = Column('cache_hits', Integer, nullable=True)
+    cache_misses = Column('cache_misses', Integer, nullable=True)
 
     def __str__(self):
         clean_error = self.error.strip().replace('\n', ' ') if self.error else ''
-        return f"{self.id} | {clean_error} | {self.tag} | {self.exit_status}"
+        return f"{self.id} | {clean_error} | {self.tag} | {self.exit_status} | {self.cache_hits} | {self.cache_misses}"
 
 
 class Sanity(Base):
@@ -164,6 +212,200 @@ class InstanceHandler(DatabaseInterface, Handler):
         return self.app.db.query(Instance)
 
 
+class TestOutcomeHandler(DatabaseInterface, Handler):
+    class Meta:
+        label = 'test_outcome'
+
+    def get(self, tid: int):
+        return self.app.db.query(TestOutcome, tid)
+
+    def durations(self, challenge: str) -> Dict[str, List[float]]:
+        """
+            Returns the durations of the previous runs of the challenge's tests, grouped by test name. Only the runs
+            that completed with the expected result are considered, runs that timed out or failed say little about
+            how long the test takes. Reused outcomes repeat the duration of their run and are not considered.
+        """
+        durations = {}
+        rows = self.app.db.query_columns(TestOutcome.name, TestOutcome.duration, join=Instance,
+                                         filters={Instance.name: lambda name: name == challenge,
+                                                  TestOutcome.result: lambda result: result.is_(True),
+                                                  TestOutcome.exit_status: lambda status: status == 0,
+                                                  TestOutcome.reused: lambda reused: reused.is_not(True)})
+
+        for name, duration in rows:
+            durations.setdefault(name, []).append(duration)
+
+        return durations
+
+    def fail_rates(self, challenge: str, neg_pov: bool = False) -> Dict[str, float]:
+        """
+            Returns the rate of failed runs of the challenge's tests, smoothed with one pass and one fail, grouped by
+            test name. With 'neg_pov' a POV fails when the binary does not crash. Skipped runs and reused outcomes are
+            not considered.
+        """
+        counts = {}
+        rows = self.app.db.query_columns(TestOutcome.name, TestOutcome.is_pov, TestOutcome.result, TestOutcome.error,
+                                         join=Instance,
+                                         filters={Instance.name: lambda name: name == challenge,
+                                                  TestOutcome.status: lambda status: status.is_distinct_from(SKIPPED),
+                                                  TestOutcome.reused: lambda reused: reused.is_not(True)})
+
+        for name, is_pov, result, error in rows:
+            if is_pov and neg_pov:
+                failed = result
+            else:
+                failed = not result or bool(error)
+
+            runs, fails = counts.get(name, (0, 0))
+            counts[name] = (runs + 1, fails + int(failed))
+
+        return {name: (fails + 1) / (runs + 2) for name, (runs, fails) in counts.items()}
+
+    def writer(self, batch_size: int = 0, on_flush: Callable[[List[TestOutcome]], None] = None):
+        return OutcomeWriter(self.app.db, batch_size=batch_size, on_flush=on_flush)
+
+    def all(self):
+        return self.app.db.query(TestOutcome)
+
+
+class OutcomeWriter:
+    """
+        Buffers test outcomes and inserts them in bulk, a single transaction for each batch of 'batch_size' outcomes.
+        Without a batch size, the outcomes are inserted only when the writer is flushed. The 'on_flush' callback gets
+        the outcomes of each batch once they are inserted and have their ids.
+    """
+
+    def __init__(self, db: 'Database', batch_size: int = 0, on_flush: Callable[[List[TestOutcome]], None] = None):
+        self.db = db
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.pending = []
+        self.written = []
+
+    def add(self, test_outcome: TestOutcome):
+        self.pending.append(test_outcome)
+
+        if self.batch_size and len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> int:
+        if not self.pending:
+            return 0
+
+        # the outcomes stay pending when the insert fails, the next flush retries them
+        outcomes = self.pending
+        self.db.add_all(outcomes)
+        self.pending = []
+        self.written.extend(outcomes)
+
+        if self.on_flush:
+            self.on_flush(outcomes)
+
+        return len(outcomes)
+
+    @property
+    def ids(self) -> List[int]:
+        self.flush()
+        return [test_outcome.id for test_outcome in self.written]
+
+
+class TestCacheHandler(DatabaseInterface, Handler):
+    class Meta:
+        label = 'test_cache'
+
+    def get(self, key: str) -> Union[TestOutcome, None]:
+        """
+            Returns the outcome cached for the key and marks the entry as recently used.
+        """
+        entries = self.app.db.query_columns(TestCache.id, TestCache.to_id, TestCache.hits,
+                                            filters={TestCache.key: lambda k: k == key})
+
+        if not entries:
+            return None
+
+        tc_id, to_id, hits = entries[0]
+        self.app.db.update(TestCache, tc_id, 'hits', hits + 1)
+        self.app.db.update(TestCache, tc_id, 'last_hit', datetime.now())
+
+        return self.app.db.query(TestOutcome, to_id)
+
+    def put(self, key: str, to_id: int):
+        try:
+            self.app.db.add(TestCache(key=key, to_id=to_id, hits=0, last_hit=datetime.now()))
+        except IntegrityError:
+            # cached meanwhile by another run
+            pass
+
+    def put_all(self, entries: Dict[str, int]):
+        try:
+            self.app.db.add_all([TestCache(key=key, to_id=to_id, hits=0, last_hit=datetime.now())
+                                 for key, to_id in entries.items()])
+        except IntegrityError:
+            # some were cached meanwhile by another run
+            for key, to_id in entries.items():
+                self.put(key, to_id)
+
+    def evict(self, size: int) -> int:
+        """
+            Deletes the least recently used entries above the size of the cache.
+        """
+        return self.app.db.trim(TestCache, TestCache.last_hit, keep=size)
+
+    def delete(self, tc_id: int):
+        return self.app.db.delete(TestCache, tc_id)
+
+    def all(self):
+        return self.app.db.query(TestCache)
+
+
+class TestCoverageHandler(DatabaseInterface, Handler):
+    class Meta:
+        label = 'test_coverage'
+
+    def get(self, challenge: str, digest: str) -> Dict[str, Dict[str, Set[int]]]:
+        """
+            Returns the index of the challenge's tests to the lines they execute, grouped by test name and file. Only
+            the tests indexed on the source with the digest are considered.
+        """
+        index = {}
+        rows = self.app.db.query_columns(TestCoverage.test, TestCoverage.file, TestCoverage.lines,
+                                         filters={TestCoverage.challenge: lambda name: name == challenge,
+                                                  TestCoverage.digest: lambda d: d == digest})
+
+        for test, file, lines in rows:
+            index.setdefault(test, {})[file] = {int(line) for line in lines.split(',') if line}
+
+        return index
+
+    def outcomes(self, challenge: str, digest: str) -> Dict[str, TestOutcome]:
+        """
+            Returns the outcomes of the runs that indexed the challenge's tests on the source with the digest, grouped
+            by test name. The outcomes are copies without ids, to be recorded again.
+        """
+        columns = ['name', 'is_pov', 'result', 'status', 'total', 'passed', 'failed', 'error', 'exit_status', 'sig',
+                   'duration', 'cpu_user', 'cpu_sys', 'max_rss', 'procs']
+        rows = self.app.db.query_columns(*[getattr(TestOutcome, column) for column in columns],
+                                         join=TestCoverage,
+                                         filters={TestCoverage.challenge: lambda name: name == challenge,
+                                                  TestCoverage.digest: lambda d: d == digest})
+
+        return {row[0]: TestOutcome(**dict(zip(columns, row))) for row in rows}
+
+    def put(self, challenge: str, test: str, files: Dict[str, Set[int]], digest: str = None, to_id: int = None):
+        """
+            Replaces the lines the test executes in the index, with the digest of the source they refer to and the
+            outcome of the run.
+        """
+        self.app.db.delete_all(TestCoverage, {TestCoverage.challenge: lambda name: name == challenge,
+                                              TestCoverage.test: lambda name: name == test})
+        self.app.db.add_all([TestCoverage(challenge=challenge, test=test, file=file, digest=digest, to_id=to_id,
+                                          lines=','.join(str(line) for line in sorted(lines)))
+                             for file, lines in files.items()])
+
+    def all(self):
+        return self.app.db.query(TestCoverage)
+
+
 class VulnerabilityHandler(DatabaseInterface, Handler):
     class Meta:
         label = 'vulnerability'
@@ -216,6 +458,22 @@ class Database:
                  debug: bool = False):
         self.engine = create_engine(f"{dialect}://{username}:{password}@{host}:{port}/{database}", echo=debug)
         Base.metadata.create_all(bind=self.engine)
+        self._add_columns()
+
+    def _add_columns(self):
+        """
+            Adds the nullable columns missing in the existing tables, create_all only creates the missing tables.
+        """
+        inspector = inspect(self.engine)
+
+        with self.engine.begin() as con:
+            for table in Base.metadata.sorted_tables:
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+
+                for column in table.columns:
+                    if column.name not in existing and column.nullable:
+                        column_type = column.type.compile(dialect=self.engine.dialect)
+                        con.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
 
     def refresh(self, entity: Base):
         with Session(self.engine) as session, session.begin():
@@ -233,6 +491,14 @@ class Database:
             if hasattr(entity, 'id'):
                 return entity.id
 
+    def add_all(self, entities: List[Base]) -> List:
+        with Session(self.engine) as session, session.begin():
+            session.add_all(entities)
+            session.flush()
+            session.expunge_all()
+
+            return [entity.id for entity in entities if hasattr(entity, 'id')]
+
     def destroy(self):
         # metadata = MetaData(self.engine, reflect=True)
         with contextlib.closing(self.engine.connect()) as con:
@@ -244,6 +510,15 @@ class Database:
         with Session(self.engine) as session, session.begin():
             return session.query(entity).filter(entity.id == entity_id).delete(synchronize_session='evaluate')
 
+    def delete_all(self, entity: Base, filters: Dict[Any, Callable]) -> int:
+        with Session(self.engine) as session, session.begin():
+            query = session.query(entity)
+
+            for attr, exp in filters.items():
+                query = query.filter(exp(attr))
+
+            return query.delete(synchronize_session=False)
+
     def has_table(self, name: str):
         inspector = inspect(self.engine)
         return inspector.reflect_table(name, None)
@@ -283,6 +558,24 @@ class Database:
             session.expunge_all()
             return query
 
+    def query_columns(self, *columns: Any, join: Base = None, filters: Dict[Any, Callable] = None) -> List[tuple]:
+        with Session(self.engine) as session, session.begin():
+            query = session.query(*columns)
+
+            if join is not None:
+                query = query.join(join)
+
+            if filters:
+                for attr, exp in filters.items():
+                    query = query.filter(exp(attr))
+
+            return query.all()
+
+    def trim(self, entity: Base, order_by: Any, keep: int) -> int:
+        with Session(self.engine) as session, session.begin():
+            stale = select(entity.id).order_by(order_by.desc()).offset(keep)
+            return session.query(entity).filter(entity.id.in_(stale)).delete(synchronize_session=False)
+
     def count(self, entity: Base):
         with Session(self.engine) as session, session.begin():
             return session.query(entity).count()
@@ -1,14 +1,22 @@
+import os
+import fcntl
+import shlex
+import hashlib
 import platform
 import shutil
+import tempfile
 from pathlib import Path
-from typing import List, AnyStr
+from typing import List, AnyStr, Dict, Tuple, Union, Set
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from cgcrepair.core.corpus.challenge import Challenge
 from cgcrepair.core.exc import CommandError
 from cgcrepair.core.handlers.database import CompileOutcome, Instance
-from cgcrepair.core.handlers.operations.make import MakeHandler
+from cgcrepair.core.handlers.operations.make import MakeHandler, CONFIGURE_ENV
 from cgcrepair.core.corpus.manifest import map_instrumented_files
+from cgcrepair.utils.object_cache import ObjectCache, read_stats, BASE_ENV, STATS_ENV, CACHE_ENV
 from cgcrepair.utils.data import WorkingPaths
+from cgcrepair.utils.helpers import reflink_or_copy
 
 
 class CompileHandler(MakeHandler):
@@ -21,10 +29,12 @@ class CompileHandler(MakeHandler):
 
     def set(self, coverage: bool = False, fix_files: List[AnyStr] = None, inst_files: List[AnyStr] = None,
             cpp_files: bool = False, backup: str = None, link: bool = False, replace: bool = False, tag: str = None,
-            save_temps: bool = False, write_build_args: str = None, compiler_trail_path: bool = False):
+            save_temps: bool = False, write_build_args: str = None, compiler_trail_path: bool = False,
+            jobs: int = 0):
         super().set(replace=replace, tag=tag, save_temps=save_temps, write_build_args=write_build_args,
                     compiler_trail_path=compiler_trail_path)
         self.coverage = coverage
+        self.jobs = jobs if jobs and jobs > 0 else os.cpu_count()
         self.inst_files = inst_files
         self.cpp_files = cpp_files
         self.backup = backup
@@ -49,6 +59,9 @@ class CompileHandler(MakeHandler):
             if self.backup:
                 self._backup_manifest_files(working)
 
+            if self.launcher:
+                self._count_cache(working)
+
             if self.link:
                 self.link_executable(working)
             elif self.inst_files:
@@ -56,6 +69,10 @@ class CompileHandler(MakeHandler):
             else:
                 self.app.log.info(f"Compiling {instance.name}.")
                 super().run(instance, working)
+
+                if self.app.config.get_config('pristine_builds') and not self.error:
+                    self._seed_objects(instance, working)
+
                 super().__call__(cmd_str=f"cmake --build . --target {instance.name}",
                                  msg=f"Building {working.source.name}\n", raise_err=True,
                                  cmd_cwd=str(working.build_root))
@@ -66,12 +83,145 @@ class CompileHandler(MakeHandler):
         except CommandError as ce:
             self.error = str(ce)
         finally:
+            if STATS_ENV in self.env:
+                self._cache_stats()
+
             self.unset()
 
     def unset(self):
         if self.coverage and 'COVERAGE' in self.env:
             del self.env['COVERAGE']
 
+    def _seed_objects(self, instance: Instance, working: WorkingPaths):
+        """
+            Seeds the first build of the instance with the objects of the pristine build of the challenge, leaving out
+            the objects that depend on the manifest files, per their dependency files, which are then the only ones
+            compiled before the link.
+        """
+        objects = f"{instance.name}/CMakeFiles/*.dir/**/*.o"
+
+        if self.coverage:
+            # the objects record the paths where their coverage data is written
+            return
+
+        if any(working.build_root.glob(objects)):
+            return
+
+        try:
+            pristine = self._pristine_build(instance.name)
+        except CommandError as ce:
+            self.app.log.warning(f"Pristine build of {instance.name} failed, building all the objects: {ce}")
+            return
+
+        corpus = str(Path(self.app.config.get_config('corpus')))
+        pristine_source = Path(corpus, working.source.relative_to(working.root))
+        manifest = {pristine_source / line.split(':')[0]
+                    for line in (working.source / 'manifest').read_text().splitlines() if line}
+        # the dependencies that expand __FILE__, e.g. with assert, embed the path of the pristine build in the objects
+        embeds_path = {}
+        seeded = 0
+
+        for obj in pristine.glob(objects):
+            rel_obj = obj.relative_to(pristine)
+            # the path of the source within the object directory of the target
+            source = working.source / str(Path(*rel_obj.parts[3:]))[:-len('.o')]
+            dep_file = obj.with_name(obj.name + '.d')
+
+            if not source.exists() or not dep_file.exists():
+                continue
+
+            dependencies = _dependencies(dep_file, cwd=pristine / instance.name)
+
+            if manifest & dependencies:
+                # the translation unit includes a source that is repaired
+                continue
+
+            for dependency in dependencies - embeds_path.keys():
+                embeds_path[dependency] = not dependency.exists() or b'__FILE__' in dependency.read_bytes()
+
+            if any(embeds_path[dependency] for dependency in dependencies):
+                continue
+
+            dest = working.build_root / rel_obj
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            reflink_or_copy(obj, dest)
+            # the dependencies on the sources of the instance
+            dest.with_name(dest.name + '.d').write_text(dep_file.read_text().replace(corpus, str(working.root)))
+            seeded += 1
+
+        self.app.log.info(f"Reused {seeded} objects of the pristine build of {instance.name}.")
+
+    def _pristine_build(self, name: str) -> Path:
+        """
+            Returns the build directory of the pristine build of the challenge for the current build profile, which
+            is the cmake options and the environment of the configure, building it if needed.
+        """
+        sha = hashlib.sha256()
+        sha.update(self.cmake_opts.encode())
+
+        for var in CONFIGURE_ENV:
+            sha.update(f"{var}={self.env.get(var)}\0".encode())
+
+        profile = Path(self.app.config.get_config('pristine_builds'), name, sha.hexdigest()[:16])
+        profile.mkdir(parents=True, exist_ok=True)
+        build = profile / 'build'
+
+        # instances compiled concurrently wait for the same pristine build
+        with (profile / '.lock').open(mode='w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            if not (profile / '.built').exists():
+                build.mkdir(exist_ok=True)
+                corpus = self.app.config.get_config('corpus')
+
+                # neither the outcome nor the object cache stats of the pristine build are those of the compile
+                cache_env = {var: self.env.pop(var) for var in [STATS_ENV, BASE_ENV] if var in self.env}
+
+                try:
+                    for cmd_str in [f"cmake {self.cmake_opts} {corpus} -DCB_PATH:STRING={name}",
+                                    f"cmake --build . --target {name}"]:
+                        cmd_data = self.execute(cmd_str=cmd_str, cmd_cwd=str(build),
+                                                msg=f"Building pristine {name}.\n")
+
+                        if cmd_data.return_code:
+                            raise CommandError(cmd_data.error)
+                finally:
+                    self.env.update(cache_env)
+
+                (profile / '.built').touch()
+
+        return build
+
+    def _count_cache(self, working: WorkingPaths):
+        """
+            Points the launcher to a file where it counts the hits and misses of the object cache.
+        """
+        fd, stats = tempfile.mkstemp(prefix='cgcrepair-cc-', suffix='.stats')
+        os.close(fd)
+        self.env[STATS_ENV] = stats
+        # the paths of the instance are not part of the keys of the objects
+        self.env[BASE_ENV] = str(working.root)
+
+    def _cache_stats(self):
+        stats = Path(self.env.pop(STATS_ENV))
+        del self.env[BASE_ENV]
+        self.cache_hits, self.cache_misses = read_stats(stats)
+        stats.unlink()
+
+        if self.cache_hits or self.cache_misses:
+            self.app.log.info(f"Object cache: {self.cache_hits} hits, {self.cache_misses} misses.")
+
+        self._evict_objects()
+
+    def _evict_objects(self):
+        cache_size = self.app.config.get_config('object_cache_size')
+
+        if cache_size:
+            evicted = ObjectCache(self.env[CACHE_ENV]).evict(cache_size * 1024 * 1024)
+
+            if evicted:
+                self.app.log.info(f"Evicted {evicted} objects from the object cache.")
+
     def _backup_manifest_files(self, working: WorkingPaths):
         backup_path = Path(self.backup)
         manifest_file = working.source / 'manifest'
@@ -100,8 +250,7 @@ class CompileHandler(MakeHandler):
 
         if mapping:
             # creating object files
-            for source_file, cpp_file in mapping.items():
-                self.build_file(source_file, cpp_file, working=working)
+            self.build_files(mapping, working=working)
 
             # links objects into executable
             self.link_executable(working)
@@ -109,7 +258,36 @@ class CompileHandler(MakeHandler):
         else:
             self.error = f"Could not map fix files {self.fixes} with source files."
 
-    def build_file(self, source_file: str, cpp_file: str, working: WorkingPaths):
+    def build_files(self, mapping: Dict[str, str], working: WorkingPaths):
+        """
+            Creates the object files concurrently, at most 'jobs' at a time. The first compile error cancels the
+            compiles not yet started and is raised once the running ones finish.
+        """
+        commands = [command for command in (self.build_file(source_file, cpp_file)
+                                             for source_file, cpp_file in mapping.items()) if command]
+
+        if not commands:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.jobs, len(commands))) as executor:
+            futures = {executor.submit(self.execute, cmd_str=compile_command, cmd_cwd=str(working.build),
+                                       msg=f"Creating object file for {cpp_file}.\n"): cpp_file
+                       for cpp_file, compile_command in commands}
+
+            for future in as_completed(futures):
+                cmd_data = future.result()
+
+                if cmd_data.return_code:
+                    for pending in futures:
+                        pending.cancel()
+
+                    self.return_code = cmd_data.return_code
+                    raise CommandError(cmd_data.error or f"Could not create object file for {futures[future]}.")
+
+    def build_file(self, source_file: str, cpp_file: str) -> Union[Tuple[str, str], None]:
+        """
+            Returns the file to compile in place of the source file and its compile command.
+        """
         if self.fixes:
             cpp_file = self.fixes.pop(0)
 
@@ -118,10 +296,106 @@ class CompileHandler(MakeHandler):
 
         if Path(cpp_file).exists():
             compile_command = self.get_compile_command(source_file, cpp_file)
-            super().__call__(cmd_str=compile_command, msg=f"Creating object file for {cpp_file}.\n",
-                             cmd_cwd=str(working.build), raise_err=True)
+
+            if compile_command is None:
+                return None
+
+            if self.launcher:
+                compile_command = f"{self.launcher} {compile_command}"
+
+            return cpp_file, compile_command
         else:
             self.error = f"File {cpp_file} not found."
+            return None
+
+    def build_population(self, instance: Instance, working: WorkingPaths, manifest_file: str, candidates: List[str],
+                         out_dir: Path) -> List[CompileOutcome]:
+        """
+            Compiles the candidate versions of the manifest file concurrently, with its compile command, and links the
+            binary of each candidate against the objects of the instance in its own directory under the output
+            directory. Returns the compile outcome of each candidate, in the order of the candidates.
+        """
+        self.load_commands(working)
+        link_file = working.cmake / Path("link.txt")
+
+        if manifest_file not in self.compile_commands:
+            raise ValueError(f"Could not find the compile command of {manifest_file}.")
+
+        if not link_file.exists():
+            raise ValueError(f"Link file {link_file} not found, compile the instance first.")
+
+        link_commands = link_file.read_text().splitlines()
+        out_dir.mkdir(parents=True, exist_ok=True)
+        self.app.log.info(f"Compiling {len(candidates)} candidates of {manifest_file} with {self.jobs} jobs.")
+
+        if self.launcher:
+            # the paths of the instance are not part of the keys of the objects
+            self.env[BASE_ENV] = str(working.root)
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.jobs, len(candidates))) as executor:
+                futures = [executor.submit(self._build_candidate, instance, working, manifest_file, candidate,
+                                           out_dir / str(i), link_commands) for i, candidate in enumerate(candidates)]
+                outcomes = [future.result() for future in futures]
+        finally:
+            if self.launcher:
+                del self.env[BASE_ENV]
+                self._evict_objects()
+
+        self.app.db.add_all(outcomes)
+
+        return outcomes
+
+    def _build_candidate(self, instance: Instance, working: WorkingPaths, manifest_file: str, candidate: str,
+                         candidate_dir: Path, link_commands: List[str]) -> CompileOutcome:
+        outcome = CompileOutcome(instance_id=instance.id, tag='population', exit_status=0)
+        candidate_dir.mkdir(exist_ok=True)
+
+        if not Path(candidate).exists():
+            outcome.error = f"File {candidate} not found."
+            outcome.exit_status = 1
+            return outcome
+
+        source_file = str(self.compile_commands[manifest_file].file)
+        args = [str(Path(candidate).resolve()) if arg == source_file else arg
+                for arg in shlex.split(self.get_compile_command(manifest_file))]
+        obj = args[args.index('-o') + 1]
+        # the output and the dependency file of the object are placed in the directory of the candidate
+        candidate_obj = str(candidate_dir / Path(obj).name)
+        compile_command = shlex.join(arg.replace(obj, candidate_obj) for arg in args)
+        stats = None
+
+        if self.launcher:
+            # the hits and misses of the candidate are counted apart from the other candidates
+            fd, stats = tempfile.mkstemp(prefix='cgcrepair-cc-', suffix='.stats')
+            os.close(fd)
+            compile_command = f"{STATS_ENV}={shlex.quote(stats)} {self.launcher} {compile_command}"
+
+        commands = [(compile_command, f"Creating object file for {candidate}.\n")]
+
+        for link_command in link_commands:
+            args = shlex.split(link_command)
+
+            if '-o' in args:
+                args[args.index('-o') + 1] = str(candidate_dir / working.binary.name)
+
+            commands.append((shlex.join(candidate_obj if arg == obj else arg for arg in args),
+                             f"Linking {candidate} into {candidate_dir}.\n"))
+
+        try:
+            for cmd_str, msg in commands:
+                cmd_data = self.execute(cmd_str=cmd_str, cmd_cwd=str(working.build), msg=msg)
+
+                if cmd_data.return_code:
+                    outcome.error = cmd_data.error
+                    outcome.exit_status = cmd_data.return_code
+                    break
+        finally:
+            if stats:
+                outcome.cache_hits, outcome.cache_misses = read_stats(Path(stats))
+                os.unlink(stats)
+
+        return outcome
 
     def link_executable(self, working: WorkingPaths):
         self.app.log.info(f"Linking into executable {working.source.name}.")
@@ -198,3 +472,13 @@ class CompileHandler(MakeHandler):
         self.app.log.info(f"Built POVs for {challenge.name}.")
 
         shutil.rmtree(str(build_dir))
+
+
+def _dependencies(dep_file: Path, cwd: Path) -> Set[Path]:
+    """
+        Returns the files a Makefile dependency file lists as the prerequisites of the object.
+    """
+    prerequisites = dep_file.read_text().replace('\\\n', ' ').split(':', 1)[-1].split()
+
+    # the phony targets of the headers (-MP) end with a colon
+    return {Path(os.path.normpath(cwd / prerequisite.rstrip(':'))) for prerequisite in prerequisites}
@@ -1,6 +1,8 @@
 import traceback
 import platform
-from json import loads
+import hashlib
+import shutil
+from json import loads, dumps
 from pathlib import Path
 
 from cgcrepair.core.corpus.manifest import Manifest
@@ -8,6 +10,13 @@ from cgcrepair.core.exc import CommandError
 from cgcrepair.core.handlers.commands import CommandsHandler
 from cgcrepair.core.handlers.database import CompileOutcome, Instance
 from cgcrepair.utils.data import WorkingPaths, CompileCommand
+from cgcrepair.utils.object_cache import LAUNCHER, CACHE_ENV
+
+# environment read by the CMakeLists.txt files and the compilers at configure time
+CONFIGURE_ENV = ['CC', 'CXX', 'CMAKE_OPTS', 'CMAKE_C_FLAGS', 'M32', 'COVERAGE', 'SAVETEMPS', 'PATCH', 'LINK',
+                 'FORKSERVER', 'CGC_INCLUDE_DIR', 'CGC_LIB_DIR']
+# fingerprint of the inputs of the last successful configure, kept in the build directory
+CONFIGURE_FINGERPRINT = '.configure_fingerprint'
 
 
 class MakeHandler(CommandsHandler):
@@ -18,6 +27,8 @@ class MakeHandler(CommandsHandler):
         super().__init__(**kwargs)
         self.compile_commands = {}
         self.cmake_opts = ""
+        self.launcher = None
+        self.cache_hits, self.cache_misses = None, None
 
     def set(self, replace: bool = False, save_temps: bool = False, write_build_args: str = None, tag: str = None,
             compiler_trail_path: bool = False):
@@ -61,6 +72,17 @@ class MakeHandler(CommandsHandler):
 
         self.cmake_opts = f"{self.cmake_opts} {c_compiler} {asm_compiler} {cxx_compiler} {build_link}"
 
+        object_cache = self.app.config.get_config('object_cache')
+        self.launcher = shutil.which(LAUNCHER) if object_cache else None
+
+        if self.launcher:
+            # the compilers are launched through the object cache
+            self.env[CACHE_ENV] = object_cache
+            self.cmake_opts = f"{self.cmake_opts} -DCMAKE_C_COMPILER_LAUNCHER={self.launcher} " \
+                              f"-DCMAKE_CXX_COMPILER_LAUNCHER={self.launcher}"
+        elif object_cache:
+            self.app.log.warning(f"Compiler launcher {LAUNCHER} not found, the object cache is disabled.")
+
     def _make(self, source: Path, name: str, dest: Path):
         if not dest.exists():
             self.app.log.info("Creating build directory")
@@ -71,7 +93,7 @@ class MakeHandler(CommandsHandler):
 
     def run(self, instance: Instance, working: WorkingPaths):
         try:
-            self._make(working.root, instance.name, working.build_root)
+            self._configure(instance, working)
 
             if self.write_build_args:
                 self._write_build_args(working)
@@ -81,6 +103,47 @@ class MakeHandler(CommandsHandler):
         finally:
             self.unset()
 
+    def _configure(self, instance: Instance, working: WorkingPaths):
+        """
+            Configures the build files, unless the inputs of the configure match the last successful one.
+        """
+        fingerprint = self._configure_fingerprint(instance.name, working)
+        fingerprint_file = working.build_root / CONFIGURE_FINGERPRINT
+
+        if (working.build_root / 'CMakeCache.txt').exists() and fingerprint_file.exists() and \
+                fingerprint_file.read_text() == fingerprint:
+            self.app.log.info("Build files up to date, skipping the configure.")
+            return
+
+        if fingerprint_file.exists():
+            # a failed configure leaves the build files in an unknown state
+            fingerprint_file.unlink()
+
+        self._make(working.root, instance.name, working.build_root)
+        fingerprint_file.write_text(fingerprint)
+
+    def _configure_fingerprint(self, name: str, working: WorkingPaths) -> str:
+        """
+            Hashes the inputs of the configure: the options, the environment, the CMake files and the names of the
+            source files, which CMake collects when configuring.
+        """
+        sha = hashlib.sha256()
+        sha.update(dumps({'opts': self.cmake_opts, 'name': name,
+                          'env': {var: self.env.get(var) for var in CONFIGURE_ENV}}, sort_keys=True).encode())
+
+        for path in sorted(working.source.rglob('*')):
+            if not path.is_file():
+                continue
+
+            sha.update(str(path.relative_to(working.root)).encode())
+
+            if path.name == 'CMakeLists.txt' or path.suffix == '.cmake':
+                sha.update(path.read_bytes())
+
+        sha.update((working.root / 'CMakeLists.txt').read_bytes())
+
+        return sha.hexdigest()
+
     def unset(self):
         if self.save_temps:
             del self.env["SAVETEMPS"]
@@ -126,6 +189,8 @@ class MakeHandler(CommandsHandler):
         outcome.instance_id = instance.id
         outcome.error = self.error
         outcome.exit_status = self.return_code
+        outcome.cache_hits = self.cache_hits
+        outcome.cache_misses = self.cache_misses
 
         if self.tag:
             outcome.tag = self.tag
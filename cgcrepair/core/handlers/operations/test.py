@@ -1,18 +1,36 @@
 import os
+import math
+import asyncio
+import psutil
+import json
+import hashlib
+import time
+import socket
+import tempfile
 import binascii
 import fileinput
 
 from pathlib import Path
+from typing import List, Dict, Tuple, Set, Union
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from cgcrepair.core.handlers.database import TestOutcome, Instance
-from cgcrepair.utils.parse.test_result import get_outcome, get_pids_sig, pov_signals
-from cgcrepair.utils.helpers import kill_by_name, collect_files
+from cgcrepair.core.data.results import CommandData
+from cgcrepair.core.handlers.database import TestOutcome, Instance, OutcomeWriter, SKIPPED
+from cgcrepair.utils.parse.test_result import TestResultParser, BatchResultParser, pov_signals
+from cgcrepair.utils.parse.coverage import covered_lines, changed_lines, same_source
+from cgcrepair.utils.helpers import kill_by_pid, kill_group, collect_files, percentile
 
 from cgcrepair.core.exc import CommandError
 from cgcrepair.core.handlers.commands import CommandsHandler
 from cgcrepair.core.tests import Tests
 from cgcrepair.utils.data import Test, WorkingPaths, ChallengePaths
 
+# prefix of the line that ends the response of the replay service (tools/cb-replay-server.py)
+REPLAY_END = '# cb-replay-server: '
+# prefix of the lines with the result records in the response of the replay service
+REPLAY_RESULT = '# cb-replay-result: '
+
 
 class TestHandler(CommandsHandler):
     class Meta:
@@ -23,7 +41,10 @@ class TestHandler(CommandsHandler):
         self.failed = False
 
     def set(self, timeout: int = None, neg_pov: bool = False, print_ids: bool = False, only_numbers: bool = False,
-            print_class: bool = False, out_file: str = None, write_fail: bool = True, prefix: str = None):
+            print_class: bool = False, out_file: str = None, write_fail: bool = True, prefix: str = None,
+            jobs: int = 1, batch: int = 1, adaptive_timeout: bool = False, fail_fast: bool = False,
+            cache: bool = False, seed: str = None, impact: bool = False, fix_files: List[str] = None,
+            concurrent: int = 1):
         super().set()
         self.timeout = timeout
         self.neg_pov = neg_pov
@@ -33,58 +54,661 @@ class TestHandler(CommandsHandler):
         self.out_file = out_file
         self.write_fail = write_fail
         self.prefix = prefix
+        self.jobs = jobs if jobs and jobs > 1 else 1
+        self.batch = batch if batch and batch > 1 else 1
+        self.adaptive_timeout = adaptive_timeout
+        self.fail_fast = fail_fast
+        self.cache = cache
+        self.seed = seed
+        self.impact = impact
+        self.fix_files = fix_files
+        self.concurrent = concurrent
+        self.replay_socket = self.app.config.get_config('replay_socket')
 
     def run(self, instance: Instance, working: WorkingPaths, challenge_paths: ChallengePaths, tests: Tests):
+        executions = None
+        writer = None
+
         try:
             self.app.log.info(f"Running {len(tests)} tests.")
-            timeout = self.get_timeout()
+            timeouts = self.get_timeouts(tests, challenge=challenge_paths.name)
+            self._check_replay_service(working)
+
+            if self.jobs > 1 and getattr(self.app.pargs, 'cov_out_dir', None):
+                # coverage files of concurrent tests would be mixed together
+                self.app.log.warning("Coverage is collected per test, running tests sequentially.")
+                self.jobs = 1
+
+            if self.seed is not None and len(self.seed) != 96:
+                raise ValueError("The seed must have 96 hex characters.")
+
+            if self.cache and getattr(self.app.pargs, 'cov_out_dir', None):
+                self.app.log.warning("Coverage is collected per test, the cache of results is disabled.")
+                self.cache = False
+
+            if self.impact and not self.fix_files:
+                raise ValueError("The selection of tests by impact requires the fix files.")
+
+            if self.impact and getattr(self.app.pargs, 'cov_out_dir', None):
+                self.app.log.warning("Coverage is collected for every test, the selection of tests by impact is "
+                                     "disabled.")
+                self.impact = False
+
+            self.concurrent = self.get_concurrency(challenge=challenge_paths.name)
+
+            ordered = self._order(tests, challenge=challenge_paths.name)
+            cache_keys = self._cache_keys(ordered, working) if self.cache else {}
+            executed = set()
+            # names of the executed tests whose outcomes are cached once inserted
+            to_cache = set()
+            # lines executed by the tests, indexed with their outcomes once inserted
+            indexed = {}
+            # the coverage index and the results carried forward refer to the source of the instance with the digest
+            digest = _source_digest(working) if self.impact or getattr(self.app.pargs, 'cov_out_dir', None) else None
+            test_outcome_handler = self.app.handler.get('database', 'test_outcome', setup=True)
+            writer = test_outcome_handler.writer(
+                batch_size=self.app.config.get_config('outcome_batch') or 0,
+                on_flush=lambda outcomes: self._inserted(outcomes, instance, cache_keys, to_cache,
+                                                         challenge=challenge_paths.name, indexed=indexed,
+                                                         digest=digest))
+
+            for test, test_outcome in self._cached(ordered, cache_keys):
+                self._reuse(test_outcome, instance, writer)
+                executed.add(test.name)
+
+                if self.fail_fast and self.failed:
+                    break
+
+            if self.impact and not (self.fail_fast and self.failed):
+                unaffected = self._unaffected([test for test in ordered if test.name not in executed], working,
+                                              challenge=challenge_paths.name, digest=digest)
+
+                for test, test_outcome in unaffected:
+                    self._reuse(test_outcome, instance, writer)
+                    executed.add(test.name)
+
+                    if self.fail_fast and self.failed:
+                        break
+
+            if self.fail_fast and self.failed:
+                pending = []
+            else:
+                pending = [test for test in ordered if test.name not in executed]
+
+            executions = self._execute(pending, working, timeouts)
 
-            for test in tests.values():
-                cmd_str = self._cmd_str(test, working=working)
-                super().__call__(cmd_str=' '.join(cmd_str), cmd_cwd=str(self.app.config.get_config('tools')),
-                                 timeout=timeout, raise_err=False, exit_err=False,
-                                 msg=f"Testing {test.name} on {test.file.name}\n")
+            for test, cmd_data, parser in executions:
+                if cmd_data.error is not None:
+                    self.error = cmd_data.error
 
-                test_outcome = self._process_result(test, challenge_name=challenge_paths.name)
-                self.coverage(working)
+                if cmd_data.return_code:
+                    self.return_code = cmd_data.return_code
+
+                test_outcome = self._process_result(test, cmd_data, parser, challenge_name=challenge_paths.name)
+                covered = self.coverage(working, test=test, challenge=challenge_paths.name)
+
+                if covered:
+                    indexed[test.name] = covered
                 test_outcome.instance_id = instance.id
                 test_outcome.co_id = instance.pointer
-                test_outcome.duration = round(self.duration, 3)
-                if test_outcome.duration > timeout and test_outcome.error and test_outcome.exit_status != 0:
+                test_outcome.duration = round(cmd_data.duration, 3)
+                if test_outcome.duration > timeouts[test.name] and test_outcome.error and test_outcome.exit_status != 0:
                     test_outcome.error = "Test timed out"
-                test_outcome.exit_status = self.return_code
-                t_id = self.app.db.add(test_outcome)
-                self.app.log.debug(f"Inserted 'test outcome' with id {t_id} for instance {instance.id}.")
+                test_outcome.exit_status = cmd_data.return_code
+
+                if self.cache and not cmd_data.timeout:
+                    # timeouts depend on the load of the machine
+                    to_cache.add(test.name)
+
+                writer.add(test_outcome)
+
                 self._process_flags(test_outcome)
+                executed.add(test.name)
+
+                if self.fail_fast and self.failed:
+                    self.app.log.info(f"Test {test.name} failed, skipping the remaining tests.")
+                    break
+
+            self._skip([test for test in ordered if test.name not in executed], instance, writer)
+            writer.flush()
+
+            cache_size = self.app.config.get_config('test_cache_size')
+
+            if self.cache and cache_size:
+                evicted = self.app.handler.get('database', 'test_cache', setup=True).evict(cache_size)
+
+                if evicted:
+                    self.app.log.info(f"Evicted {evicted} results from the cache.")
 
         except (ValueError, CommandError) as e:
             self.error = str(e)
         finally:
+            if executions:
+                # stops the pending tests
+                executions.close()
+            if writer:
+                # keeps the outcomes of the tests that ran before a failure
+                writer.flush()
             self.unset()
 
     def unset(self):
         super().unset()
 
+    def _order(self, tests: Tests, challenge: str) -> List[Test]:
+        """
+            Returns the tests in the order they run. With fail fast, the tests most likely to fail run first, based on
+            their previous runs, and POVs run before polls with the same rate.
+        """
+        if not self.fail_fast:
+            return list(tests.values())
+
+        test_outcome_handler = self.app.handler.get('database', 'test_outcome', setup=True)
+        fail_rates = test_outcome_handler.fail_rates(challenge, neg_pov=self.neg_pov)
+        # tests without previous runs have the rate of the smoothing, 1/2
+        return sorted(tests.values(), key=lambda t: (-fail_rates.get(t.name, 0.5), not t.is_pov))
+
+    def _cache_keys(self, tests: List[Test], working: WorkingPaths) -> Dict[str, str]:
+        """
+            Returns the key of the cached result of each test, the hash of the binaries, the test file and the seed.
+        """
+        binaries = hashlib.sha256()
+
+        for name in sorted(working.get_binaries()):
+            binaries.update(name.encode())
+            binaries.update(_file_hash(working.build / name).encode())
+
+        digest = binaries.hexdigest()
+
+        return {test.name: hashlib.sha256(f"{digest}:{_file_hash(test.file)}:{self.seed or ''}".encode()).hexdigest()
+                for test in tests}
+
+    def _cached(self, tests: List[Test], cache_keys: Dict[str, str]):
+        """
+            Yields the tests with a cached result together with a copy of the cached outcome.
+        """
+        if not cache_keys:
+            return
+
+        test_cache_handler = self.app.handler.get('database', 'test_cache', setup=True)
+
+        for test in tests:
+            cached = test_cache_handler.get(cache_keys[test.name])
+
+            if cached:
+                self.app.log.info(f"Using the cached result of {test.name} (test outcome {cached.id}).")
+                yield test, TestOutcome(name=cached.name, is_pov=cached.is_pov, result=cached.result,
+                                        status=cached.status, total=cached.total, passed=cached.passed,
+                                        failed=cached.failed, error=cached.error, exit_status=cached.exit_status,
+                                        sig=cached.sig, duration=cached.duration, cpu_user=cached.cpu_user,
+                                        cpu_sys=cached.cpu_sys, max_rss=cached.max_rss, procs=cached.procs)
+
+    def _unaffected(self, tests: List[Test], working: WorkingPaths, challenge: str, digest: str):
+        """
+            Yields the polls that do not execute the lines changed by the fix files, according to the coverage index,
+            together with the outcome of the run that indexed them. Only the index of the source of the instance, the
+            baseline the fix files are compared with, is considered. POVs and polls without coverage are never
+            yielded.
+        """
+        test_coverage_handler = self.app.handler.get('database', 'test_coverage', setup=True)
+        index = test_coverage_handler.get(challenge, digest=digest)
+
+        if not index:
+            self.app.log.warning(f"No coverage index for the source of {challenge} in the instance, running all "
+                                 f"tests.")
+            return
+
+        changes = self._changes(working)
+
+        if changes is None:
+            return
+
+        baseline = test_coverage_handler.outcomes(challenge, digest=digest)
+        carried = 0
+
+        for test in tests:
+            if test.is_pov or test.name not in index or test.name not in baseline:
+                continue
+
+            affected = any(lines & covered for file, covered in index[test.name].items()
+                           for source_file, lines in changes.items() if same_source(file, source_file))
+
+            if not affected:
+                carried += 1
+                yield test, baseline[test.name]
+
+        self.app.log.info(f"Carried forward the results of {carried} polls not affected by the fix.")
+
+    def _changes(self, working: WorkingPaths) -> Union[Dict[str, Set[int]], None]:
+        """
+            Returns the lines changed by each fix file, mapped by the manifest file it changes. Returns None when a fix
+            file can not be mapped or changes a header, the lines it affects are unknown.
+        """
+        manifest_files = _manifest_files(working)
+        changes = {}
+
+        for fix_file in self.fix_files:
+            source_file = _manifest_file(Path(fix_file), working, manifest_files)
+
+            if source_file is None or source_file.endswith('.h'):
+                self.app.log.warning(f"Could not tell the lines affected by {fix_file}, running all tests.")
+                return None
+
+            changes[source_file] = changed_lines(working.source / source_file, Path(fix_file))
+
+        return changes
+
+    def _reuse(self, test_outcome: TestOutcome, instance: Instance, writer: OutcomeWriter):
+        """
+            Records the outcome of a test that did not run because its result is already known, marked as reused.
+        """
+        test_outcome.reused = True
+        test_outcome.instance_id = instance.id
+        test_outcome.co_id = instance.pointer
+        writer.add(test_outcome)
+        self._process_flags(test_outcome)
+
+    def _skip(self, tests: List[Test], instance: Instance, writer: OutcomeWriter):
+        """
+            Records the tests that did not run.
+        """
+        for test in tests:
+            test_outcome = TestOutcome(name=test.name, is_pov=test.is_pov, result=False, status=SKIPPED, total=1,
+                                       passed=0, exit_status=0, duration=0, instance_id=instance.id,
+                                       co_id=instance.pointer)
+            writer.add(test_outcome)
+
+        if tests:
+            self.app.log.info(f"Recorded {len(tests)} skipped tests for instance {instance.id}.")
+
+    def _inserted(self, outcomes: List[TestOutcome], instance: Instance, cache_keys: Dict[str, str],
+                  to_cache: set, challenge: str, indexed: Dict[str, Dict[str, Set[int]]], digest: str):
+        """
+            Caches the results and indexes the coverage of the inserted outcomes, which have their ids only after being
+            inserted.
+        """
+        self.app.log.debug(f"Inserted {len(outcomes)} 'test outcomes' for instance {instance.id}.")
+        entries = {cache_keys[outcome.name]: outcome.id for outcome in outcomes if outcome.name in to_cache}
+
+        if entries:
+            self.app.handler.get('database', 'test_cache', setup=True).put_all(entries)
+
+        for outcome in outcomes:
+            if outcome.name in indexed:
+                self.app.handler.get('database', 'test_coverage', setup=True).put(
+                    challenge, outcome.name, indexed.pop(outcome.name), digest=digest, to_id=outcome.id)
+
+    def _execute(self, tests: List[Test], working: WorkingPaths, timeouts: Dict[str, int]):
+        """
+            Yields the tests with the results of their execution and the parser of their output, in the same order as
+            they are in the set of tests.
+        """
+        units = self._units(tests)
+
+        if self.jobs == 1:
+            for unit in units:
+                for test, (cmd_data, parser) in zip(unit, self._test(unit, working, timeouts)):
+                    yield test, cmd_data, parser
+        elif self.app.config.get_config('engine') == 'asyncio':
+            self.app.log.info(f"Running tests with {self.jobs} jobs in the event loop.")
+            yield from self._execute_async(units, working, timeouts)
+        else:
+            self.app.log.info(f"Running tests with {self.jobs} jobs.")
+
+            # the process groups of the running units
+            groups = set()
+
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [(unit, executor.submit(self._test, unit, working, timeouts, groups)) for unit in units]
+
+                try:
+                    for unit, future in futures:
+                        for test, (cmd_data, parser) in zip(unit, future.result()):
+                            yield test, cmd_data, parser
+                finally:
+                    # when the consumer stops early, the tests not yet started are dropped and the running ones are
+                    # killed, as the cancelled coroutines of the event loop are
+                    for _, future in futures:
+                        future.cancel()
+
+                    while groups:
+                        kill_group(groups.pop())
+
+    def _execute_async(self, units: List[List[Test]], working: WorkingPaths, timeouts: Dict[str, int]):
+        """
+            Runs the units as coroutines in an event loop, at most 'jobs' at a time, and yields their results in order.
+            The loop runs while waiting for the next unit in order, which keeps all the running units going.
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        semaphore = asyncio.Semaphore(self.jobs)
+        tasks = [(unit, loop.create_task(self._test_async(unit, working, timeouts, semaphore))) for unit in units]
+
+        try:
+            for unit, task in tasks:
+                for test, (cmd_data, parser) in zip(unit, loop.run_until_complete(task)):
+                    yield test, cmd_data, parser
+        finally:
+            # when the consumer stops early, the running tests are killed and the others dropped
+            for _, task in tasks:
+                task.cancel()
+
+            loop.run_until_complete(asyncio.gather(*[task for _, task in tasks], return_exceptions=True))
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def _units(self, tests: List[Test]) -> List[List[Test]]:
+        """
+            Groups consecutive tests of the same kind into units of at most 'batch' tests, each unit is executed by a
+            single cb-test invocation.
+        """
+        units = []
+
+        for test in tests:
+            if units and len(units[-1]) < self.batch and units[-1][0].is_pov == test.is_pov:
+                units[-1].append(test)
+            else:
+                units.append([test])
+
+        return units
+
+    @staticmethod
+    def _unit_args(unit: List[Test], timeouts: Dict[str, int]) -> Tuple[int, str, TestResultParser]:
+        """
+            Returns the timeout, the message and the parser of the output of a unit.
+        """
+        # cb-test takes a single timeout for all the tests in the unit
+        timeout = max(timeouts[test.name] for test in unit)
+
+        if len(unit) == 1:
+            msg = f"Testing {unit[0].name} on {unit[0].file.name}\n"
+        else:
+            msg = f"Testing {unit[0].name} to {unit[-1].name} in batch of {len(unit)} tests\n"
+
+        # the output is fed to the parser as it streams in, the result records of cb-test override its fields
+        parser = TestResultParser() if len(unit) == 1 else BatchResultParser()
+
+        return timeout, msg, parser
+
+    def _unit_results(self, unit: List[Test], cmd_data: CommandData,
+                      parser: TestResultParser) -> List[Tuple[CommandData, TestResultParser]]:
+        if not self.replay_socket and kill_group(cmd_data.pgid):
+            # tear down the CBs left behind by the test, the group holds only the processes of this test
+            self.app.log.info(f"Killed the processes left in group {cmd_data.pgid}.")
+
+        if len(unit) == 1:
+            return [(cmd_data, parser)]
+
+        return self._split(unit, cmd_data, parser)
+
+    async def _test_async(self, unit: List[Test], working: WorkingPaths, timeouts: Dict[str, int],
+                          semaphore: asyncio.Semaphore) -> List[Tuple[CommandData, TestResultParser]]:
+        timeout, msg, parser = self._unit_args(unit, timeouts)
+
+        async with semaphore:
+            if self.replay_socket:
+                cmd_str = self._cmd_str(unit, working=working, timeout=timeout)
+                cmd_data = await self._replay_async(cmd_str, timeout=timeout * len(unit), msg=msg, parser=parser)
+            else:
+                with tempfile.TemporaryFile(mode='w+') as results:
+                    cmd_str = self._cmd_str(unit, working=working, timeout=timeout, result_fd=results.fileno())
+                    cmd_data = await self.execute_async(cmd_str=' '.join(cmd_str),
+                                                        cmd_cwd=str(self.app.config.get_config('tools')),
+                                                        timeout=timeout * len(unit), msg=msg, group=True,
+                                                        parser=parser, pass_fds=(results.fileno(),))
+                    results.seek(0)
+
+                    for line in results:
+                        parser.record(json.loads(line))
+
+        return self._unit_results(unit, cmd_data, parser)
+
+    def _test(self, unit: List[Test], working: WorkingPaths, timeouts: Dict[str, int],
+              groups: set = None) -> List[Tuple[CommandData, TestResultParser]]:
+        timeout, msg, parser = self._unit_args(unit, timeouts)
+
+        if self.replay_socket:
+            cmd_str = self._cmd_str(unit, working=working, timeout=timeout)
+            cmd_data = self._replay(cmd_str, timeout=timeout * len(unit), msg=msg, parser=parser)
+        else:
+            # cb-test writes a result record of each test to the file
+            with tempfile.TemporaryFile(mode='w+') as results:
+                cmd_str = self._cmd_str(unit, working=working, timeout=timeout, result_fd=results.fileno())
+                cmd_data = self.execute(cmd_str=' '.join(cmd_str), cmd_cwd=str(self.app.config.get_config('tools')),
+                                        timeout=timeout * len(unit), msg=msg, group=True, parser=parser,
+                                        pass_fds=(results.fileno(),), groups=groups)
+                results.seek(0)
+
+                for line in results:
+                    parser.record(json.loads(line))
+
+        return self._unit_results(unit, cmd_data, parser)
+
+    def _check_replay_service(self, working: WorkingPaths):
+        """
+            Uses the replay service when it is listening, the service supports only single binary challenges.
+        """
+        if not self.replay_socket:
+            return
+
+        if Path(self.replay_socket).exists() and len(working.get_binaries()) == 1:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.replay_socket)
+                self.app.log.info(f"Running tests through the replay service at {self.replay_socket}.")
+                return
+            except OSError as oe:
+                self.app.log.warning(f"Replay service not available: {oe}")
+
+        self.replay_socket = None
+
+    def _replay(self, cmd_str: List[str], timeout: int, msg: str, parser) -> CommandData:
+        """
+            Sends the cb-test arguments to the replay service and feeds the output and the result records it streams
+            back to the parser.
+        """
+        self.app.log.info(msg)
+        cmd_data = CommandData(args=cmd_str)
+        status = None
+        cmd_data.start = datetime.now()
+        time_start = time.time()
+
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(self.replay_socket)
+                sock.sendall(self._replay_request(cmd_str))
+
+                for line in sock.makefile(mode='rb'):
+                    status = self._replay_line(line.decode(), parser)
+
+                    if status is not None:
+                        break
+        except socket.timeout:
+            cmd_data.error = "Command timed out"
+            cmd_data.timeout = True
+            cmd_data.return_code = -3
+        except OSError as oe:
+            cmd_data.error = f"Replay service failed: {oe}"
+            cmd_data.return_code = -1
+
+        self._replay_status(cmd_data, status, time_start)
+
+        return cmd_data
+
+    async def _replay_async(self, cmd_str: List[str], timeout: int, msg: str, parser) -> CommandData:
+        """
+            Asyncio counterpart of '_replay', the timeout applies to each read as the timeout of the socket does.
+        """
+        self.app.log.info(msg)
+        cmd_data = CommandData(args=cmd_str)
+        status = None
+        cmd_data.start = datetime.now()
+        time_start = time.time()
+        writer = None
+
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.replay_socket, limit=2 ** 20),
+                                                    timeout=timeout)
+            writer.write(self._replay_request(cmd_str))
+            await writer.drain()
+
+            while status is None:
+                line = await asyncio.wait_for(reader.readline(), timeout=timeout)
+
+                if not line:
+                    break
+
+                status = self._replay_line(line.decode(), parser)
+        except asyncio.TimeoutError:
+            cmd_data.error = "Command timed out"
+            cmd_data.timeout = True
+            cmd_data.return_code = -3
+        except (OSError, ValueError) as e:
+            cmd_data.error = f"Replay service failed: {e}"
+            cmd_data.return_code = -1
+        finally:
+            if writer:
+                writer.close()
+
+        self._replay_status(cmd_data, status, time_start)
+
+        return cmd_data
+
+    def _replay_request(self, cmd_str: List[str]) -> bytes:
+        request = {'args': cmd_str[2:], 'env': self.env, 'cwd': str(self.app.config.get_config('tools')),
+                   'results': True}
+
+        return (json.dumps(request) + '\n').encode()
+
+    def _replay_line(self, decoded: str, parser) -> Union[dict, None]:
+        """
+            Handles a line of the response of the replay service, returns the exit status at the end of the response.
+        """
+        if decoded.startswith(REPLAY_END):
+            return json.loads(decoded[len(REPLAY_END):])
+
+        if decoded.startswith(REPLAY_RESULT):
+            parser.record(json.loads(decoded[len(REPLAY_RESULT):]))
+            return None
+
+        parser.feed(decoded)
+
+        if self.app.pargs.verbose:
+            self.app.log.debug(decoded)
+
+        return None
+
+    def _replay_status(self, cmd_data: CommandData, status: Union[dict, None], time_start: float):
+        cmd_data.duration = time.time() - time_start
+        cmd_data.end = datetime.now()
+
+        if status and status['exit']:
+            cmd_data.return_code = status['exit']
+            cmd_data.error = status['error'] or ''
+
+            if status['error']:
+                self.app.log.error(status['error'])
+
+    @staticmethod
+    def _split(unit: List[Test], cmd_data: CommandData,
+               parser: BatchResultParser) -> List[Tuple[CommandData, TestResultParser]]:
+        """
+            Splits the results of a batch into the results of each test. The wall time of the batch is shared by its
+            tests in proportion to the durations cb-test reports for them, evenly when any is missing, so the
+            durations of batched and single tests both include the overhead of cb-test.
+        """
+        results = []
+        test_parsers = [parser.get(str(test.file)) for test in unit]
+        reported = [test_parser.duration for test_parser in test_parsers]
+
+        if None in reported or not sum(reported):
+            reported = [1] * len(unit)
+
+        for test, test_parser, share in zip(unit, test_parsers, reported):
+            test_data = CommandData(args=cmd_data.args, pid=cmd_data.pid, pgid=cmd_data.pgid, start=cmd_data.start,
+                                    end=cmd_data.end, timeout=cmd_data.timeout)
+            test_data.duration = cmd_data.duration * share / sum(reported)
+
+            if test_parser.passed != 1:
+                test_data.error = cmd_data.error
+                test_data.return_code = cmd_data.return_code
+
+            results.append((test_data, test_parser))
+
+        return results
+
     def get_timeout(self):
         # TODO: add/remove margin for execution
         margin = self.app.config.get_config('margin')
-        # TODO: add duration of tests from sanity
-        # sanity_handler = self.app.handler.get('database', 'sanity', setup=True)
-        # duration = sanity_handler.get(challenge, test)
-        # if duration:
-        #     return duration + margin
+
         if self.timeout:
             return self.timeout + margin
 
         return self.app.config.get_config('tests_timeout') + margin
 
-    def _process_result(self, test: Test, challenge_name: str):
-        pids, sig = get_pids_sig(self.output)
-        test_outcome = get_outcome(self.output, test=test, sig=sig)
+    def get_concurrency(self, challenge: str) -> int:
+        """
+            Returns the number of polls each cb-test invocation throws concurrently. Without a concurrency, it is sized
+            from the CPUs left for each job and the memory available for each poll, up to the size of the batch. The
+            challenges in the config overrides never run with a higher concurrency than their override.
+        """
+        concurrent = self.concurrent
+
+        if not concurrent or concurrent < 1:
+            cpus = max(1, (os.cpu_count() or 1) // self.jobs)
+            poll_memory = (self.app.config.get_config('concurrent_memory') or 256) * 1024 * 1024
+            by_memory = max(1, psutil.virtual_memory().available // (poll_memory * self.jobs))
+            concurrent = max(1, min(cpus, by_memory, self.batch))
+            self.app.log.info(f"Throwing up to {concurrent} polls concurrently.")
+
+        overrides = self.app.config.get_config('concurrent_overrides') or {}
+
+        if challenge in overrides and overrides[challenge] < concurrent:
+            self.app.log.info(f"Concurrency limited to {overrides[challenge]} for {challenge} by the config.")
+            concurrent = max(1, overrides[challenge])
+
+        return concurrent
+
+    def get_timeouts(self, tests: Tests, challenge: str) -> Dict[str, int]:
+        """
+            Returns the timeout of each test. With adaptive timeouts, the tests with enough previous runs get a
+            percentile of their durations times the multiplier, bounded by the minimum and the global timeout.
+        """
+        timeout = self.get_timeout()
+        timeouts = {test.name: timeout for test in tests.values()}
+
+        if not self.adaptive_timeout:
+            return timeouts
+
+        test_outcome_handler = self.app.handler.get('database', 'test_outcome', setup=True)
+        durations = test_outcome_handler.durations(challenge)
+        rank = self.app.config.get_config('timeout_percentile') or 95
+        multiplier = self.app.config.get_config('timeout_multiplier') or 3
+        min_samples = self.app.config.get_config('timeout_min_samples') or 5
+        min_timeout = self.app.config.get_config('timeout_min') or 2
+
+        for name in timeouts:
+            samples = durations.get(name, [])
+
+            if len(samples) < min_samples:
+                continue
 
-        if self.error and sig not in pov_signals:
+            adaptive = math.ceil(percentile(samples, rank) * multiplier)
+            timeouts[name] = min(timeout, max(min_timeout, adaptive))
+
+        adapted = [name for name in timeouts if timeouts[name] < timeout]
+        self.app.log.info(f"Adaptive timeouts for {len(adapted)} of {len(timeouts)} tests.")
+
+        return timeouts
+
+    def _process_result(self, test: Test, cmd_data: CommandData, parser: TestResultParser, challenge_name: str):
+        pids, sig = parser.pids_sig()
+        test_outcome = parser.outcome(test=test, sig=sig)
+
+        if cmd_data.pgid is None and cmd_data.error and sig not in pov_signals:
+            # tests run by the replay service are not in a group of their own, only their pids can be killed
             self.app.log.warning(f"Killing {challenge_name} process.")
-            killed_pids = kill_by_name(process_name=challenge_name, target_pids=pids)
+            killed_pids = kill_by_pid(pids)
 
             if killed_pids:
                 self.app.log.info(f"Killed processes {killed_pids}.")
@@ -92,48 +716,71 @@ class TestHandler(CommandsHandler):
         return test_outcome
 
     def _process_flags(self, test_outcome: TestOutcome):
+        # the outcome is queued for the database, its result stays the raw one
+        result = test_outcome.result
+
         if test_outcome.is_pov and self.neg_pov:
             # Invert negative test's result
-            test_outcome.result = not test_outcome.result
+            result = not result
 
-            if not test_outcome.result:
+            if not result:
                 self.failed = True
 
-        if self.print_ids and test_outcome.result:
+        if self.print_ids and result:
             if self.only_numbers:
                 print(test_outcome.name[1:])
             else:
                 print(test_outcome.name)
         if self.print_class:
-            print("PASS" if test_outcome.result else 'FAIL')
+            print("PASS" if result else 'FAIL')
 
         if self.out_file is not None:
-            self.write_result(test_outcome)
+            self.write_result(test_outcome, result)
 
-        if not test_outcome.result or test_outcome.error:
+        if not result or test_outcome.error:
             if not test_outcome.is_pov:
                 self.failed = True
             elif not self.neg_pov:
                 self.failed = True
 
-    def _cmd_str(self, test: Test, working: WorkingPaths):
+    def _cmd_str(self, tests: List[Test], working: WorkingPaths, timeout: int, result_fd: int = None):
         bin_names = working.get_binaries()
-
-        # use timeout or duration from sanity check
-        timeout = self.get_timeout()
         python2 = self.app.config.get_config('python2')
-        cb_cmd = [python2, str(self.app.tools.test), '--directory', str(working.build), '--xml', str(test.file),
-                  '--concurrent', '1', '--debug', '--timeout', str(timeout), '--negotiate_seed', '--cb'] + bin_names
+        cb_cmd = [python2, str(self.app.tools.test), '--directory', str(working.build), '--xml'] + \
+                 [str(test.file) for test in tests] + \
+                 ['--concurrent', str(self.concurrent), '--timeout', str(timeout), '--negotiate_seed', '--cb'] + \
+                 bin_names
+
+        # the results are read from the result records, the debug logs are only for the user
+        if self.app.pargs.verbose:
+            cb_cmd += ['--debug']
+
+        if result_fd is not None:
+            cb_cmd += ['--result_fd', str(result_fd)]
+
+        if len(tests) > 1:
+            cb_cmd += ['--split_results']
 
-        if test.is_pov:
-            cb_cmd += ['--cores_path', self.app.config.get_config("cores"), '--should_core']
+        replay_cache = self.app.config.get_config('replay_cache')
+
+        if replay_cache:
+            cb_cmd += ['--cache_dir', replay_cache]
+
+        if tests[0].is_pov:
+            if self.app.config.get_config('crash_capture'):
+                # only the signal and registers of the crash, recorded by libcgc
+                cb_cmd += ['--crash_path', self.app.config.get_config("cores"), '--should_core']
+            else:
+                cb_cmd += ['--cores_path', self.app.config.get_config("cores"), '--should_core']
             # double check
-            seed = binascii.b2a_hex(os.urandom(48))
-            cb_cmd += ['--pov_seed', seed.decode()]
+            seed = self.seed if self.seed else binascii.b2a_hex(os.urandom(48)).decode()
+            cb_cmd += ['--pov_seed', seed]
+        elif self.seed:
+            cb_cmd += ['--cb_seed', self.seed]
 
         return cb_cmd
 
-    def write_result(self, test_outcome: TestOutcome):
+    def write_result(self, test_outcome: TestOutcome, result: bool):
         if self.prefix:
             out_file = Path(self.prefix, self.out_file)
         else:
@@ -142,16 +789,19 @@ class TestHandler(CommandsHandler):
         if not self.write_fail and not test_outcome.passed:
             return
         with out_file.open(mode="a") as of:
-            of.write(f"{test_outcome.name} {test_outcome.result}\n")
+            of.write(f"{test_outcome.name} {result}\n")
 
-    def coverage(self, working: WorkingPaths):
+    def coverage(self, working: WorkingPaths, test: Test, challenge: str) -> Union[Dict[str, Set[int]], None]:
         # copies coverage file generated to coverage dir with respective name
+        # and returns the lines executed by the test, indexed once its outcome is inserted
 
         if self.app.pargs.cov_out_dir:
             out_dir = Path(self.app.pargs.cov_out_dir)
             cov_dir = Path(self.app.pargs.cov_dir) if self.app.pargs.cov_dir else working.cmake
+            suffix = self.app.pargs.cov_suffix
+            covered = {}
 
-            for file in collect_files(cov_dir, self.app.pargs.cov_suffix):
+            for file in collect_files(cov_dir, suffix):
                 in_file = cov_dir / file
                 out_path = out_dir / file.parent
                 out_file = out_path / Path(file.name)
@@ -160,6 +810,13 @@ class TestHandler(CommandsHandler):
                     out_path.mkdir(parents=True, exist_ok=True)
 
                 if in_file.exists():
+                    if covered is not None:
+                        try:
+                            covered[str(file)[:-len(suffix)]] = covered_lines(in_file)
+                        except ValueError as ve:
+                            self.app.log.warning(f"Could not index the coverage of {test.name}: {ve}")
+                            covered = None
+
                     concat_file = Path(file.stem + self.app.pargs.rename_suffix) if self.app.pargs.rename_suffix else Path(out_file)
                     concat_file = out_path / concat_file
 
@@ -168,3 +825,58 @@ class TestHandler(CommandsHandler):
                             fout.write(line)
                     # delete the file generated
                     in_file.unlink()
+
+            if covered is None:
+                # the test is left out of the index and runs for every fix
+                self.app.handler.get('database', 'test_coverage', setup=True).put(challenge, test.name, {})
+
+            return covered
+
+        return None
+
+
+def _manifest_files(working: WorkingPaths) -> List[str]:
+    with (working.source / 'manifest').open(mode="r") as mf:
+        return [line.split(":")[0] for line in mf.read().splitlines() if line]
+
+
+def _manifest_file(fix_file: Path, working: WorkingPaths, manifest_files: List[str]) -> Union[str, None]:
+    """
+        Returns the manifest file the fix file is a version of, by their paths relative to the source: the path of the
+        fix file within the source of the instance, or the path the fix file ends with when it is outside of it.
+        Returns None when no manifest file, or more than one, matches.
+    """
+    fix_file = Path(os.path.normpath(fix_file.absolute()))
+    paths = {mf: Path(os.path.normpath(mf)).parts for mf in manifest_files}
+
+    try:
+        relative = fix_file.relative_to(os.path.normpath(working.source.absolute())).parts
+        matches = [mf for mf, parts in paths.items() if parts == relative]
+    except ValueError:
+        matches = [mf for mf, parts in paths.items() if fix_file.parts[-len(parts):] == parts]
+
+    return matches[0] if len(matches) == 1 else None
+
+
+def _source_digest(working: WorkingPaths) -> str:
+    """
+        Returns the hash of the manifest files of the source of the instance.
+    """
+    digest = hashlib.sha256()
+
+    for manifest_file in sorted(_manifest_files(working)):
+        source_file = working.source / manifest_file
+        digest.update(manifest_file.encode())
+        digest.update(_file_hash(source_file).encode() if source_file.exists() else b'')
+
+    return digest.hexdigest()
+
+
+def _file_hash(path: Path) -> str:
+    file_hash = hashlib.sha256()
+
+    with path.open(mode='rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
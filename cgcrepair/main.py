@@ -18,7 +18,7 @@ from cgcrepair.core.handlers.operations.checkout import CheckoutHandler
 from cgcrepair.core.handlers.operations.genpolls import GenPollsHandler
 from cgcrepair.core.handlers.operations.genpovs import GenPOVsHandler
 from cgcrepair.core.handlers.tasks.sanity import SanityHandler
-from cgcrepair.core.handlers.database import InstanceHandler
+from cgcrepair.core.handlers.database import InstanceHandler, TestOutcomeHandler, TestCacheHandler, TestCoverageHandler
 from cgcrepair.core.handlers.operations.make import MakeHandler
 from cgcrepair.core.handlers.operations.compile import CompileHandler
 from cgcrepair.core.handlers.operations.test import TestHandler
@@ -64,7 +64,8 @@ class CGCRepair(App):
             Base, YamlConfigurations, CommandsHandler, CorpusHandler,
             Corpus, CheckoutHandler, GenPollsHandler, GenPOVsHandler,
             Instance, MakeHandler, CompileHandler, TestHandler, VulnerabilityHandler,
-            InstanceHandler, Database, MetadataHandler, Task, SanityHandler, RunnerHandler
+            InstanceHandler, Database, MetadataHandler, Task, SanityHandler, RunnerHandler, TestOutcomeHandler,
+            TestCacheHandler, TestCoverageHandler
         ]
 
 
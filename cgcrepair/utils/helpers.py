@@ -1,11 +1,17 @@
 import os
-import sys
+import math
+import fcntl
+import shutil
+import signal
 from pathlib import Path
 
 import psutil
 
 from typing import List
 
+# ioctl that clones a file on copy-on-write file systems (linux/fs.h)
+FICLONE = 0x40049409
+
 
 def kill_by_pid(pids: List[str] = None):
     killed_pids = []
@@ -13,7 +19,6 @@ def kill_by_pid(pids: List[str] = None):
         Kills processes from a supplied list of pids 
     """
     for pid in pids:
-        print(int(pid))
         if psutil.pid_exists(int(pid)):
             os.system(f"kill -9 {pid}")
             killed_pids.append(pid)
@@ -21,29 +26,26 @@ def kill_by_pid(pids: List[str] = None):
     return killed_pids
 
 
-def kill_by_name(process_name: str,  target_pids: List[str] = None):
+def kill_group(pgid: int) -> bool:
     """
-    Gets a list of all the PIDs of a all the running process whose name contains the given string process_name and
-    kills the process. If target_pids list is supplied, it checks the pids for the process with the list
+        Kills the processes in the process group, returns whether any process was left in the group
     """
-    # based on https://thispointer.com/python-check-if-a-process-is-running-by-name-and-find-its-process-id-pid/
-    # Iterate over the all the running process
-    killed_pids = []
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+        return True
+    except ProcessLookupError:
+        return False
 
-    for proc in psutil.process_iter():
-        try:
-            proc_info = proc.as_dict(attrs=['pid', 'name', 'create_time'])
-            # Check if process name contains the given name string.
-            if process_name in proc_info['name']:
-                if psutil.pid_exists(proc_info['pid']):
-                    if target_pids and proc_info['pid'] not in target_pids:
-                        continue
-                    os.system(f"kill -9 {proc_info['pid']}")
-                    killed_pids.append(proc_info['pid'])
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess) as pe:
-            sys.stderr.write(str(pe))
 
-    return killed_pids
+def percentile(values: List[float], rank: float) -> float:
+    """
+        Returns the value at the given percentile (0-100) of the values, interpolating between the closest ranks.
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * rank / 100
+    lower, upper = math.floor(position), math.ceil(position)
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
 
 
 def collect_files(path: Path, target_suffix: str) -> List[Path]:
@@ -62,3 +64,18 @@ def collect_files(path: Path, target_suffix: str) -> List[Path]:
             recurse_walk(folder, Path(folder.name), target_suffix)
 
     return coverage_files
+
+
+def reflink_or_copy(src: Path, dst: Path):
+    """
+        Clones the file where the file system supports reflinks and copies it otherwise, either way the destination is
+        a new file with its own modification time.
+    """
+    try:
+        with src.open(mode='rb') as sf, dst.open(mode='wb') as df:
+            fcntl.ioctl(df.fileno(), FICLONE, sf.fileno())
+        return
+    except OSError:
+        pass
+
+    shutil.copyfile(str(src), str(dst))
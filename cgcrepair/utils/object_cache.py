@@ -0,0 +1,202 @@
+"""
+    Object cache shared by the instances of the challenges. The 'cgcrepair-cc' launcher wraps the compiler in the
+    compile commands: the key of a translation unit is the hash of the compiler, of its flags and of its preprocessed
+    source, and the object is copied from the cache on a hit. The paths of the instance are taken out of the flags and
+    of the line markers of the preprocessed source, so the instances of the same challenge share the objects. The
+    objects are compiled with the paths of the instance mapped out of their debug info, which would otherwise point the
+    other instances at the sources of the first one.
+"""
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from pathlib import Path
+from typing import List, Union, Tuple
+
+# environment of the launcher: directory of the cache, root of the instance and file where hits and misses are counted
+CACHE_ENV = 'CGC_OBJECT_CACHE'
+BASE_ENV = 'CGC_OBJECT_CACHE_BASE'
+STATS_ENV = 'CGC_OBJECT_CACHE_STATS'
+LAUNCHER = 'cgcrepair-cc'
+HIT, MISS = 'hit', 'miss'
+
+# flags whose outputs, other than the object, are not cached
+UNCACHEABLE_FLAGS = {'-E', '-S', '-M', '-MM', '--coverage', '-fprofile-arcs', '-ftest-coverage'}
+
+
+class ObjectCache:
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    def key(self, compiler: str, flags: List[str], base: str = None) -> str:
+        """
+            Hashes the compiler, the flags and the preprocessed source of the compile command. The preprocessing
+            writes the dependency file of the object, if any, as the compilation would.
+        """
+        sha = hashlib.sha256()
+        compiler_path = shutil.which(compiler) or compiler
+        stat = os.stat(compiler_path)
+        sha.update(f"{os.path.realpath(compiler_path)} {stat.st_size} {stat.st_mtime}\0".encode())
+
+        for flag in _without_output(flags):
+            sha.update((flag.replace(base, '') if base else flag).encode() + b'\0')
+
+        preprocess = [compiler] + ['-E' if flag == '-c' else flag for flag in _without_output(flags)]
+        source = subprocess.run(preprocess, stdout=subprocess.PIPE, check=True).stdout
+
+        for line in source.splitlines(keepends=True):
+            if base and line.startswith(b'# '):
+                # line markers hold the paths of the instance
+                line = line.replace(base.encode(), b'')
+            sha.update(line)
+
+        return sha.hexdigest()
+
+    def entry(self, key: str) -> Path:
+        return self.path / key[:2] / f"{key}.o"
+
+    def get(self, key: str, obj: str) -> bool:
+        entry = self.entry(key)
+
+        try:
+            shutil.copyfile(str(entry), obj)
+        except OSError:
+            return False
+
+        # the modification time orders the entries for the eviction
+        os.utime(str(entry))
+
+        return True
+
+    def put(self, key: str, obj: str):
+        entry = self.entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(entry.parent), suffix='.tmp')
+        os.close(fd)
+
+        try:
+            shutil.copyfile(obj, tmp)
+            os.replace(tmp, str(entry))
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    def evict(self, size: int) -> int:
+        """
+            Deletes the least recently used objects above the size (bytes) of the cache, returns the number deleted.
+        """
+        entries = [(entry.stat(), entry) for entry in self.path.glob('*/*.o')]
+        total = sum(stat.st_size for stat, _ in entries)
+        evicted = 0
+
+        for stat, entry in sorted(entries, key=lambda e: e[0].st_mtime):
+            if total <= size:
+                break
+
+            entry.unlink()
+            total -= stat.st_size
+            evicted += 1
+
+        return evicted
+
+
+def read_stats(path: Path) -> Tuple[int, int]:
+    """
+        Returns the hits and misses counted by the launcher in the stats file.
+    """
+    if not path.exists():
+        return 0, 0
+
+    outcomes = path.read_text().split()
+
+    return outcomes.count(HIT), outcomes.count(MISS)
+
+
+def _without_output(flags: List[str]) -> List[str]:
+    without = []
+    skip = False
+
+    for flag in flags:
+        if skip:
+            skip = False
+        elif flag == '-o':
+            skip = True
+        else:
+            without.append(flag)
+
+    return without
+
+
+def _output(flags: List[str]) -> Union[str, None]:
+    """
+        Returns the object of a compile command that can be cached, None otherwise.
+    """
+    if '-c' not in flags or flags.count('-o') != 1 or flags[-1] == '-o':
+        return None
+
+    if any(flag in UNCACHEABLE_FLAGS or flag.startswith('-save-temps') for flag in flags):
+        return None
+
+    if ('-MD' in flags or '-MMD' in flags) and '-MF' not in flags:
+        # the default dependency file is named after the object
+        return None
+
+    return flags[flags.index('-o') + 1]
+
+
+def _count(outcome: str):
+    stats = os.environ.get(STATS_ENV)
+
+    if stats:
+        with open(stats, 'a') as stats_file:
+            stats_file.write(outcome + '\n')
+
+
+def main():
+    """
+        Compiler launcher: 'cgcrepair-cc <compiler> <flags>'.
+    """
+    if len(sys.argv) < 2:
+        sys.exit(f"usage: {LAUNCHER} <compiler> [flags]")
+
+    compiler, flags = sys.argv[1], sys.argv[2:]
+    cache_dir = os.environ.get(CACHE_ENV)
+    base = os.environ.get(BASE_ENV)
+    obj = _output(flags)
+
+    if not cache_dir or not obj:
+        os.execvp(compiler, sys.argv[1:])
+
+    if base:
+        # the debug info of the shared objects holds paths relative to the instance
+        flags = flags + [f"-fdebug-prefix-map={base}=."]
+
+    cache = ObjectCache(cache_dir)
+
+    try:
+        key = cache.key(compiler, flags, base=base)
+    except (OSError, subprocess.CalledProcessError):
+        # the compiler reports the error
+        os.execvp(compiler, sys.argv[1:])
+
+    if cache.get(key, obj):
+        _count(HIT)
+        sys.exit(0)
+
+    ret = subprocess.call([compiler] + flags)
+
+    if ret == 0:
+        try:
+            cache.put(key, obj)
+        except OSError:
+            pass
+
+    _count(MISS)
+    sys.exit(ret)
+
+
+if __name__ == '__main__':
+    main()
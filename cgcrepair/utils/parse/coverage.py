@@ -0,0 +1,67 @@
+import re
+import difflib
+
+from pathlib import Path
+from typing import Set
+
+line_pattern = re.compile(r"^\s*(\d+)(\s.*)?$")
+
+
+def covered_lines(path: Path) -> Set[int]:
+    """
+        Parses out the lines executed from a coverage file (.path), which the instrumented source writes as it runs.
+        Each line of the file holds the number of an executed line of the source file, optionally followed by other
+        fields separated by whitespace, and repeats for every execution of the line, e.g.
+
+            12
+            13
+            12
+
+        Blank lines are ignored. Raises ValueError on a line in any other format, e.g. the 'count: line: source'
+        lines of gcov, whose first number is not a line number.
+    """
+    lines = set()
+
+    with path.open(mode="r") as cov_file:
+        for number, line in enumerate(cov_file, start=1):
+            if not line.strip():
+                continue
+
+            match = line_pattern.match(line)
+
+            if not match:
+                raise ValueError(f"Unexpected format in line {number} of the coverage file {path}: {line.strip()}")
+
+            lines.add(int(match.group(1)))
+
+    return lines
+
+
+def changed_lines(original: Path, changed: Path) -> Set[int]:
+    """
+        Returns the lines of the original file that the changed file replaces or deletes, and the lines around the
+        insertions
+    """
+    with original.open(mode="r") as of, changed.open(mode="r") as cf:
+        matcher = difflib.SequenceMatcher(None, of.readlines(), cf.readlines(), autojunk=False)
+
+    lines = set()
+
+    for tag, i1, i2, _, _ in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+
+        if i1 == i2:
+            # inserted between lines i1 and i1 + 1
+            lines.update({i1, i1 + 1})
+        else:
+            lines.update(range(i1 + 1, i2 + 1))
+
+    return lines
+
+
+def same_source(coverage_file: str, source_file: str) -> bool:
+    """
+        Checks if the coverage file, relative to the coverage dir and without its suffix, is of the source file
+    """
+    return coverage_file.endswith(source_file) or coverage_file.endswith(str(Path(source_file).with_suffix('')))
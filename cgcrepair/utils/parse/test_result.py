@@ -1,105 +1,258 @@
 import re
 import signal
 
+from typing import Dict, List, Tuple
+
 from cgcrepair.core.handlers.database import TestOutcome
 from cgcrepair.utils.data import Test
 
-pid_pattern = "# pid (\d{4,7})"
-polls_failed_pattern = "# polls failed: (\d{1,4})"
-pid_debug_pattern = "# \[DEBUG\] pid: (\d{1,7}), sig: (\d{1,2})"
-pid_process_pattern = "# Process generated signal \(pid: (\d{1,7}), signal: (\d{1,2})\)"
-not_ok_pattern = "not ok - (.*)"
-not_ok_pattern_polls = "not ok (\d{1,4}) - (.*)"
-ok_pattern = "ok - (.*)"
+pid_pattern = re.compile(r"# pid (\d{4,7})")
+polls_failed_pattern = re.compile(r"# polls failed: (\d{1,4})")
+pid_debug_pattern = re.compile(r"# \[DEBUG\] pid: (\d{1,7}), sig: (\d{1,2})")
+pid_process_pattern = re.compile(r"# Process generated signal \(pid: (\d{1,7}), signal: (\d{1,2})\)")
+not_ok_pattern = re.compile(r"not ok - (.*)")
+not_ok_pattern_polls = re.compile(r"not ok (\d{1,4}) - (.*)")
+ok_pattern = re.compile(r"ok - (.*)")
+duration_pattern = re.compile(r"# duration: (\d+\.\d+)")
+rusage_pattern = re.compile(r"# \[RUSAGE\] pid: \d{1,7}, utime: (\d+\.\d+), stime: (\d+\.\d+), maxrss: (\d+)")
+begin_test_pattern = re.compile(r"# BEGIN TEST (.*)")
+end_test_pattern = re.compile(r"# END TEST (.*)")
 
 pov_signals = [signal.SIGSEGV, signal.SIGILL, signal.SIGBUS]
 
 
-def get_outcome(output: str, test: Test, sig: int):
+class TestResultParser:
     """
-        Parses out the number of passed and failed tests from cb-test output
+        Line by line parser of the output of cb-test, keeps only the fields of the outcome instead of the output. The
+        first match of each pattern is kept, as a search over the whole output would return.
     """
-    test_outcome = TestOutcome()
-    test_outcome.total = 1
-    test_outcome.passed = 0
-    test_outcome.name = test.name
-    test_outcome.is_pov = test.is_pov
-    test_outcome.failed = polls_failed(output)
-    test_outcome.sig = sig
-    ok = match_pattern(output, ok_pattern)
-    not_ok = match_pattern(output, not_ok_pattern)
-    not_ok_polls = re.findall(not_ok_pattern_polls, output)
-
-    if 'timed out' in output:
-        test_outcome.error = "Test timed out"
-        test_outcome.result = False
-
-    elif not test.is_pov and not_ok_polls:
-        test_outcome.error = "Polls failed"
-
-        for _, msg in not_ok_polls:
-            test_outcome.error += f"\n{msg}"
-
-        test_outcome.result = False
-    elif not test.is_pov and test_outcome.failed > 0:
-        test_outcome.error = "Polls failed"
-        test_outcome.result = False
-
-    # If the test failed to run, consider it failed
-    elif 'TOTAL TESTS' not in output:
-        test_outcome.error = "Test failed to run."
-        test_outcome.result = False
-
-    elif 'TOTAL TESTS: ' in output:
-        test_outcome.total = int(output.split('TOTAL TESTS: ')[1].split('\n')[0])
-        test_outcome.passed = int(output.split('TOTAL PASSED: ')[1].split('\n')[0])
-
-        if not_ok:
-            test_outcome.status = not_ok
-            test_outcome.result = False
-        elif ok:
-            test_outcome.status = ok
-            test_outcome.result = True
-    else:
-        test_outcome.error = "Unknown behavior"
-        test_outcome.result = False
 
-    return test_outcome
+    def __init__(self):
+        self.debug_pid_sig = None
+        self.process_pid_sig = None
+        self.pid = None
+        self.polls_failed = None
+        self.ok = None
+        self.not_ok = None
+        self.not_ok_polls = []
+        self.timed_out = False
+        self.has_total = False
+        self.total = None
+        self.passed = None
+        self.duration = None
+        # resources used by the CBs of the test
+        self.cpu_user = None
+        self.cpu_sys = None
+        self.max_rss = None
+        self.procs = None
+        self.recorded = False
 
+    def feed(self, line: str):
+        if self.recorded:
+            # the fields of the result record are final
+            return
+
+        if self.debug_pid_sig is None:
+            match = pid_debug_pattern.search(line)
+
+            if match:
+                self.debug_pid_sig = match.group(1), int(match.group(2))
+
+        if self.process_pid_sig is None:
+            match = pid_process_pattern.search(line)
+
+            if match:
+                self.process_pid_sig = match.group(1), int(match.group(2))
+
+        if self.pid is None:
+            match = pid_pattern.search(line)
+
+            if match:
+                self.pid = match.group(1)
+
+        if self.polls_failed is None:
+            match = polls_failed_pattern.search(line)
+
+            if match:
+                self.polls_failed = int(match.group(1))
+
+        if self.ok is None:
+            match = ok_pattern.search(line)
+
+            if match:
+                self.ok = match.group(1)
+
+        if self.not_ok is None:
+            match = not_ok_pattern.search(line)
+
+            if match:
+                self.not_ok = match.group(1)
+
+        match = not_ok_pattern_polls.search(line)
+
+        if match:
+            self.not_ok_polls.append(match.groups())
+
+        if self.duration is None:
+            match = duration_pattern.search(line)
+
+            if match:
+                self.duration = float(match.group(1))
+
+        match = rusage_pattern.search(line)
 
-def get_pids_sig(output: str):
-    match = re.search(pid_debug_pattern, output)
-    match2 = re.search(pid_process_pattern, output)
-    pids = []
-    sig = 0
-
-    if match:
-        pids.append(match.group(1))
-        sig = int(match.group(2))
-    elif match2:
-        pids.append(match2.group(1))
-        sig = int(match2.group(2))
-    else:
-        match = re.search(pid_pattern, output)
         if match:
-            pids.append(match.group(1))
+            self.cpu_user = (self.cpu_user or 0) + float(match.group(1))
+            self.cpu_sys = (self.cpu_sys or 0) + float(match.group(2))
+            self.max_rss = max(self.max_rss or 0, int(match.group(3)))
+            self.procs = (self.procs or 0) + 1
+
+        if 'timed out' in line:
+            self.timed_out = True
+
+        if 'TOTAL TESTS' in line:
+            self.has_total = True
+
+        if self.total is None and 'TOTAL TESTS: ' in line:
+            self.total = int(line.split('TOTAL TESTS: ', 1)[1].rstrip('\r\n'))
+
+        if self.passed is None and 'TOTAL PASSED: ' in line:
+            self.passed = int(line.split('TOTAL PASSED: ', 1)[1].rstrip('\r\n'))
+
+    def record(self, data: dict):
+        """
+            Takes the fields from the result record cb-test writes to its result fd, which override the ones parsed
+            from the output, before and after the record
+        """
+        self.recorded = True
+        self.debug_pid_sig = (str(data['pid']), data['sig']) if data.get('pid') else None
+        self.process_pid_sig = None
+        self.pid = None
+        self.polls_failed = data['polls_failed']
+        self.ok = data['ok']
+        self.not_ok = data['not_ok']
+        self.not_ok_polls = [(None, msg) for msg in data['failed_polls']]
+        self.timed_out = data['timed_out']
+        self.has_total = True
+        self.total = data['total']
+        self.passed = data['passed']
+        self.duration = data['duration']
+        self.cpu_user = data.get('cpu_user')
+        self.cpu_sys = data.get('cpu_sys')
+        self.max_rss = data.get('max_rss')
+        self.procs = data.get('procs')
+
+    def pids_sig(self) -> Tuple[List[str], int]:
+        if self.debug_pid_sig:
+            return [self.debug_pid_sig[0]], self.debug_pid_sig[1]
+
+        if self.process_pid_sig:
+            return [self.process_pid_sig[0]], self.process_pid_sig[1]
 
-    return pids, sig
+        if self.pid:
+            return [self.pid], 0
 
+        return [], 0
 
-def polls_failed(output: str):
-    match = re.search(polls_failed_pattern, output)
+    def outcome(self, test: Test, sig: int) -> TestOutcome:
+        """
+            Builds the outcome of the test with the number of passed and failed tests
+        """
+        test_outcome = TestOutcome()
+        test_outcome.total = 1
+        test_outcome.passed = 0
+        test_outcome.name = test.name
+        test_outcome.is_pov = test.is_pov
+        test_outcome.failed = self.polls_failed or 0
+        test_outcome.sig = sig
+        test_outcome.cpu_user = self.cpu_user
+        test_outcome.cpu_sys = self.cpu_sys
+        test_outcome.max_rss = self.max_rss
+        test_outcome.procs = self.procs
 
-    if match:
-        return int(match.group(1))
+        if self.timed_out:
+            test_outcome.error = "Test timed out"
+            test_outcome.result = False
+
+        elif not test.is_pov and self.not_ok_polls:
+            test_outcome.error = "Polls failed"
+
+            for _, msg in self.not_ok_polls:
+                test_outcome.error += f"\n{msg}"
+
+            test_outcome.result = False
+        elif not test.is_pov and test_outcome.failed > 0:
+            test_outcome.error = "Polls failed"
+            test_outcome.result = False
+
+        # If the test failed to run, consider it failed
+        elif not self.has_total:
+            test_outcome.error = "Test failed to run."
+            test_outcome.result = False
+
+        elif self.total is not None:
+            test_outcome.total = self.total
+            test_outcome.passed = self.passed
+
+            if self.not_ok:
+                test_outcome.status = self.not_ok
+                test_outcome.result = False
+            elif self.ok:
+                test_outcome.status = self.ok
+                test_outcome.result = True
+        else:
+            test_outcome.error = "Unknown behavior"
+            test_outcome.result = False
+
+        return test_outcome
+
+
+class BatchResultParser:
+    """
+        Line by line parser of the output of a cb-test run with several tests (--split_results), routes the lines of
+        each test to a parser of its own, mapped by the test file.
+    """
+
+    def __init__(self):
+        self.parsers: Dict[str, TestResultParser] = {}
+        self.current = None
+
+    def feed(self, line: str):
+        if self.current is None:
+            match = begin_test_pattern.match(line)
+
+            if match:
+                # the record of the test may come before its output
+                self.current = self.parsers.setdefault(match.group(1).strip(), TestResultParser())
+        elif end_test_pattern.match(line):
+            self.current = None
+        else:
+            self.current.feed(line)
+
+    def record(self, data: dict):
+        self.parsers.setdefault(data['file'], TestResultParser()).record(data)
+
+    def get(self, file: str) -> TestResultParser:
+        # tests without output, e.g. when the batch timed out before reaching them
+        return self.parsers.get(file, TestResultParser())
+
+
+def parse(output: str) -> TestResultParser:
+    parser = TestResultParser()
 
-    return 0
+    for line in output.splitlines():
+        parser.feed(line)
 
+    return parser
 
-def match_pattern(output: str, pattern: str):
-    match = re.search(pattern, output)
 
-    if match:
-        return match.group(1)
+def get_outcome(output: str, test: Test, sig: int):
+    """
+        Parses out the number of passed and failed tests from cb-test output
+    """
+    return parse(output).outcome(test, sig)
+
+
+def get_pids_sig(output: str):
+    return parse(output).pids_sig()
 
-    return None
@@ -0,0 +1,125 @@
+/*
+ * Lightweight crash capture for challenge binaries.
+ *
+ * When CGC_CRASH_DIR is set, the fatal signals of the POVs are caught on an
+ * alternate stack and the signal, the faulting address and the registers of
+ * the binary are written to CGC_CRASH_DIR/crash.<pid>, replacing the core
+ * dumps that are otherwise read with gdb (see tools/challenge_runner.py). The
+ * binary then dies from the same signal, so the exit status is unchanged.
+ *
+ * The record is two lines, "<signal> <faulting address>" and the registers as
+ * "<name>:<hex value>" separated by spaces.
+ */
+
+#define _GNU_SOURCE
+
+// the CBs are built with -Derrno=__cgc_errno
+#undef errno
+#include <errno.h>
+#include <fcntl.h>
+#include <signal.h>
+#include <stdlib.h>
+#include <string.h>
+#include <ucontext.h>
+#include <unistd.h>
+
+#if defined(__linux__) && (defined(__x86_64__) || defined(__i386__))
+
+#define CRASH_DIR_SIZE 4000
+#define CRASH_STACK_SIZE 65536
+
+static char cgc_crash_dir[CRASH_DIR_SIZE];
+static char cgc_crash_stack[CRASH_STACK_SIZE];
+static const int cgc_crash_signals[] = {SIGSEGV, SIGILL, SIGBUS, SIGFPE};
+
+#if defined(__x86_64__)
+static const char *cgc_reg_names[] = {"rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi", "rip"};
+static const int cgc_reg_ids[] = {REG_RAX, REG_RCX, REG_RDX, REG_RBX, REG_RSP, REG_RBP, REG_RSI, REG_RDI, REG_RIP};
+#else
+static const char *cgc_reg_names[] = {"eax", "ecx", "edx", "ebx", "esp", "ebp", "esi", "edi", "eip"};
+static const int cgc_reg_ids[] = {REG_EAX, REG_ECX, REG_EDX, REG_EBX, REG_UESP, REG_EBP, REG_ESI, REG_EDI, REG_EIP};
+#endif
+
+/* Only async-signal-safe code below, the strings are built by hand */
+static size_t append_str(char *buf, size_t len, const char *str) {
+    while (*str)
+        buf[len++] = *str++;
+
+    return len;
+}
+
+static size_t append_num(char *buf, size_t len, unsigned long value, unsigned int base) {
+    char digits[sizeof(unsigned long) * 8];
+    size_t count = 0;
+
+    do {
+        digits[count++] = "0123456789abcdef"[value % base];
+        value /= base;
+    } while (value);
+
+    while (count)
+        buf[len++] = digits[--count];
+
+    return len;
+}
+
+static void cgc_crash_handler(int sig, siginfo_t *info, void *context) {
+    ucontext_t *uc = (ucontext_t *) context;
+    char path[CRASH_DIR_SIZE + 32], record[512];
+    size_t len = append_str(path, 0, cgc_crash_dir);
+
+    len = append_str(path, len, "/crash.");
+    len = append_num(path, len, (unsigned long) getpid(), 10);
+    path[len] = '\0';
+
+    int fd = open(path, O_WRONLY | O_CREAT | O_TRUNC, 0644);
+
+    if (fd >= 0) {
+        len = append_num(record, 0, (unsigned long) sig, 10);
+        len = append_str(record, len, " ");
+        len = append_num(record, len, (unsigned long) info->si_addr, 16);
+        len = append_str(record, len, "\n");
+
+        for (size_t i = 0; i < sizeof(cgc_reg_ids) / sizeof(cgc_reg_ids[0]); i++) {
+            len = append_str(record, len, i ? " " : "");
+            len = append_str(record, len, cgc_reg_names[i]);
+            len = append_str(record, len, ":");
+            len = append_num(record, len, (unsigned long) uc->uc_mcontext.gregs[cgc_reg_ids[i]], 16);
+        }
+
+        len = append_str(record, len, "\n");
+        write(fd, record, len);
+        close(fd);
+    }
+
+    // the handler was reset, the signal kills the binary once the handler returns
+    raise(sig);
+}
+
+static void __attribute__ ((constructor)) cgc_install_crash_handler(void) {
+    const char *crash_dir = getenv("CGC_CRASH_DIR");
+
+    if (crash_dir == NULL || *crash_dir == '\0' || strlen(crash_dir) >= CRASH_DIR_SIZE)
+        return;
+
+    strcpy(cgc_crash_dir, crash_dir);
+
+    stack_t stack;
+    stack.ss_sp = cgc_crash_stack;
+    stack.ss_size = sizeof(cgc_crash_stack);
+    stack.ss_flags = 0;
+
+    if (sigaltstack(&stack, NULL))
+        return;
+
+    struct sigaction action;
+    memset(&action, 0, sizeof(action));
+    action.sa_sigaction = cgc_crash_handler;
+    action.sa_flags = SA_SIGINFO | SA_ONSTACK | SA_RESETHAND;
+    sigemptyset(&action.sa_mask);
+
+    for (size_t i = 0; i < sizeof(cgc_crash_signals) / sizeof(cgc_crash_signals[0]); i++)
+        sigaction(cgc_crash_signals[i], &action, NULL);
+}
+
+#endif
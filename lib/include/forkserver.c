@@ -0,0 +1,150 @@
+/*
+ * Fork server for challenge binaries, linked in when the challenge is built
+ * with the FORKSERVER environment variable set (see cmake/CMakeLists.txt).
+ *
+ * main is wrapped (-Wl,--wrap=main). When CGC_FORKSERVER holds the fds of a
+ * control and a status pipe, the binary stops at main, after the dynamic
+ * loader and the constructors of libcgc ran, and forks a child for each
+ * request read from the control pipe. A request is a line with the hex seed
+ * ("-" for none) and the paths of the FIFOs for the stdin, stdout and stderr
+ * of the child. The child places the FIFOs over its standard fds, reseeds
+ * libcgc and runs main. The server answers each request with a line with the
+ * pid of the child and, once the child exits, a line with its wait status,
+ * user and system CPU time and peak RSS (see tools/challenge_runner.py).
+ */
+
+// the CBs are built with -Derrno=__cgc_errno
+#undef errno
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/resource.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+
+#define LINE_SIZE 4096
+
+int __real_main(int argc, char **argv, char **envp);
+void cgc_reseed_prng(void);
+
+static int read_line(int fd, char *buf, size_t size) {
+    size_t len = 0;
+
+    while (len + 1 < size) {
+        ssize_t ret = read(fd, buf + len, 1);
+
+        if (ret < 0 && errno == EINTR)
+            continue;
+        if (ret <= 0)
+            return -1;
+
+        if (buf[len] == '\n') {
+            buf[len] = '\0';
+            return (int) len;
+        }
+        len++;
+    }
+
+    return -1;
+}
+
+static int write_all(int fd, const char *buf, size_t len) {
+    while (len > 0) {
+        ssize_t ret = write(fd, buf, len);
+
+        if (ret < 0 && errno == EINTR)
+            continue;
+        if (ret <= 0)
+            return -1;
+
+        buf += ret;
+        len -= ret;
+    }
+
+    return 0;
+}
+
+static int open_std(const char *path, int flags, int target) {
+    int fd = open(path, flags);
+
+    if (fd < 0)
+        return -1;
+
+    if (fd != target) {
+        dup2(fd, target);
+        close(fd);
+    }
+
+    return 0;
+}
+
+/* Returns in the child, the server exits when the control pipe is closed */
+static void serve(int ctl_fd, int st_fd) {
+    char request[LINE_SIZE], reply[256];
+    char seed[256], in[LINE_SIZE], out[LINE_SIZE], err[LINE_SIZE];
+
+    for (;;) {
+        if (read_line(ctl_fd, request, sizeof(request)) < 0)
+            _exit(0);
+
+        if (sscanf(request, "%255s %4095s %4095s %4095s", seed, in, out, err) != 4)
+            _exit(1);
+
+        pid_t pid = fork();
+
+        if (pid < 0)
+            _exit(1);
+
+        if (pid == 0) {
+            close(ctl_fd);
+            close(st_fd);
+            unsetenv("CGC_FORKSERVER");
+
+            if (strcmp(seed, "-") != 0)
+                setenv("seed", seed, 1);
+            else
+                unsetenv("seed");
+
+            // stdin last, the runner takes an open stdin as the child being ready
+            if (open_std(out, O_WRONLY, STDOUT_FILENO) || open_std(err, O_WRONLY, STDERR_FILENO) ||
+                open_std(in, O_RDONLY, STDIN_FILENO))
+                _exit(1);
+
+            cgc_reseed_prng();
+            return;
+        }
+
+        int len = snprintf(reply, sizeof(reply), "%d\n", (int) pid);
+
+        if (write_all(st_fd, reply, len))
+            _exit(1);
+
+        int status;
+        struct rusage usage;
+
+        while (wait4(pid, &status, 0, &usage) < 0) {
+            if (errno != EINTR)
+                _exit(1);
+        }
+
+        len = snprintf(reply, sizeof(reply), "%d %ld.%06ld %ld.%06ld %ld\n", status,
+                       (long) usage.ru_utime.tv_sec, (long) usage.ru_utime.tv_usec,
+                       (long) usage.ru_stime.tv_sec, (long) usage.ru_stime.tv_usec, usage.ru_maxrss);
+
+        if (write_all(st_fd, reply, len))
+            _exit(1);
+    }
+}
+
+int __wrap_main(int argc, char **argv, char **envp) {
+    const char *fds = getenv("CGC_FORKSERVER");
+    int ctl_fd, st_fd;
+
+    if (fds != NULL && sscanf(fds, "%d,%d", &ctl_fd, &st_fd) == 2)
+        serve(ctl_fd, st_fd);
+
+    return __real_main(argc, argv, envp);
+}
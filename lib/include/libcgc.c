@@ -226,6 +226,17 @@ int cgc_random(void *buf, cgc_size_t count, cgc_size_t *rnd_bytes) {
     return 0;
 }
 
+/**
+ * Reinitializes the prng from the current seed and refills the flag page, for
+ * binaries forked after libcgc was initialized (see forkserver.c)
+ */
+void cgc_reseed_prng(void) {
+  free(cgc_internal_prng);
+  cgc_internal_prng = NULL;
+  cgc_try_init_prng();
+  cgc_aes_get_bytes(cgc_internal_prng, PAGE_SIZE, CGC_FLAG_PAGE_ADDRESS);
+}
+
 static void __attribute__ ((constructor)) cgc_initialize_flag_page(void) {
   void *mmap_addr = mmap(CGC_FLAG_PAGE_ADDRESS, PAGE_SIZE,
                          PROT_READ | PROT_WRITE,
@@ -24,5 +24,6 @@ setup(
     entry_points="""
         [console_scripts]
         cgcrepair = cgcrepair.main:main
+        cgcrepair-cc = cgcrepair.utils.object_cache:main
     """,
 )
@@ -0,0 +1,11 @@
+int sum(int *values, int count) {
+    int total = 0;
+
+    for (int i = 0; i < count; i++) {
+        if (values[i] < 0)
+            continue;
+        total += values[i];
+    }
+
+    return total;
+}
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+from pytest import approx
+from cgcrepair.core.data.results import CommandData
+from cgcrepair.core.handlers.operations import test
+from cgcrepair.utils import data
+from cgcrepair.utils.parse.test_result import BatchResultParser
+
+
+def _tests(names: str):
+    return [data.Test(name=name, order=i, is_pov=name.startswith('n'), file=Path(f"/tests/{name}.xml"))
+            for i, name in enumerate(names.split())]
+
+
+def _units(tests, batch: int):
+    handler = test.TestHandler()
+    handler.batch = batch
+
+    return [[t.name for t in unit] for unit in handler._units(tests)]
+
+
+def test_units():
+    tests = _tests('p1 p2 p3 p4 p5 n1 n2 p6')
+
+    assert _units(tests, 1) == [[name] for name in 'p1 p2 p3 p4 p5 n1 n2 p6'.split()]
+    assert _units(tests, 2) == [['p1', 'p2'], ['p3', 'p4'], ['p5'], ['n1', 'n2'], ['p6']]
+    # polls and POVs are never in the same unit
+    assert _units(tests, 10) == [['p1', 'p2', 'p3', 'p4', 'p5'], ['n1', 'n2'], ['p6']]
+    assert _units([], 10) == []
+
+
+def _record(file: str, passed: int, duration):
+    return {'file': file, 'total': 1, 'passed': passed, 'polls_failed': 1 - passed,
+            'failed_polls': [] if passed else ['match: string'], 'ok': 'polls passed' if passed else None,
+            'not_ok': None if passed else 'polls failed', 'timed_out': False, 'pid': None, 'sig': 0,
+            'duration': duration}
+
+
+def test_split():
+    unit = _tests('p1 p2 p3')
+    parser = BatchResultParser()
+    parser.record(_record('/tests/p1.xml', 1, 0.1))
+    parser.record(_record('/tests/p2.xml', 0, 0.3))
+    parser.record(_record('/tests/p3.xml', 1, 0.6))
+    cmd_data = CommandData(args='cb-test', pid=10, pgid=10, duration=2.0, return_code=1, error='failed')
+
+    results = test.TestHandler._split(unit, cmd_data, parser)
+
+    # the wall time of the batch is shared in proportion to the reported durations
+    assert [test_data.duration for test_data, _ in results] == approx([0.2, 0.6, 1.2])
+    assert sum(test_data.duration for test_data, _ in results) == approx(cmd_data.duration)
+    assert [test_parser.passed for _, test_parser in results] == [1, 0, 1]
+    # the error of the batch belongs to the tests that did not pass
+    errors = [(test_data.return_code, test_data.error) for test_data, _ in results]
+    assert errors == [(0, None), (1, 'failed'), (0, None)]
+    assert all(test_data.pgid == 10 for test_data, _ in results)
+
+
+def test_split_unreported():
+    unit = _tests('p1 p2 p3 p4')
+    parser = BatchResultParser()
+    parser.record(_record('/tests/p1.xml', 1, 0.1))
+    parser.record(_record('/tests/p2.xml', 1, None))
+    # the batch timed out before reaching p3 and p4
+    cmd_data = CommandData(args='cb-test', duration=4.0, timeout=True, return_code=-3, error='Command timed out')
+
+    results = test.TestHandler._split(unit, cmd_data, parser)
+
+    assert [test_data.duration for test_data, _ in results] == approx([1.0] * 4)
+    outcomes = [test_parser.outcome(t, 0) for t, (_, test_parser) in zip(unit, results)]
+    assert [test_outcome.result for test_outcome in outcomes] == [True, True, False, False]
+    assert [test_data.return_code for test_data, _ in results] == [0, 0, -3, -3]
+    assert all(test_data.timeout for test_data, _ in results)
@@ -0,0 +1,63 @@
+from pathlib import Path
+
+from pytest import raises
+from cgcrepair.core.handlers.operations import test
+from cgcrepair.utils.data import WorkingPaths
+from cgcrepair.utils.parse.coverage import covered_lines, changed_lines, same_source
+
+DATA = Path(__file__).parent / 'data' / 'coverage'
+
+
+def test_covered_lines():
+    # the loop of service.c runs twice
+    assert covered_lines(DATA / 'service.c.path') == {1, 2, 4, 5, 7}
+
+
+def test_covered_lines_fields(tmp_path):
+    # fields after the line number and blank lines are ignored
+    cov_file = tmp_path / 'service.c.path'
+    cov_file.write_text("12 3\n\n  13\t1\n")
+
+    assert covered_lines(cov_file) == {12, 13}
+
+
+def test_covered_lines_format(tmp_path):
+    # the first number of the gcov lines is the execution count
+    cov_file = tmp_path / 'service.c.path'
+    cov_file.write_text("        2:   12:    total += values[i];\n")
+
+    with raises(ValueError):
+        covered_lines(cov_file)
+
+
+def test_changed_lines():
+    # line 4 is replaced, and the insertions are around lines 4 and 5 and lines 5 and 6
+    assert changed_lines(DATA / 'service.c', DATA / 'service_fix.c') == {4, 5, 6}
+
+
+def test_changed_lines_delete(tmp_path):
+    changed = tmp_path / 'service.c'
+    lines = (DATA / 'service.c').read_text().splitlines(keepends=True)
+    changed.write_text(''.join(lines[:4] + lines[5:]))
+
+    assert changed_lines(DATA / 'service.c', changed) == {5}
+
+
+def test_same_source():
+    assert same_source('challenge/src/service.c', 'src/service.c')
+    assert same_source('challenge/src/service', 'src/service.c')
+    assert not same_source('challenge/src/service.c', 'src/main.c')
+
+
+def test_manifest_file(tmp_path):
+    source = tmp_path / 'CROMU_00001'
+    working = WorkingPaths(root=tmp_path, source=source, build_root=tmp_path / 'build', build=tmp_path / 'build',
+                           cmake=tmp_path / 'build', binary=tmp_path / 'build' / 'CROMU_00001')
+    manifest_files = ['src/data.c', 'src/cgc_lib.c', 'lib/lib.c', 'src/a.c']
+
+    assert test._manifest_file(source / 'src' / 'data.c', working, manifest_files) == 'src/data.c'
+    assert test._manifest_file(tmp_path / 'fix' / 'src' / 'a.c', working, manifest_files) == 'src/a.c'
+    # the paths are compared by their components, not as strings
+    assert test._manifest_file(tmp_path / 'fix' / 'a.c', working, manifest_files) is None
+    assert test._manifest_file(tmp_path / 'fix' / 'lib.c', working, manifest_files) is None
+    assert test._manifest_file(source / 'data.c', working, manifest_files) is None
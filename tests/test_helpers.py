@@ -0,0 +1,22 @@
+from pytest import approx
+from cgcrepair.utils.helpers import percentile
+
+
+def test_percentile():
+    durations = [0.5, 0.1, 0.4, 0.2, 0.3]
+
+    assert percentile(durations, 0) == 0.1
+    assert percentile(durations, 50) == 0.3
+    assert percentile(durations, 100) == 0.5
+    # interpolated between the closest ranks, as numpy.percentile
+    assert percentile(durations, 95) == approx(0.48)
+    assert percentile(durations, 30) == approx(0.22)
+
+
+def test_percentile_single():
+    assert percentile([2.0], 95) == 2.0
+
+
+def test_percentile_ties():
+    assert percentile([1, 1, 1, 9], 50) == 1
+    assert percentile([1, 1, 1, 9], 95) == approx(7.8)
@@ -0,0 +1,108 @@
+import os
+import sys
+import shutil
+import subprocess
+
+from pathlib import Path
+
+import pytest
+from cgcrepair.utils.object_cache import ObjectCache, read_stats, _output, _without_output, CACHE_ENV, BASE_ENV, \
+    STATS_ENV
+
+needs_gcc = pytest.mark.skipif(shutil.which('gcc') is None, reason="gcc is not installed")
+
+
+def _instance(root, header: str = '#define VALUE 1\n'):
+    (root / 'src').mkdir(parents=True)
+    (root / 'include').mkdir()
+    (root / 'include' / 'service.h').write_text(header)
+    (root / 'src' / 'service.c').write_text('#include "service.h"\nint value(void) { return VALUE; }\n')
+
+    return ['-I', str(root / 'include'), '-O2', '-c', str(root / 'src' / 'service.c'), '-o', str(root / 'service.o')]
+
+
+def test_without_output():
+    assert _without_output(['-c', 'a.c', '-o', 'a.o', '-O2']) == ['-c', 'a.c', '-O2']
+    assert _without_output(['-c', 'a.c']) == ['-c', 'a.c']
+
+
+def test_output():
+    assert _output(['-O2', '-c', 'a.c', '-o', 'a.o']) == 'a.o'
+    assert _output(['-MD', '-MF', 'a.o.d', '-c', 'a.c', '-o', 'a.o']) == 'a.o'
+    # links, preprocessing and outputs other than the object are not cached
+    assert _output(['a.o', '-o', 'cb']) is None
+    assert _output(['-E', '-c', 'a.c', '-o', 'a.i']) is None
+    assert _output(['-c', 'a.c', '-o']) is None
+    assert _output(['-c', 'a.c', '-o', 'a.o', '-o', 'b.o']) is None
+    assert _output(['-c', 'a.c', '-o', 'a.o', '--coverage']) is None
+    assert _output(['-c', 'a.c', '-o', 'a.o', '-save-temps=obj']) is None
+    assert _output(['-MD', '-c', 'a.c', '-o', 'a.o']) is None
+
+
+@needs_gcc
+def test_key_shared_by_instances(tmp_path):
+    cache = ObjectCache(tmp_path / 'cache')
+    first = cache.key('gcc', _instance(tmp_path / 'first'), base=str(tmp_path / 'first'))
+    second = cache.key('gcc', _instance(tmp_path / 'second'), base=str(tmp_path / 'second'))
+
+    assert first == second
+    # stable across runs
+    assert first == cache.key('gcc', _instance(tmp_path / 'third'), base=str(tmp_path / 'third'))
+
+
+@needs_gcc
+def test_key_changes(tmp_path):
+    cache = ObjectCache(tmp_path / 'cache')
+    flags = _instance(tmp_path / 'first')
+    key = cache.key('gcc', flags, base=str(tmp_path / 'first'))
+
+    # the paths of the instance are part of the key without the base
+    assert key != cache.key('gcc', flags)
+    assert key != cache.key('gcc', ['-O0' if flag == '-O2' else flag for flag in flags], base=str(tmp_path / 'first'))
+    # the headers are part of the preprocessed source
+    assert key != cache.key('gcc', _instance(tmp_path / 'second', header='#define VALUE 2\n'),
+                            base=str(tmp_path / 'second'))
+
+
+def test_get_put_evict(tmp_path):
+    cache = ObjectCache(tmp_path / 'cache')
+    obj = tmp_path / 'service.o'
+
+    for key, size in [('aa01', 100), ('bb02', 200), ('cc03', 300)]:
+        obj.write_bytes(b'\0' * size)
+        cache.put(key, str(obj))
+        os.utime(str(cache.entry(key)), (size, size))
+
+    assert not cache.get('dd04', str(tmp_path / 'missing.o'))
+    assert cache.get('aa01', str(tmp_path / 'hit.o'))
+    assert (tmp_path / 'hit.o').read_bytes() == b'\0' * 100
+
+    # the hit made 'aa01' the most recently used entry
+    assert cache.evict(450) == 1
+    assert not cache.entry('bb02').exists()
+    assert cache.entry('aa01').exists() and cache.entry('cc03').exists()
+
+
+def test_read_stats(tmp_path):
+    stats = tmp_path / 'cgcrepair-cc.stats'
+
+    assert read_stats(stats) == (0, 0)
+    stats.write_text("hit\nmiss\nhit\n")
+    assert read_stats(stats) == (2, 1)
+
+
+@needs_gcc
+def test_launcher_debug_paths(tmp_path):
+    env = dict(os.environ, **{CACHE_ENV: str(tmp_path / 'cache'), STATS_ENV: str(tmp_path / 'stats'),
+                              'PYTHONPATH': str(Path(__file__).parent.parent)})
+    launcher = [sys.executable, '-c', 'from cgcrepair.utils.object_cache import main; main()', 'gcc', '-g']
+
+    for instance in ['first', 'second']:
+        flags = _instance(tmp_path / instance)
+        env[BASE_ENV] = str(tmp_path / instance)
+        subprocess.run(launcher + flags, env=env, cwd=str(tmp_path / instance), check=True)
+
+    assert read_stats(tmp_path / 'stats') == (1, 1)
+    # the object of the first instance is shared without its paths
+    assert str(tmp_path).encode() not in (tmp_path / 'second' / 'service.o').read_bytes()
+
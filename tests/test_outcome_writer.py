@@ -0,0 +1,79 @@
+from pytest import raises
+from cgcrepair.core.handlers import database
+from cgcrepair.core.handlers.database import OutcomeWriter
+
+
+class RecordingDatabase:
+    """
+        Records the batches inserted and assigns the ids as the database would, the inserts fail while 'down' is set.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.down = False
+
+    def add_all(self, entities):
+        if self.down:
+            raise RuntimeError("database is down")
+
+        inserted = sum(len(batch) for batch in self.batches)
+
+        for i, entity in enumerate(entities, start=1):
+            entity.id = inserted + i
+
+        self.batches.append(list(entities))
+
+        return [entity.id for entity in entities]
+
+
+def _outcomes(count: int):
+    return [database.TestOutcome(name=f"p{i}", is_pov=False, result=True, exit_status=0, duration=0)
+            for i in range(count)]
+
+
+def test_batches():
+    db = RecordingDatabase()
+    flushed = []
+    writer = OutcomeWriter(db, batch_size=2, on_flush=lambda outcomes: flushed.append([o.id for o in outcomes]))
+
+    for test_outcome in _outcomes(5):
+        writer.add(test_outcome)
+
+    assert [len(batch) for batch in db.batches] == [2, 2]
+    assert len(writer.pending) == 1
+
+    assert writer.flush() == 1
+    assert writer.flush() == 0
+    assert flushed == [[1, 2], [3, 4], [5]]
+    assert writer.ids == [1, 2, 3, 4, 5]
+
+
+def test_no_batch_size():
+    db = RecordingDatabase()
+    writer = OutcomeWriter(db)
+
+    for test_outcome in _outcomes(3):
+        writer.add(test_outcome)
+
+    assert not db.batches
+    assert writer.ids == [1, 2, 3]
+    assert len(db.batches) == 1
+
+
+def test_flush_on_error():
+    db = RecordingDatabase()
+    writer = OutcomeWriter(db, batch_size=2)
+    outcomes = _outcomes(3)
+    writer.add(outcomes[0])
+    db.down = True
+
+    with raises(RuntimeError):
+        writer.add(outcomes[1])
+
+    # the outcomes of the failed insert are kept for the flush that follows the error
+    assert writer.pending == outcomes[:2]
+    db.down = False
+    writer.add(outcomes[2])
+
+    assert [[o.name for o in batch] for batch in db.batches] == [['p0', 'p1', 'p2']]
+    assert writer.flush() == 0
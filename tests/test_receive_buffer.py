@@ -0,0 +1,66 @@
+import shutil
+import subprocess
+
+from pathlib import Path
+
+import pytest
+
+TOOLS = Path(__file__).parent.parent / 'tools'
+
+# the tools run on python2, the checks run in its interpreter
+CHECKS = r"""
+import imp
+cb_replay = imp.load_source('cb_replay', 'cb-replay.py')
+ReceiveBuffer = cb_replay.ReceiveBuffer
+
+# CRLF converted within a chunk
+buf = ReceiveBuffer()
+buf.append('a\r\nb')
+assert str(buf) == 'a\nb' and buf.received == 4
+
+# a CR at the end of a chunk merges with the LF at the start of the next
+buf = ReceiveBuffer()
+buf.append('a\r')
+buf.append('\nb')
+assert str(buf) == 'a\nb' and buf.received == 4
+
+# a CR not followed by a LF is kept
+buf = ReceiveBuffer()
+buf.append('a\r')
+buf.append('b\r')
+assert str(buf) == 'a\rb\r'
+
+# partial reads of the delimited data
+buf = ReceiveBuffer()
+buf.append('hel')
+assert buf.find('\n') == -1
+buf.append('lo\nwor')
+assert buf.find('\n') == 5
+assert buf.consume(6) == 'hello\n' and len(buf) == 3
+assert buf.find('\n') == -1 and buf.find('r', 1) == 2
+buf.append('ld\n')
+assert buf.find('\n') == 5
+assert buf.consume(10) == 'world\n' and len(buf) == 0 and buf.consume(1) == ''
+
+# the consumed data is dropped once it is large enough
+ReceiveBuffer.COMPACT_SIZE = 4
+buf = ReceiveBuffer()
+buf.append('abcdefgh')
+assert buf.consume(3) == 'abc' and buf.start == 3
+assert buf.consume(2) == 'de' and buf.start == 0
+assert str(buf) == 'fgh' and buf.find('h') == 2
+"""
+
+
+def test_receive_buffer():
+    python2 = shutil.which('python2')
+
+    if not python2 or subprocess.run([python2, '--version'], stderr=subprocess.DEVNULL).returncode:
+        pytest.skip("python2 is not installed")
+
+    check = subprocess.run([python2, '-c', CHECKS], cwd=str(TOOLS), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    if b'ImportError' in check.stderr:
+        pytest.skip(f"the tools can not be loaded: {check.stderr.decode().strip().splitlines()[-1]}")
+
+    assert check.returncode == 0, check.stderr.decode()
@@ -0,0 +1,205 @@
+import re
+
+from pathlib import Path
+
+import pytest
+from cgcrepair.core.handlers import database
+from cgcrepair.utils import data
+from cgcrepair.utils.parse.test_result import BatchResultParser, get_outcome, get_pids_sig, parse
+
+POLL = data.Test(name='p1', order=1, is_pov=False, file=Path('/polls/GEN_00000_00001.xml'))
+POV = data.Test(name='n1', order=1, is_pov=True, file=Path('/povs/pov_1.pov'))
+
+PASSED_POLL = """# cb-test.py 0.2
+# pid 123456
+ok 1 - match: string
+ok 2 - match: string
+# tests passed: 2
+# tests failed: 0
+# polls passed: 1
+# polls failed: 0
+# [RUSAGE] pid: 123456, utime: 0.001000, stime: 0.002000, maxrss: 1536
+# duration: 0.014
+# END REPLAY
+ok - polls passed
+# TOTAL TESTS: 1
+# TOTAL PASSED: 1
+"""
+
+FAILED_POLL = """# cb-test.py 0.2
+# pid 123457
+ok 1 - match: string
+not ok 2 - match: string
+# expected: 'PASSWORD'
+# result: 'passw'
+# tests passed: 1
+# tests failed: 1
+# polls passed: 0
+# polls failed: 1
+# duration: 0.021
+# END REPLAY
+not ok - polls failed
+# TOTAL TESTS: 1
+# TOTAL PASSED: 0
+"""
+
+TIMED_OUT_POLL = """# cb-test.py 0.2
+# pid 123458
+ok 1 - match: string
+# polls failed: 0
+not ok - process timed out
+# TOTAL TESTS: 1
+# TOTAL PASSED: 0
+"""
+
+CRASHED_POV = """# cb-test.py 0.2
+# pid 123459
+# negotiation type: 2
+# [DEBUG] pid: 123459, sig: 11
+# Process generated signal (pid: 123459, signal: 11)
+# register states - eax:0 ecx:deadbeef
+# [RUSAGE] pid: 123459, utime: 0.004000, stime: 0.001000, maxrss: 2048
+# duration: 0.107
+# END REPLAY
+ok - process cored as expected: (signal 11: SIGSEGV)
+# TOTAL TESTS: 1
+# TOTAL PASSED: 1
+"""
+
+FAILED_TO_RUN = """# cb-test.py 0.2
+# launching cb-replay.py --cbs /build/cb
+Traceback (most recent call last):
+IOError: [Errno 2] No such file or directory
+"""
+
+OUTPUTS = [PASSED_POLL, FAILED_POLL, TIMED_OUT_POLL, CRASHED_POV, FAILED_TO_RUN]
+
+
+def _reference_outcome(output: str, test: data.Test, sig: int):
+    """
+        The outcome as parsed with the searches over the whole output, before the output was parsed line by line.
+    """
+    def match_pattern(pattern):
+        match = re.search(pattern, output)
+        return match.group(1) if match else None
+
+    test_outcome = database.TestOutcome(total=1, passed=0, name=test.name, is_pov=test.is_pov, sig=sig)
+    polls_failed = match_pattern(r"# polls failed: (\d{1,4})")
+    test_outcome.failed = int(polls_failed) if polls_failed else 0
+    ok = match_pattern(r"ok - (.*)")
+    not_ok = match_pattern(r"not ok - (.*)")
+    not_ok_polls = re.findall(r"not ok (\d{1,4}) - (.*)", output)
+
+    if 'timed out' in output:
+        test_outcome.error = "Test timed out"
+        test_outcome.result = False
+    elif not test.is_pov and not_ok_polls:
+        test_outcome.error = "Polls failed" + ''.join(f"\n{msg}" for _, msg in not_ok_polls)
+        test_outcome.result = False
+    elif not test.is_pov and test_outcome.failed > 0:
+        test_outcome.error = "Polls failed"
+        test_outcome.result = False
+    elif 'TOTAL TESTS' not in output:
+        test_outcome.error = "Test failed to run."
+        test_outcome.result = False
+    else:
+        test_outcome.total = int(output.split('TOTAL TESTS: ')[1].split('\n')[0])
+        test_outcome.passed = int(output.split('TOTAL PASSED: ')[1].split('\n')[0])
+
+        if not_ok:
+            test_outcome.status = not_ok
+            test_outcome.result = False
+        elif ok:
+            test_outcome.status = ok
+            test_outcome.result = True
+
+    return test_outcome
+
+
+def _reference_pids_sig(output: str):
+    match = re.search(r"# \[DEBUG\] pid: (\d{1,7}), sig: (\d{1,2})", output)
+    match2 = re.search(r"# Process generated signal \(pid: (\d{1,7}), signal: (\d{1,2})\)", output)
+
+    if match:
+        return [match.group(1)], int(match.group(2))
+    if match2:
+        return [match2.group(1)], int(match2.group(2))
+
+    match = re.search(r"# pid (\d{4,7})", output)
+
+    return ([match.group(1)] if match else []), 0
+
+
+def _fields(test_outcome):
+    return {field: getattr(test_outcome, field) for field in ['name', 'is_pov', 'result', 'status', 'total', 'passed',
+                                                              'failed', 'error', 'sig']}
+
+
+@pytest.mark.parametrize('output', OUTPUTS)
+@pytest.mark.parametrize('test', [POLL, POV])
+def test_outcome(output, test):
+    assert get_pids_sig(output) == _reference_pids_sig(output)
+    _, sig = _reference_pids_sig(output)
+    assert _fields(get_outcome(output, test, sig)) == _fields(_reference_outcome(output, test, sig))
+
+
+@pytest.mark.parametrize('line_end', ['\n', '\r\n'])
+def test_streamed_lines(line_end):
+    # the lines are fed as they are read from the pipe, with their line endings
+    output = CRASHED_POV.replace('\n', line_end)
+    parser = parse('')
+
+    for line in output.splitlines(keepends=True):
+        parser.feed(line)
+
+    assert parser.pids_sig() == (['123459'], 11)
+    assert _fields(parser.outcome(POV, 11)) == _fields(_reference_outcome(output, POV, 11))
+    assert (parser.duration, parser.cpu_user, parser.max_rss, parser.procs) == (0.107, 0.004, 2048, 1)
+
+
+def test_batch():
+    outputs = {'/polls/a.xml': PASSED_POLL, '/polls/b.xml': FAILED_POLL, '/polls/c.xml': TIMED_OUT_POLL}
+    parser = BatchResultParser()
+    parser.feed('# cb-test.py 0.2\n')
+
+    for file, output in outputs.items():
+        for line in [f"# BEGIN TEST {file}\n"] + output.splitlines(keepends=True) + [f"# END TEST {file}\n"]:
+            parser.feed(line)
+
+    for file, output in outputs.items():
+        test_parser = parser.get(file)
+        assert test_parser.pids_sig() == _reference_pids_sig(output)
+        assert _fields(test_parser.outcome(POLL, 0)) == _fields(_reference_outcome(output, POLL, 0))
+
+    # a test the batch did not reach
+    assert parser.get('/polls/d.xml').outcome(POLL, 0).error == "Test failed to run."
+
+
+def test_record():
+    record = {'file': '/povs/pov_1.pov', 'total': 1, 'passed': 1, 'polls_failed': 0, 'failed_polls': [],
+              'ok': 'process cored as expected: (signal 11: SIGSEGV)', 'not_ok': None, 'timed_out': False,
+              'pid': 123459, 'sig': 11, 'duration': 0.107, 'cpu_user': 0.004, 'cpu_sys': 0.001, 'max_rss': 2048,
+              'procs': 1}
+    parser = BatchResultParser()
+    parser.record(record)
+    test_parser = parser.get(record['file'])
+
+    # the record holds the fields the output of the same run yields
+    assert test_parser.pids_sig() == _reference_pids_sig(CRASHED_POV)
+    assert _fields(test_parser.outcome(POV, 11)) == _fields(_reference_outcome(CRASHED_POV, POV, 11))
+
+
+def test_record_overrides_output():
+    record = {'file': '/polls/a.xml', 'total': 1, 'passed': 0, 'polls_failed': 1, 'failed_polls': ['match: string'],
+              'ok': None, 'not_ok': 'polls failed', 'timed_out': False, 'pid': None, 'sig': 0, 'duration': 0.021}
+    parser = BatchResultParser()
+    parser.record(record)
+
+    # the output of the test, streamed after its record, does not change the fields of the record
+    for line in ['# BEGIN TEST /polls/a.xml\n'] + PASSED_POLL.splitlines(keepends=True) + ['# END TEST /polls/a.xml\n']:
+        parser.feed(line)
+
+    test_outcome = parser.get('/polls/a.xml').outcome(POLL, 0)
+    assert (test_outcome.result, test_outcome.error) == (False, "Polls failed\nmatch: string")
+    assert parser.get('/polls/a.xml').duration == 0.021
+
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+cb-replay micro-benchmark
+
+Throws a generated multi-MB poll with cb-replay against a CB that echoes its
+input back ('/bin/cat' by default), measuring the receive path of the replay:
+many delimited reads over a large buffer, followed by a single large read.
+"""
+
+import argparse
+import imp
+import os
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+cb_replay = imp.load_source('cb_replay', os.path.join(TOOLS_DIR, 'cb-replay.py'))
+
+
+def make_poll(size, line):
+    """ Generate the XML of a poll that writes and reads back size bytes twice
+
+    Arguments:
+        size: Amount of data in bytes for each phase of the poll
+        line: Length of the lines read with a delimiter
+
+    Returns:
+        The poll XML
+    """
+    lines = max(1, size // line)
+    data = ('A' * (line - 1) + '\\n') * lines
+
+    steps = ['<write><data>%s</data></write>' % data]
+    steps += ['<read><delim>\\n</delim></read>'] * lines
+    steps += ['<write><data>%s</data></write>' % data,
+              '<read><length>%d</length></read>' % (lines * line)]
+
+    return '<?xml version="1.0" standalone="no" ?>\n' \
+           '<pov><cbid>bench</cbid><replay>%s</replay></pov>' % ''.join(steps)
+
+
+def main():
+    """ Throw the generated poll and report the durations """
+    parser = argparse.ArgumentParser(description='Benchmark the receive path of cb-replay')
+    parser.add_argument('--cb', required=False, type=str, default='/bin/cat',
+                        help='CB that echoes its input back')
+    parser.add_argument('--size', required=False, type=int, default=4,
+                        help='MB of data in each phase of the poll')
+    parser.add_argument('--line', required=False, type=int, default=64,
+                        help='Length of the lines read with a delimiter')
+    parser.add_argument('--rounds', required=False, type=int, default=3,
+                        help='Number of throws')
+    parser.add_argument('--timeout', required=False, type=int, default=300,
+                        help='Timeout of each throw')
+
+    args = parser.parse_args()
+    xml = make_poll(args.size * 1024 * 1024, args.line)
+    durations = []
+
+    for i in xrange(args.rounds):
+        start = time.time()
+        passed, failed, logs = cb_replay.run_pov([args.cb], (xml, 'bench.xml'), args.timeout, False, False, None,
+                                                 False, None)
+        durations.append(time.time() - start)
+        print '# round %d: %.3fs (passed: %d, failed: %d)' % (i + 1, durations[-1], passed, failed)
+
+        if failed:
+            print '\n'.join(logs)
+            return 1
+
+    print '# best: %.3fs mean: %.3fs' % (min(durations), sum(durations) / len(durations))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -37,6 +37,7 @@ import os
 import signal
 import struct
 import threading
+import time
 
 from common import IS_WINDOWS, Timeout, TimeoutError
 import challenge_runner
@@ -252,6 +253,7 @@ class Throw(object):
             AssertionError: if a POV action is not in the pre-defined methods
         """
         self.log('%s' % (self.pov))
+        start = time.time()
 
         # Get the seed for the tests
         seed = self.gen_seed()
@@ -279,6 +281,7 @@ class Throw(object):
         pov_runner.join()
         watcher.join()
 
+        self.log('duration: %.3f' % (time.time() - start))
         self.log('END REPLAY')
         return self.procs[0].returncode
 
@@ -328,12 +331,26 @@ def main():
     parser.add_argument('--pov_seed', required=False, type=str,
                         help='Specify the POV Seed')
 
-    args = parser.parse_args()
+    return replay(parser.parse_args())
 
+
+def replay(args):
+    """ Throw the POVs, logging the results of each
+
+    Arguments:
+        args: Parsed command line arguments of cb-replay-pov
+
+    Returns:
+        Returns non-0 if the last POV did not exit cleanly
+    """
     assert len(args.files)
     for filename in args.files:
         assert os.path.isfile(filename), "pov must be a file: %s" % repr(filename)
 
+    if len(args.files) > 1:
+        # the POVs share the fork servers of the challenges
+        challenge_runner.reuse_fork_servers = True
+
     for pov in args.files:
         status = run_pov(args.cbs, pov, args.timeout,
                          args.debug, args.pov_seed, args.cores_path)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+"""
+CB replay service
+
+Long-lived service that keeps a pool of warm python2 workers for 'cb-test'.
+The workers are forked after 'cb-test', 'cb-replay' and 'cb-replay-pov' are
+loaded, and throw the Polls/POVs in-process instead of starting a new
+interpreter for every test.
+
+Protocol: a client connects to the Unix socket and sends a single JSON line
+with the 'cb-test' arguments ('args') and, optionally, the environment
+('env') and working directory ('cwd') for the CBs. The output of 'cb-test'
+is streamed back as it is produced and the connection ends with a line that
+starts with REPLAY_END followed by a JSON object with the exit status.
+When the request sets 'results', the result records of 'cb-test' (see
+--result_fd) are sent before that line, each prefixed with REPLAY_RESULT.
+A request is cancelled when the client closes the connection before that
+line, e.g. on its timeout.
+
+Only single binary challenges are supported, the IPC pipes of multiple
+binary challenges are placed over the fds of the service.
+"""
+
+import argparse
+import errno
+import fcntl
+import imp
+import json
+import logging
+import multiprocessing as mp
+import os
+import select
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import traceback
+
+from argparse import Namespace
+from StringIO import StringIO
+
+import challenge_runner
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPLAY_END = '# cb-replay-server: '
+REPLAY_RESULT = '# cb-replay-result: '
+
+cb_test = imp.load_source('cb_test', os.path.join(TOOLS_DIR, 'cb-test.py'))
+cb_replay = imp.load_source('cb_replay', os.path.join(TOOLS_DIR, 'cb-replay.py'))
+cb_replay_pov = imp.load_source('cb_replay_pov', os.path.join(TOOLS_DIR, 'cb-replay-pov.py'))
+
+# the workers run the challenges of many requests, the fork servers are reused
+challenge_runner.reuse_fork_servers = True
+
+
+def set_cloexec(fd):
+    """ Keeps the fd from leaking into the CBs and POVs launched by a worker """
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+class WarmRunner(cb_test.Runner):
+    """ cb-test Runner that throws the Polls/POVs within the worker process
+    instead of launching 'cb-replay' and 'cb-replay-pov' """
+
+    @staticmethod
+    def log_packages():
+        """ The packages are the same for every request, nothing to log """
+        pass
+
+    def start_replay(self, xml):
+        """ Throw the Polls/POVs in-process
+
+        Arguments:
+            xml: List of Polls or POVs to throw
+
+        Returns:
+            The return code and the output of the replay
+
+        Raises:
+            None
+        """
+        cb_paths = [os.path.join(self.directory, cb) for cb in self.cb_list]
+        timeout = self.timeout if self.timeout > 0 else None
+        cb_seed = self.cb_seed if self.negotiate_seed else None
+
+        if xml[0].endswith(cb_test.add_ext('.pov')):
+            replay = cb_replay_pov.replay
+            args = Namespace(cbs=cb_paths, files=xml, timeout=timeout, debug=self.should_debug,
+                             cores_path=self.cores_path, negotiate=self.negotiate_seed, pov_seed=self.pov_seed)
+        else:
+            replay = cb_replay.replay
+            args = Namespace(cbs=cb_paths, files=xml, concurrent=self.concurrent or 1, timeout=timeout,
+                             munge_seed=False, failure_ok=self.failure_ok, debug=self.should_debug,
+                             cores_path=self.cores_path, negotiate=self.negotiate_seed, cb_seed=cb_seed,
+                             cache_dir=self.cache_dir)
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        try:
+            ret = replay(args)
+        except Exception:
+            logging.error('replay failed: %s', traceback.format_exc())
+            ret = -1
+        finally:
+            output = sys.stdout.getvalue()
+            sys.stdout = stdout
+
+        if not self.split_results and self.result_fd is None:
+            self.log_fh.flush()
+            self.log_fh.write(output)
+            self.log_fh.flush()
+
+        return int(ret), output
+
+
+# cb-test's main builds its runner through the module global
+cb_test.Runner = WarmRunner
+
+
+def watch(conn, done):
+    """ Cancel the request when the client goes away before it is finished,
+    e.g. when the client times out, by killing the process group of the
+    worker with the CBs and POVs of the replay. The service respawns the
+    worker.
+
+    Arguments:
+        conn: Socket connected to the client
+        done: Event set once the request is finished
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    while not done.wait(0.5):
+        readable, _, _ = select.select([conn], [], [], 0)
+        if readable and not conn.recv(1, socket.MSG_PEEK):
+            # the logs of the request go to the client, the service logs the respawn
+            os.killpg(os.getpgrp(), signal.SIGKILL)
+
+
+def handle(conn):
+    """ Run a single cb-test request, streaming the output to the client
+
+    Arguments:
+        conn: Socket connected to the client
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    request = json.loads(conn.makefile('rb').readline())
+    out = conn.makefile('wb', 0)
+    logger = logging.getLogger()
+    handlers, level = list(logger.handlers), logger.level
+    stdout, argv, cwd, environ = sys.stdout, sys.argv, os.getcwd(), dict(os.environ)
+    args = request['args']
+    results = None
+    error = None
+    done = threading.Event()
+    watcher = threading.Thread(target=watch, args=(conn, done))
+    watcher.daemon = True
+    watcher.start()
+
+    if request.get('results'):
+        results = tempfile.TemporaryFile()
+        set_cloexec(results.fileno())
+        args = args + ['--result_fd', str(results.fileno())]
+
+    try:
+        if request.get('env'):
+            os.environ.clear()
+            os.environ.update(request['env'])
+
+        if request.get('cwd'):
+            os.chdir(request['cwd'])
+
+        sys.stdout = out
+        sys.argv = ['cb-test.py'] + args
+        ret = cb_test.main()
+    except SystemExit as se:
+        ret = se.code if isinstance(se.code, int) else 1
+    except Exception:
+        error = traceback.format_exc()
+        ret = 1
+    finally:
+        done.set()
+        sys.stdout, sys.argv = stdout, argv
+        logger.handlers, logger.level = handlers, level
+        os.chdir(cwd)
+        # the environment of the request does not leak into the next one
+        os.environ.clear()
+        os.environ.update(environ)
+        watcher.join()
+
+    if results is not None:
+        results.seek(0)
+        for line in results:
+            out.write(REPLAY_RESULT + line)
+        results.close()
+
+    out.write('\n%s%s\n' % (REPLAY_END, json.dumps({'exit': ret % 256, 'error': error})))
+
+
+def serve(listener):
+    """ Worker loop, handles one request at a time in the main thread (the
+    replay timeouts interrupt the main thread) """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except socket.error as err:
+            if err.errno == errno.EINTR:
+                continue
+            raise
+
+        set_cloexec(conn.fileno())
+
+        try:
+            handle(conn)
+        except (socket.error, IOError, ValueError) as err:
+            # the client went away or sent a malformed request
+            logging.warning('request failed: %s', str(err))
+        except KeyboardInterrupt:
+            # a replay timeout fired after the request was finished
+            pass
+        finally:
+            # ends the response even if the files of the request, e.g. the
+            # stream of the logs of cb-test, still hold the socket
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            conn.close()
+
+
+def main():
+    """ Start the service and keep the pool of workers alive """
+    parser = argparse.ArgumentParser(description='Replay service with warm workers for cb-test')
+    parser.add_argument('--socket', required=True, type=str,
+                        help='Path of the Unix socket the service listens on')
+    parser.add_argument('--workers', required=False, type=int, default=mp.cpu_count(),
+                        help='Number of worker processes')
+
+    args = parser.parse_args()
+    assert args.workers > 0, "The number of workers must be greater than 0"
+
+    logging.basicConfig(format='# %(message)s', level=logging.INFO)
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(args.socket)
+    listener.listen(128)
+    set_cloexec(listener.fileno())
+
+    workers = set()
+
+    def spawn():
+        pid = os.fork()
+
+        if pid == 0:
+            try:
+                # the process group of the worker holds the CBs and POVs of its requests
+                os.setpgid(0, 0)
+                serve(listener)
+            finally:
+                os._exit(0)
+
+        workers.add(pid)
+
+    def shutdown(signum, frame):
+        for worker in workers:
+            try:
+                os.killpg(worker, signal.SIGTERM)
+            except OSError:
+                pass
+
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+        os._exit(0)
+
+    for _ in range(args.workers):
+        spawn()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    logging.info('listening on %s with %d workers', args.socket, args.workers)
+
+    while True:
+        try:
+            pid, status = os.wait()
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            raise
+
+        # keep the pool size, workers die when their requests crash them
+        if pid in workers:
+            workers.remove(pid)
+            logging.warning('worker %d exited with status %d, respawning', pid, status)
+            spawn()
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -33,32 +33,54 @@ format [1].
 
 import os
 import argparse
+import errno
+import hashlib
+import marshal
 import multiprocessing as mp
 import re
+import select
 import socket
+import tempfile
 import time
 import threading
 import zipfile
 import defusedxml.ElementTree as ET
 
-from common import Timeout, TimeoutError
+from common import Timeout, TimeoutError, IS_WINDOWS
 import challenge_runner
 
+if not IS_WINDOWS:
+    import fcntl
+
+# Amount of data read from the challenges at once
+PIPE_CHUNK = 65536
+# How often a wait on the pipes returns to let Timeout interrupt the replay
+PIPE_WAIT = 0.1
+
 
 class RegexMatch(object):
     """ Simple wrapper for handling regexes in Throw.
 
     Attributes:
         group: which re group to use when extracting data
-        regex: The compiled re to be evaluated
+        pattern: The regular expression
+        regex: The compiled re to be evaluated, compiled on first use
 
     """
-    def __init__(self, regex, group=None):
+    def __init__(self, pattern, group=None):
         if group is None:
             group = 0
 
-        self.regex = regex
+        self.pattern = pattern
         self.group = group
+        self._regex = None
+
+    @property
+    def regex(self):
+        """ The compiled re, compiled when first used """
+        if self._regex is None:
+            self._regex = re.compile(self.pattern, re.DOTALL)
+        return self._regex
 
     def match(self, data):
         """
@@ -83,6 +105,204 @@ class _ValueStr(str):
     pass
 
 
+class ReceiveBuffer(object):
+    """ Data received from the CB and not consumed by the read steps yet
+
+    The data is kept in a bytearray consumed from an offset, so neither
+    appending nor consuming data copies the whole buffer. CRLF is converted
+    to LF as the data is appended, a CR at the end of the data not consumed
+    yet merges with a LF at the start of the next chunk.
+
+    Attributes:
+        data: The received data, consumed up to 'start'
+        start: Offset of the first byte not consumed yet
+        received: Amount of data received, before converting CRLFs
+    """
+    # consumed data is dropped once it is this large and half of the buffer
+    COMPACT_SIZE = 65536
+
+    def __init__(self):
+        self.data = bytearray()
+        self.start = 0
+        self.received = 0
+
+    def __len__(self):
+        return len(self.data) - self.start
+
+    def __str__(self):
+        return str(self.data[self.start:])
+
+    def append(self, chunk):
+        """ Append data received from the CB """
+        self.received += len(chunk)
+        if chunk.startswith('\n') and len(self) > 0 and self.data[-1] == ord('\r'):
+            del self.data[-1]
+        self.data += chunk.replace('\r\n', '\n')
+
+    def find(self, delim, offset=0):
+        """ Index of the delimiter in the data not consumed yet, searching
+        from offset, or -1 """
+        index = self.data.find(delim, self.start + offset)
+        if index < 0:
+            return -1
+        return index - self.start
+
+    def consume(self, size):
+        """ Consume and return up to size bytes """
+        end = min(self.start + size, len(self.data))
+        data = str(self.data[self.start:end])
+        self.start = end
+
+        if self.start >= ReceiveBuffer.COMPACT_SIZE and self.start * 2 >= len(self.data):
+            del self.data[:self.start]
+            self.start = 0
+
+        return data
+
+
+class ParseCache(object):
+    """ Cache of parsed POVs/Polls keyed by the SHA-256 of their XML
+
+    The parsed POVs/Polls are kept in memory for the lifetime of the process
+    and, when a directory is provided, marshaled to disk to be reused by later
+    runs. On disk, the steps only hold builtin types, the regexes are compiled
+    again when first used.
+
+    Usage:
+        cache = ParseCache(directory)
+        parsed = cache.get(raw_data)
+        cache.put(raw_data, parsed)
+
+    Attributes:
+        directory: Directory of the on-disk cache, None to cache only in
+            memory
+    """
+    # bump when the format of the parsed steps changes
+    VERSION = '1'
+    MAX_ENTRIES = 4096
+    _memory = {}
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    @staticmethod
+    def key(raw_data):
+        """ Hash of the raw XML and the version of the cache format """
+        return hashlib.sha256(ParseCache.VERSION + raw_data).hexdigest()
+
+    def path(self, key):
+        """ Path of the on-disk entry for the key """
+        return os.path.join(self.directory, key[:2], key + '.marshal')
+
+    @staticmethod
+    def freeze(value):
+        """ Convert the parsed steps into builtin types for marshal """
+        if isinstance(value, _ValueStr):
+            return ('var', str(value))
+        if isinstance(value, RegexMatch):
+            return ('pcre', value.pattern, value.group)
+        if isinstance(value, slice):
+            return ('slice', value.start, value.stop)
+        if isinstance(value, dict):
+            return ('dict', [(key, ParseCache.freeze(item)) for key, item in value.items()])
+        if isinstance(value, list):
+            return ('list', [ParseCache.freeze(item) for item in value])
+        if isinstance(value, tuple):
+            return ('tuple', [ParseCache.freeze(item) for item in value])
+        return ('raw', value)
+
+    @staticmethod
+    def thaw(value):
+        """ Convert the output of freeze back into the parsed steps """
+        kind = value[0]
+        if kind == 'var':
+            return _ValueStr(value[1])
+        if kind == 'pcre':
+            return RegexMatch(value[1], value[2])
+        if kind == 'slice':
+            return slice(value[1], value[2])
+        if kind == 'dict':
+            return dict((key, ParseCache.thaw(item)) for key, item in value[1])
+        if kind == 'list':
+            return [ParseCache.thaw(item) for item in value[1]]
+        if kind == 'tuple':
+            return tuple(ParseCache.thaw(item) for item in value[1])
+        return value[1]
+
+    @staticmethod
+    def remember(key, parsed):
+        """ Keep the parsed POV/Poll in memory, dropping everything when full """
+        if len(ParseCache._memory) >= ParseCache.MAX_ENTRIES:
+            ParseCache._memory.clear()
+        ParseCache._memory[key] = parsed
+
+    def get(self, raw_data):
+        """ Return the parsed POV/Poll for the XML
+
+        Args:
+            raw_data:  Raw XML of the POV/Poll
+
+        Returns:
+            The parsed POV/Poll, or None if it is not cached
+
+        Raises:
+            None
+        """
+        key = ParseCache.key(raw_data)
+        if key in ParseCache._memory:
+            return ParseCache._memory[key]
+
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self.path(key), 'rb') as cache_fh:
+                parsed = ParseCache.thaw(marshal.load(cache_fh))
+        except IOError:
+            return None
+        except (EOFError, ValueError, TypeError, IndexError):
+            # corrupted entry, it is rewritten after parsing
+            return None
+
+        ParseCache.remember(key, parsed)
+        return parsed
+
+    def put(self, raw_data, parsed):
+        """ Cache the parsed POV/Poll for the XML
+
+        Args:
+            raw_data:  Raw XML of the POV/Poll
+            parsed:  The parsed POV/Poll
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        key = ParseCache.key(raw_data)
+        ParseCache.remember(key, parsed)
+
+        if self.directory is None:
+            return
+
+        path = self.path(key)
+        try:
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+
+            # write and rename, concurrent replays never read partial entries
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(tmp_fd, 'wb') as cache_fh:
+                marshal.dump(ParseCache.freeze(parsed), cache_fh)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            pass
+
+
 class TestFailure(Exception):
     """ Exception to be used by Throw(), to allow catching of test failures """
     pass
@@ -134,13 +354,13 @@ class Throw(object):
         self.timeout = timeout
         self.values = {}
         self.logs = []
-        self._read_buffer = ''
+        self._read_buffer = ReceiveBuffer()
         self.negotiate = negotiate
         self.cores_path = cores_path
 
         self.procs = None
         self.pipe_raw = []
-        self.pipe_buf = ''
+        self.pipe_eof = False
 
     def is_ok(self, expected, result, message):
         """ Verifies 'expected' is equal to 'result', logging results in TAP
@@ -389,47 +609,31 @@ class Throw(object):
 
     def _read_len(self, read_len):
         """
-        Read a specified size, but only ever get 4096 bytes from the socket
+        Read a specified size, buffering the data received from the CB
         """
-        if len(self._read_buffer) >= read_len:
-            data = self._read_buffer[:read_len]
-            self._read_buffer = self._read_buffer[read_len:]
-            return data
-
-        data = [self._read_buffer]
-        data_len = len(self._read_buffer)
-        while data_len < read_len:
-            left = read_len - data_len
-            data_read = self.read_from_proc(max(4096, left))
-            if len(data_read) == 0:
-                # data_read = '\n'
-                self.log_fail('recv failed. (%s so far)' % repr(data))
-                self._read_buffer = ''.join(data)
+        while len(self._read_buffer) < read_len:
+            if self.read_from_proc() == 0:
+                self.log_fail('recv failed. (%s so far)' % repr(str(self._read_buffer)))
                 return ''
 
-            data.append(data_read)
-            data_len += len(data_read)
-
-        data = ''.join(data)
-        self._read_buffer = data[read_len:]
-        return data[:read_len]
+        return self._read_buffer.consume(read_len)
 
     def _read_delim(self, delim):
         """
-        Read until a delimiter is found, but only ever get 4096 bytes from the
-        socket
+        Read until a delimiter is found, without searching again the data
+        already searched
         """
-        while delim not in self._read_buffer:
-            data_read = self.read_from_proc(4096)
-            if len(data_read) == 0:
+        index = self._read_buffer.find(delim)
+        while index < 0:
+            # a match can start in the last bytes searched, or one byte
+            # earlier when the next chunk merges a CRLF
+            offset = max(0, len(self._read_buffer) - len(delim))
+            if self.read_from_proc() == 0:
                 self.log_fail('recv failed.  No data returned.')
                 return ''
-            self._read_buffer += data_read
+            index = self._read_buffer.find(delim, offset)
 
-        depth = self._read_buffer.index(delim) + len(delim)
-        data = self._read_buffer[:depth]
-        self._read_buffer = self._read_buffer[depth:]
-        return data
+        return self._read_buffer.consume(index + len(delim))
 
     def read(self, read_args):
         """ Read data from the CB, validating the results
@@ -512,49 +716,91 @@ class Throw(object):
     def write_to_proc(self, data):
         """ Writes data to the stdin pipe of the challenges
 
+        The output of the challenges is buffered while writing, so neither
+        side blocks on a full pipe.
+
         Args:
             data (str): data to be written
 
         Returns:
             (int): amount of data written, or 0 on error
         """
-        try:
-            self.procs[0].stdin.write(data)
-            return len(data)
-        except IOError:
-            return 0
+        if IS_WINDOWS:
+            try:
+                self.procs[0].stdin.write(data)
+                return len(data)
+            except IOError:
+                return 0
 
-    def read_from_proc(self, size):
-        """ Reads a chosen amount of data from the stdout pipe of the challenges
+        stdin = self.procs[0].stdin.fileno()
+        stdout = self.procs[0].stdout.fileno()
+        sent = 0
 
-        Args:
-            size (int): amount of data to read
+        while sent < len(data):
+            rlist = [] if self.pipe_eof else [stdout]
+            readable, writable, _ = select.select(rlist, [stdin], [], PIPE_WAIT)
+
+            if readable:
+                self.buffer_pipe_chunk(stdout)
+
+            if writable:
+                try:
+                    sent += os.write(stdin, data[sent:])
+                except OSError as err:
+                    if err.errno != errno.EAGAIN:
+                        return 0
+
+        return sent
+
+    def read_from_proc(self):
+        """ Waits for data from the stdout pipe of the challenges and moves it
+        into the read buffer
 
         Returns:
-            (str): data read from the pipe
+            (int): amount of data buffered, 0 when the pipe is closed
         """
-        # Wait until there's data in the raw buffer
-        while len(self.pipe_raw) == 0:
-            time.sleep(0.1)
+        received = self._read_buffer.received
+
+        if not IS_WINDOWS:
+            stdout = self.procs[0].stdout.fileno()
+
+            # Wake up as soon as there's data, the wait is bounded so a
+            # Timeout can still interrupt the replay
+            while self._read_buffer.received == received and not self.pipe_eof:
+                readable, _, _ = select.select([stdout], [], [], PIPE_WAIT)
+                if readable:
+                    self.buffer_pipe_chunk(stdout)
+        else:
+            # Wait until there's data in the raw buffer
+            while len(self.pipe_raw) == 0 and not self.pipe_eof:
+                time.sleep(0.1)
+
+            # the buffering thread only appends, take what is there now
+            count = len(self.pipe_raw)
+            self._read_buffer.append(''.join(self.pipe_raw[:count]))
+            del self.pipe_raw[:count]
+
+        return self._read_buffer.received - received
 
-        # Fill up the temp buffer until we have the requested amount of data
-        while len(self.pipe_buf) < size and len(self.pipe_raw) != 0:
-            self.pipe_buf += self.pipe_raw.pop(0)
+    def buffer_pipe_chunk(self, fd):
+        """ Reads and buffers the data available in a pipe
 
-            # Convert CRLF to LF to match what the POLLs expect
-            if self.pipe_buf.endswith('\r\n'):
-                self.pipe_buf = self.pipe_buf[:-2] + '\n'
+        Args:
+            fd: file descriptor of a readable pipe
+        """
+        chunk = os.read(fd, PIPE_CHUNK)
+        if not chunk:
+            self.pipe_eof = True
+            return
 
-        # Return the amount requested
-        res = self.pipe_buf[:size]
-        self.pipe_buf = self.pipe_buf[size:]
-        return res
+        self._read_buffer.append(chunk)
 
     def buffer_pipe_data(self, pipe):
         """ Continuously reads and buffers data from a pipe
 
         This will block when attempting to read data and should be run
-        in a separate thread
+        in a separate thread (used on Windows, where select does not support
+        pipes)
 
         Args:
             pipe: readable fileobject for a pipe
@@ -562,6 +808,7 @@ class Throw(object):
         while True:
             c = pipe.read(1)
             if c in [None, '']:
+                self.pipe_eof = True
                 break
             self.pipe_raw.append(c)
 
@@ -604,10 +851,16 @@ class Throw(object):
         # Launch all challenges
         self.procs, watcher = challenge_runner.run(self.cb_paths, self.timeout, seed, self.log, self.cores_path)
 
-        # Start a thread to buffer data from the challenges' stdout
-        buf_thread = threading.Thread(target=self.buffer_pipe_data, args=(self.procs[0].stdout,))
-        buf_thread.setDaemon(True)
-        buf_thread.start()
+        buf_thread = None
+        if IS_WINDOWS:
+            # Start a thread to buffer data from the challenges' stdout
+            buf_thread = threading.Thread(target=self.buffer_pipe_data, args=(self.procs[0].stdout,))
+            buf_thread.setDaemon(True)
+            buf_thread.start()
+        else:
+            # The writes are interleaved with reads of the challenges' output
+            stdin = self.procs[0].stdin.fileno()
+            fcntl.fcntl(stdin, fcntl.F_SETFL, fcntl.fcntl(stdin, fcntl.F_GETFL) | os.O_NONBLOCK)
 
         # Everything is ready, now we can run the test
         for method, arguments in self.pov:
@@ -618,13 +871,18 @@ class Throw(object):
                 self.log('stopping due to failure')
                 break
 
-        # The current test is done, kill the main process if it's still running
+        # The current test is done, kill the main process if it's still running.
+        # The watcher reaps the processes, polling here would race its wait
         proc = self.procs[0]
-        if proc.poll() is None:
-            proc.terminate()
+        if proc.returncode is None:
+            try:
+                proc.terminate()
+            except OSError:
+                pass
 
         # Wait for the watcher to report its results
-        buf_thread.join()
+        if buf_thread is not None:
+            buf_thread.join()
         watcher.join()
 
     def dump(self):
@@ -666,12 +924,15 @@ class POV(object):
         _steps:  List of iteractions of a CB
 
         _variables:  List of variables used during CB interaction
+
+        _xml_seed:  Seed defined in the XML
     """
     def __init__(self, seed=None):
         self.filename = None
         self.name = None
         self._steps = []
         self._variables = []
+        self._xml_seed = None
 
         self.seed = seed
 
@@ -724,8 +985,7 @@ class POV(object):
         Raises:
             None
         """
-        pattern = re.compile(data, re.DOTALL)
-        return RegexMatch(pattern)
+        return RegexMatch(data)
 
     @staticmethod
     def compile_slice(data):
@@ -1148,11 +1408,45 @@ class POV(object):
         echo = POV.get_attribute(data, 'echo', 'no', ['yes', 'no', 'ascii'])
         self.add_step('write', {'value': values, 'echo': echo})
 
-    def parse(self, raw_data, filename=None):
+    def set_xml_seed(self, seed):
+        """ Use the seed defined in the XML, over the one set by command line
+
+        Args:
+            seed:  Seed from the XML, or None
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        if seed is None:
+            return
+
+        if self.seed is not None:
+            print "# Seed is set by XML and command line, using XML seed"
+        self._xml_seed = seed
+        self.seed = seed
+
+    def parsed(self):
+        """ The result of parsing the XML, as stored by ParseCache """
+        return {'name': self.name, 'seed': self._xml_seed,
+                'steps': self._steps, 'variables': self._variables}
+
+    def load(self, parsed):
+        """ Restore the result of parsing the XML from ParseCache """
+        self.name = parsed['name']
+        self._steps = parsed['steps']
+        self._variables = parsed['variables']
+        self.set_xml_seed(parsed['seed'])
+
+    def parse(self, raw_data, filename=None, cache=None):
         """ Parse the specified replay XML
 
         Args:
             raw_data:  Raw XML to be parsed
+            filename:  Filename of the XML
+            cache:  Optional ParseCache to reuse previously parsed XMLs
 
         Returns:
             None
@@ -1171,6 +1465,12 @@ class POV(object):
 
         self.filename = filename
 
+        if cache is not None:
+            parsed = cache.get(raw_data)
+            if parsed is not None:
+                self.load(parsed)
+                return
+
         tree = ET.fromstring(raw_data)
         assert tree.tag == 'pov'
         assert len(tree) in [2, 3]
@@ -1194,9 +1494,7 @@ class POV(object):
             assert len(seed_tree.tag) > 0
             seed = seed_tree.text
             assert len(seed) == 96
-            if self.seed is not None:
-                print "# Seed is set by XML and command line, using XML seed"
-            self.seed = seed.decode('hex')
+            self.set_xml_seed(seed.decode('hex'))
 
         parse_fields = {
             'decl': self.parse_decl,
@@ -1209,6 +1507,9 @@ class POV(object):
             assert replay_element.tag in parse_fields
             parse_fields[replay_element.tag](replay_element)
 
+        if cache is not None:
+            cache.put(raw_data, self.parsed())
+
     def dump(self):
         """ Print the steps in the POV, via repr
 
@@ -1257,7 +1558,7 @@ class Results(object):
             self.full_passed += 1
 
 
-def run_pov(cbs, pov_info, timeout, debug, negotiate, cb_seed, munge_seed, cores_path):
+def run_pov(cbs, pov_info, timeout, debug, negotiate, cb_seed, munge_seed, cores_path, cache_dir=None):
     """
     Parse and Throw a POV/Poll
 
@@ -1270,6 +1571,7 @@ def run_pov(cbs, pov_info, timeout, debug, negotiate, cb_seed, munge_seed, cores
         cb_seed: specify a seed to use in the pools
         munge_seed: should the seed be xored before use
         cores_path: should the cores be stored under specified path
+        cache_dir: directory of the cache of parsed POVs/Polls
 
     Returns:
         The number of passed tests
@@ -1285,7 +1587,7 @@ def run_pov(cbs, pov_info, timeout, debug, negotiate, cb_seed, munge_seed, cores
     error = None
     try:
         with Timeout(30):
-            pov.parse(xml, filename=filename)
+            pov.parse(xml, filename=filename, cache=ParseCache(cache_dir))
     except TimeoutError:
         error = "parsing %s timed out" % filename
     except ET.ParseError as err:
@@ -1301,6 +1603,7 @@ def run_pov(cbs, pov_info, timeout, debug, negotiate, cb_seed, munge_seed, cores
         except TestFailure:
             pass  # log_fail throws an exception on purpose
     else:
+        start = time.time()
         try:
             with Timeout(timeout):
                 thrower.run()
@@ -1311,6 +1614,7 @@ def run_pov(cbs, pov_info, timeout, debug, negotiate, cb_seed, munge_seed, cores
                 # this exception should always happen.  don't stop because
                 # one timed out.
                 pass
+        thrower.log('duration: %.3f' % (time.time() - start))
         thrower.dump()
 
     return thrower.passed, thrower.failed, thrower.logs
@@ -1341,9 +1645,25 @@ def main():
                         default=False, help='The CB seed should be negotiated')
     parser.add_argument('--cb_seed', required=False, type=str,
                         help='Specify the CB Seed')
+    parser.add_argument('--cache_dir', required=False, type=str,
+                        help='Directory to cache the parsed POVs/Polls')
+
+    return replay(parser.parse_args())
+
 
-    args = parser.parse_args()
+def replay(args):
+    """ Throw the POVs/Polls, reporting the results in the TAP format
 
+    Arguments:
+        args: Parsed command line arguments of cb-replay
+
+    Returns:
+        Returns 0 if the POVs/Polls passed or failures are accepted
+        Returns non-0 if any of the POVs/Polls failed
+
+    Raises:
+        Exception if the CB seed is set without seed negotiation
+    """
     assert args.concurrent > 0, "Conccurent count must be less than 1"
 
     if args.cb_seed is not None and not args.negotiate:
@@ -1365,13 +1685,18 @@ def main():
         for xml in pov_xml:
             povs.append((xml, pov_filename))
 
+    if len(povs) > 1:
+        # the Polls/POVs share the fork servers of the challenges
+        challenge_runner.reuse_fork_servers = True
+
     result_handler = Results()
     pool = mp.Pool(args.concurrent)
     pool_responses = []
     try:
         for pov in povs:
             pov_args = (args.cbs, pov, args.timeout, args.debug,
-                        args.negotiate, args.cb_seed, args.munge_seed, args.cores_path)
+                        args.negotiate, args.cb_seed, args.munge_seed, args.cores_path,
+                        args.cache_dir)
             if args.concurrent > 1:
                 pool_response = pool.apply_async(run_pov, args=pov_args,
                                                  callback=result_handler.cb_pov_result)
@@ -29,6 +29,7 @@ using 'cb-replay', 'tcpdump', and 'cb-server'.
 
 import re
 import argparse
+import json
 import platform
 import glob
 import logging
@@ -43,8 +44,9 @@ import Queue
 import ansi_x931_aes128
 
 from os import environ
-from common import IS_WINDOWS
+from common import IS_WINDOWS, CRASH_ENV
 if not IS_WINDOWS:
+    import fcntl
     import resource
 
 
@@ -178,7 +180,8 @@ class Runner(object):
         a = Runner(port, cb_list, xml_list, pcap, wrapper, directory,
                    should_core, failure_ok, should_debug, timeout, log_fh,
                    cb_seed, cb_seed_skip, max_send, concurrent,
-                   negotiate_seed, pov_seed, cb_no_attach)
+                   negotiate_seed, pov_seed, cb_no_attach, cores_path,
+                   split_results, cache_dir, result_fd, crash_path)
         a.run()
 
     Attributes:
@@ -201,6 +204,13 @@ class Runner(object):
         negotiate_seed: Should the CB seed be negotiated from cb-replay
         pov_seed: the PRNG seed for POVs
         cb_no_attach: Should the CB not be attached within cb-server
+        cores_path: Path where the Linux cores are stored
+        split_results: Should the results be reported per Poll/POV
+        cache_dir: Directory to cache the parsed Polls
+        result_fd: File descriptor the result record of each Poll/POV is
+            written to
+        crash_path: Path where the CBs record their crashes instead of
+            dumping cores
     """
     pov_signals = [signal.SIGSEGV, signal.SIGILL]
     if not IS_WINDOWS:
@@ -209,7 +219,8 @@ class Runner(object):
     def __init__(self, port, cb_list, xml_list, pcap, wrapper, directory,
                  should_core, failure_ok, should_debug, timeout, log_fh,
                  cb_seed, cb_seed_skip, max_send, concurrent, negotiate_seed,
-                 pov_seed, cb_no_attach, cores_path):
+                 pov_seed, cb_no_attach, cores_path, split_results=False,
+                 cache_dir=None, result_fd=None, crash_path=None):
         self.port = port
         self.cb_list = cb_list
         self.cb_no_attach = cb_no_attach
@@ -230,10 +241,20 @@ class Runner(object):
         self.negotiate_seed = negotiate_seed
         self.pov_seed = pov_seed
         self.cores_path = cores_path
+        self.split_results = split_results
+        self.cache_dir = cache_dir
+        self.result_fd = result_fd
+        self.crash_path = crash_path
 
         if not IS_WINDOWS:
-            resource.setrlimit(resource.RLIMIT_CORE, (resource.RLIM_INFINITY,
-                                                      resource.RLIM_INFINITY))
+            if crash_path:
+                # libcgc records the signal and registers, no core is needed
+                environ[CRASH_ENV] = crash_path
+                resource.setrlimit(resource.RLIMIT_CORE, (0, resource.RLIM_INFINITY))
+            else:
+                environ.pop(CRASH_ENV, None)
+                resource.setrlimit(resource.RLIMIT_CORE, (resource.RLIM_INFINITY,
+                                                          resource.RLIM_INFINITY))
 
     def background(self, cmd, cmd_name=None):
         """ Run a command in the background, and verify it started
@@ -276,9 +297,12 @@ class Runner(object):
         if len(stderr):
             for line in stderr.split('\n'):
                 logging.error('%s (stderr): %s', cmd[0], repr(line))
-        self.log_fh.flush()
-        self.log_fh.write(stdout)
-        self.log_fh.flush()
+        # The output is written per Poll/POV when the results are split, and
+        # not at all when the results are written to the result fd
+        if not self.split_results and self.result_fd is None:
+            self.log_fh.flush()
+            self.log_fh.write(stdout)
+            self.log_fh.flush()
         return process.returncode, stdout
 
     def cleanup(self):
@@ -368,7 +392,7 @@ class Runner(object):
         if xml[0].endswith(add_ext('.pov')):
             replay_bin = os.path.join('.', 'cb-replay-pov.py')
 
-        replay_cmd = [sys.executable, replay_bin, '--debug', '--cbs'] + cb_paths
+        replay_cmd = [sys.executable, replay_bin, '--cbs'] + cb_paths
 
         if self.timeout > 0:
             replay_cmd += ['--timeout', '%d' % self.timeout]
@@ -391,6 +415,9 @@ class Runner(object):
             if self.concurrent:
                 replay_cmd += ['--concurrent', '%d' % self.concurrent]
 
+            if self.cache_dir:
+                replay_cmd += ['--cache_dir', self.cache_dir]
+
         if self.max_send is not None and self.max_send > 0:
             replay_cmd += ['--max_send', '%d' % self.max_send]
 
@@ -600,18 +627,97 @@ class Runner(object):
             if match:
                 sig = int(match.group(1))
 
-            # Verify the result of this test
-            if not xml.endswith(add_ext('.pov')):
-                res = self._check_result_cqe(sig, ret)
-            else:
-                res = self._check_result_cfe(sig, xml_replay_stdout)
+            if self.split_results:
+                logging.warning('BEGIN TEST %s', xml)
+                if self.result_fd is None:
+                    self.log_fh.flush()
+                    self.log_fh.write(xml_replay_stdout)
+                    self.log_fh.flush()
+
+            # Verify the result of this test, keeping the verdict for the record
+            verdicts = VerdictLog()
+            logging.getLogger().addHandler(verdicts)
+            try:
+                if not xml.endswith(add_ext('.pov')):
+                    res = self._check_result_cqe(sig, ret)
+                else:
+                    res = self._check_result_cfe(sig, xml_replay_stdout)
+            finally:
+                logging.getLogger().removeHandler(verdicts)
+
+            if self.result_fd is not None:
+                self.write_result(xml, res, verdicts, xml_replay_stdout)
 
             # Keep track of how many tests passed verification
             if res == 0:
                 passed += 1
 
+            if self.split_results:
+                failed = 1 if re.search(r'(?m)^not ok \d+ - ', xml_replay_stdout) else 0
+                logging.warning('polls failed: %d', failed)
+                logging.warning('TOTAL TESTS: 1')
+                logging.warning('TOTAL PASSED: %d', 1 if res == 0 else 0)
+                logging.warning('END TEST %s', xml)
+
         return passed
 
+    def write_result(self, xml, res, verdicts, replay_stdout):
+        """ Write the result record of a Poll/POV to the result fd, a single
+        JSON line with the fields that are otherwise scraped from the logs
+
+        Arguments:
+            xml: path of the Poll/POV
+            res: result of the verification of the Poll/POV
+            verdicts: VerdictLog with the verdicts of the verification
+            replay_stdout: the section of the output of cb-replay for the
+                Poll/POV
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        # the crash reported by the challenge runner, the debug line first
+        pid, sig = None, 0
+        for pid_re in [r'\[DEBUG\] pid: (\d+), sig: (\d+)',
+                       r'Process generated signal \(pid: (\d+), signal: (\d+)\)']:
+            match = re.search(pid_re, replay_stdout)
+            if match:
+                pid, sig = int(match.group(1)), int(match.group(2))
+                break
+
+        duration = None
+        match = re.search(r'# duration: (\d+\.\d+)', replay_stdout)
+        if match:
+            duration = float(match.group(1))
+
+        failed_polls = re.findall(r'(?m)^not ok \d+ - (.*)$', replay_stdout)
+
+        # the resources used by the CBs, reported by the challenge runner
+        usages = re.findall(r'\[RUSAGE\] pid: \d+, utime: (\d+\.\d+), stime: (\d+\.\d+), maxrss: (\d+)',
+                            replay_stdout)
+
+        record = {
+            'file': xml,
+            'total': 1,
+            'passed': 1 if res == 0 else 0,
+            'polls_failed': 1 if failed_polls else 0,
+            'failed_polls': failed_polls,
+            'ok': verdicts.ok,
+            'not_ok': verdicts.not_ok,
+            'timed_out': 'timed out' in replay_stdout,
+            'pid': pid,
+            'sig': sig,
+            'duration': duration,
+            'cpu_user': sum(float(usage[0]) for usage in usages) if usages else None,
+            'cpu_sys': sum(float(usage[1]) for usage in usages) if usages else None,
+            'max_rss': max(int(usage[2]) for usage in usages) if usages else None,
+            'procs': len(usages) if usages else None,
+        }
+
+        os.write(self.result_fd, json.dumps(record) + '\n')
+
     def run(self):
         """ Runs the test
 
@@ -654,6 +760,28 @@ class Runner(object):
         return 0 if passed_tests == total_tests else -1
 
 
+class VerdictLog(logging.Handler):
+    """ Keeps the first 'ok' and 'not ok' verdicts logged while a Poll/POV
+    is verified """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.ok = None
+        self.not_ok = None
+
+    def emit(self, record):
+        if not getattr(record, 'raw', False):
+            return
+
+        message = record.getMessage()
+        if message.startswith('not ok - '):
+            if self.not_ok is None:
+                self.not_ok = message[len('not ok - '):].rstrip('\n')
+        elif message.startswith('ok - '):
+            if self.ok is None:
+                self.ok = message[len('ok - '):].rstrip('\n')
+
+
 class CB_Formatter(logging.Formatter):
     def format(self, record):
         s = super(CB_Formatter, self).format(record)
@@ -716,6 +844,10 @@ def main():
                         default=False, help='This test should cause a core')
     parser.add_argument('--cores_path', required=False, type=str,
                         help='Enables for Linux core storage under the specified path.')
+    parser.add_argument('--crash_path', required=False, type=str,
+                        help='Record only the signal and registers of the '
+                             'crashing CBs under the specified path, '
+                             'without core dumps')
     parser.add_argument('--wrapper', required=False, type=str,
                         help='Executable to wrap each CB for instrumentation')
     parser.add_argument('--failure_ok', required=False, action='store_true',
@@ -728,6 +860,14 @@ def main():
                         default=False, help='Negotate the CB seed from cb-replay')
     parser.add_argument('--cb_no_attach', required=False, action='store_true',
                         default=False, help='Do not attach to the CB')
+    parser.add_argument('--split_results', required=False, action='store_true',
+                        default=False, help='Report the results of each '
+                                            'Poll/POV in its own block')
+    parser.add_argument('--cache_dir', required=False, type=str,
+                        help='Directory to cache the parsed Polls')
+    parser.add_argument('--result_fd', required=False, type=int,
+                        help='File descriptor to write a JSON result record '
+                             'of each Poll/POV to')
 
     exgroup = parser.add_argument_group(title='XML files')
     group = exgroup.add_mutually_exclusive_group(required=True)
@@ -780,12 +920,19 @@ def main():
         error_handler.setFormatter(logging.Formatter('# %(message)s'))
         logger.addHandler(error_handler)
 
+    if args.result_fd is not None and not IS_WINDOWS:
+        # the fd is for cb-test only, keep it from cb-replay and the CBs
+        flags = fcntl.fcntl(args.result_fd, fcntl.F_GETFD)
+        fcntl.fcntl(args.result_fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
     ret = -1
     runner = Runner(args.port, args.cb, xml_files, args.pcap, args.wrapper,
                     args.directory, args.should_core, args.failure_ok,
                     args.debug, args.timeout, log_fh, args.cb_seed,
                     args.cb_seed_skip, args.max_send, args.concurrent,
-                    args.negotiate_seed, args.pov_seed, args.cb_no_attach, args.cores_path)
+                    args.negotiate_seed, args.pov_seed, args.cb_no_attach, args.cores_path,
+                    args.split_results, args.cache_dir, args.result_fd,
+                    args.crash_path)
 
     try:
         ret = runner.run()
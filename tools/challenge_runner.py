@@ -1,14 +1,18 @@
 #!/usr/bin/env python2
 
+import errno
 import os
 import re
+import shutil
 import signal
 import socket
 import subprocess as sp
-from time import time, sleep
+import tempfile
 import threading
+import time
+import Queue
 
-from common import IS_DARWIN, IS_LINUX, IS_WINDOWS, try_delete
+from common import CRASH_ENV, IS_DARWIN, IS_LINUX, IS_WINDOWS, try_delete
 from os import environ
 cb_env = environ
 # Path to crash dumps in windows
@@ -16,6 +20,213 @@ if IS_WINDOWS:
     # NOTE: These may need to be changed depending on your setup
     DUMP_DIR = os.path.join(os.path.expandvars('%LOCALAPPDATA%'), 'CrashDumps')
     CDB_PATH = 'C:/Program Files (x86)/Windows Kits/10/Debuggers/x64/cdb.exe'
+else:
+    import fcntl
+
+# Symbol of the fork server shim (lib/include/forkserver.c)
+FORKSERVER_SYMBOL = '__wrap_main'
+# How long a forked challenge may take to open its standard fds
+FORKSERVER_OPEN_TIMEOUT = 5
+
+
+class ForkedProcess(object):
+    """ Challenge forked by a fork server, with the interface of the Popen
+    objects used by the replayers
+
+    Attributes:
+        server (ForkServer): server that forked the challenge
+        pid (int): pid of the challenge
+        stdin, stdout, stderr (file): FIFOs placed over the standard fds
+        returncode (int): return code, set once the challenge was reaped
+        rusage: resource usage, set once the challenge was reaped
+    """
+    def __init__(self, server, pid, stdin, stdout, stderr):
+        self.server = server
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self.rusage = None
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            if self.returncode is None:
+                status, self.rusage = self.server.reap()
+                if os.WIFSIGNALED(status):
+                    self.returncode = -os.WTERMSIG(status)
+                else:
+                    self.returncode = os.WEXITSTATUS(status)
+
+        return self.returncode
+
+    def poll(self):
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, sig)
+            except OSError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class ForkUsage(object):
+    """ Resource usage of a forked challenge, as reported by its server """
+    def __init__(self, utime, stime, maxrss):
+        self.ru_utime = utime
+        self.ru_stime = stime
+        self.ru_maxrss = maxrss
+
+
+class ForkServer(object):
+    """ Challenge started once and forked at main for each test
+
+    The challenge must be built with the fork server shim, see
+    lib/include/forkserver.c for the protocol. The server exits when the
+    control pipe is closed.
+
+    Attributes:
+        path (str): path of the challenge
+        key (tuple): identity of the challenge file the server was started from
+        proc (sp.Popen): the server
+    """
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+        ctl_read, ctl_write = os.pipe()
+        status_read, status_write = os.pipe()
+        for fd in [ctl_write, status_read]:
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+        env = dict(cb_env)
+        env['CGC_FORKSERVER'] = '{},{}'.format(ctl_read, status_write)
+        with open(os.devnull, 'r+b') as devnull:
+            self.proc = sp.Popen([path], env=env, stdin=devnull, stdout=devnull, stderr=devnull)
+
+        os.close(ctl_read)
+        os.close(status_write)
+        self.control = ctl_write
+        self.status = os.fdopen(status_read, 'rb')
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def close(self):
+        os.close(self.control)
+        self.status.close()
+        self.proc.wait()
+
+    def spawn(self, seed):
+        """ Fork a challenge with the seed and FIFOs as its standard fds
+
+        Args:
+            seed (str): Hex encoded seed for libcgc random
+        Returns:
+            (ForkedProcess): the forked challenge
+        """
+        fifo_dir = tempfile.mkdtemp(prefix='cgc-fork-')
+        try:
+            fifos = [os.path.join(fifo_dir, name) for name in ['stdin', 'stdout', 'stderr']]
+            for fifo in fifos:
+                os.mkfifo(fifo)
+
+            os.write(self.control, '{} {}\n'.format(seed or '-', ' '.join(fifos)))
+            line = self.status.readline()
+            if not line:
+                raise OSError(errno.EPIPE, 'fork server of {} exited'.format(self.path))
+            pid = int(line)
+
+            # The child opens stdout and stderr before stdin, the readers are
+            # opened without blocking and stdin is open once the child is ready
+            fds = [os.open(fifos[1], os.O_RDONLY | os.O_NONBLOCK),
+                   os.open(fifos[2], os.O_RDONLY | os.O_NONBLOCK)]
+            deadline = time.time() + FORKSERVER_OPEN_TIMEOUT
+            while True:
+                try:
+                    fds.insert(0, os.open(fifos[0], os.O_WRONLY | os.O_NONBLOCK))
+                    break
+                except OSError as err:
+                    if err.errno != errno.ENXIO or time.time() > deadline:
+                        for fd in fds:
+                            os.close(fd)
+                        os.kill(pid, signal.SIGKILL)
+                        self.reap()
+                        raise
+                    time.sleep(0.001)
+
+            # Same blocking behaviour as the pipes of Popen
+            for fd in fds:
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+                fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+            return ForkedProcess(self, pid, os.fdopen(fds[0], 'wb'), os.fdopen(fds[1], 'rb'),
+                                 os.fdopen(fds[2], 'rb'))
+        finally:
+            shutil.rmtree(fifo_dir, ignore_errors=True)
+
+    def reap(self):
+        """ Block until the forked challenge exits
+
+        Returns:
+            (int, ForkUsage): wait status and resource usage of the challenge
+        """
+        line = self.status.readline()
+        if not line:
+            raise OSError(errno.EPIPE, 'fork server of {} exited'.format(self.path))
+
+        status, utime, stime, maxrss = line.split()
+        return int(status), ForkUsage(float(utime), float(stime), int(maxrss))
+
+
+# Fork servers of this process by challenge path
+fork_servers = {}
+# Whether this process runs the challenges more than once, a fork server lives
+# as long as the process and costs more than a launch for a single run
+reuse_fork_servers = False
+
+
+def fork_server(path):
+    """ Get the fork server of a challenge, starting it if needed
+
+    Fork servers are used when FORKSERVER is set in the environment, the
+    process runs the challenges more than once (reuse_fork_servers) and the
+    challenge was built with the shim
+
+    Args:
+        path (str): path of the challenge
+    Returns:
+        (ForkServer): the server, or None if the challenge can't be forked
+    """
+    if IS_WINDOWS or 'FORKSERVER' not in environ or not reuse_fork_servers:
+        return None
+
+    stat = os.stat(path)
+    # the crash handler of libcgc is installed when the server starts
+    key = (stat.st_ino, stat.st_size, stat.st_mtime, cb_env.get(CRASH_ENV))
+    server = fork_servers.get(path)
+
+    if server is not None and (server.key != key or not server.alive()):
+        # the challenge was rebuilt, the crash capture changed or the server died
+        del fork_servers[path]
+        server.close()
+        server = None
+
+    if server is None:
+        with open(path, 'rb') as cb_file:
+            if FORKSERVER_SYMBOL not in cb_file.read():
+                return None
+        server = fork_servers[path] = ForkServer(path, key)
+
+    return server
 
 
 def run(challenges, timeout, seed, logfunc, cores_path):
@@ -79,8 +290,21 @@ def run(challenges, timeout, seed, logfunc, cores_path):
     # Start all challenges
     # Launch the main binary first
     mainchal, otherchals = challenges[0], challenges[1:]
-    procs = [sp.Popen(mainchal, env=cb_env, stdin=sp.PIPE,
-                      stdout=sp.PIPE, stderr=sp.PIPE)]
+    procs = None
+
+    # Single binary challenges are forked by their fork server when available
+    server = fork_server(mainchal) if len(challenges) == 1 else None
+    if server is not None:
+        try:
+            procs = [server.spawn(seed)]
+        except (OSError, IOError, ValueError) as err:
+            logfunc('fork server failed, launching the challenge: {}'.format(err))
+            fork_servers.pop(mainchal, None)
+            server.close()
+
+    if procs is None:
+        procs = [sp.Popen(mainchal, env=cb_env, stdin=sp.PIPE,
+                          stdout=sp.PIPE, stderr=sp.PIPE)]
 
     # Any others should be launched with the same std i/o pipes
     # as the main binary
@@ -97,23 +321,103 @@ def run(challenges, timeout, seed, logfunc, cores_path):
     return procs, watcher
 
 
+def terminate(procs):
+    """ Terminate the processes that were not reaped yet
+
+    Args:
+        procs (list): processes to terminate
+    """
+    for proc in procs:
+        if proc.returncode is None:
+            try:
+                proc.terminate()
+            except OSError:
+                pass
+
+
+def reap(proc):
+    """ Block until the process exits, keeping its resource usage
+
+    The process is reaped with wait4 where available, the usage is then set
+    as 'rusage' on the process
+
+    Args:
+        proc: process to wait for
+    """
+    if isinstance(proc, ForkedProcess):
+        # reaped by its fork server
+        proc.wait()
+        return
+
+    proc.rusage = None
+    if IS_WINDOWS:
+        proc.wait()
+        return
+
+    while True:
+        try:
+            _, status, proc.rusage = os.wait4(proc.pid, 0)
+            break
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            if err.errno == errno.ECHILD:
+                # reaped elsewhere
+                proc.wait()
+                return
+            raise
+
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+
+
+def wait_exit(proc, exited):
+    """ Block until the process exits and report it
+
+    Args:
+        proc: process to wait for
+        exited (Queue.Queue): queue where the process is put once it exits
+    """
+    reap(proc)
+    exited.put(proc)
+
+
 def chal_watcher(paths, procs, timeout, log, cores_path):
-    # Continue until any of the processes die
+    # The crashes are recorded by libcgc instead of dumping cores when set
+    crash_path = None if IS_WINDOWS else cb_env.get(CRASH_ENV)
+
+    # The processes still running at the deadline are terminated, so the
+    # blocking waits below return at the latest by then
+    deadline = None
+    if timeout:
+        deadline = threading.Timer(timeout, terminate, args=(procs,))
+        deadline.setDaemon(True)
+        deadline.start()
+
+    if len(procs) == 1:
+        reap(procs[0])
+    else:
+        exited = Queue.Queue()
+        waiters = [threading.Thread(target=wait_exit, args=(proc, exited)) for proc in procs]
+        for waiter in waiters:
+            waiter.setDaemon(True)
+            waiter.start()
+
+        # Wait until any process exits
+        exited.get()
 
-    # Wait until any process exits
-    start = time()
-    while time() - start < timeout \
-            and all(proc.poll() is None for proc in procs):
-        sleep(0.1)
+        # Give the others a chance to exit
+        for waiter in waiters:
+            waiter.join()
 
-    # Give the others a chance to exit
-    while time() - start < timeout \
-            and any(proc.poll() is None for proc in procs):
-        sleep(0.1)
+    if deadline is not None:
+        deadline.cancel()
 
     # Kill any remaining processes
     for proc in procs:
-        if proc.poll() is None:
+        if proc.returncode is None:
             proc.terminate()
             proc.wait()
 
@@ -129,7 +433,10 @@ def chal_watcher(paths, procs, timeout, log, cores_path):
             log('[DEBUG] pid: {}, sig: {}'.format(pid, sig))
 
             # Attempt to get register values
-            regs = get_core_dump_regs(path, pid, log, cores_path)
+            if crash_path:
+                regs = get_crash_regs(pid, log, crash_path)
+            else:
+                regs = get_core_dump_regs(path, pid, log, cores_path)
             if regs is not None:
                 # If a core dump was generated, report this as a crash
                 # log('Process generated signal (pid: {}, signal: {}) - {}\n'.format(pid, sig, testpath))
@@ -139,8 +446,19 @@ def chal_watcher(paths, procs, timeout, log, cores_path):
                 reg_str = ' '.join(['{}:{}'.format(reg, val) for reg, val in regs.iteritems()])
                 log('register states - {}'.format(reg_str))
 
+    # Report the resources used by the challenges, maxrss is in bytes on MacOS
+    for proc in procs:
+        rusage = getattr(proc, 'rusage', None)
+        if rusage is not None:
+            max_rss = rusage.ru_maxrss // 1024 if IS_DARWIN else rusage.ru_maxrss
+            log('[RUSAGE] pid: {}, utime: {:.6f}, stime: {:.6f}, maxrss: {}'.format(
+                proc.pid, rusage.ru_utime, rusage.ru_stime, max_rss))
+
     # Final cleanup
-    clean_cores(paths, procs, cores_path)
+    if crash_path:
+        clean_crashes(procs, crash_path)
+    else:
+        clean_cores(paths, procs, cores_path)
 
 
 def get_core_dump_regs(path, pid, log, cores_path):
@@ -215,6 +533,47 @@ def get_core_dump_regs(path, pid, log, cores_path):
     return regs
 
 
+def get_crash_regs(pid, log, crash_path):
+    """ Read all register values from the crash record of a challenge
+    The record is written by the crash handler of libcgc (lib/include/crash.c)
+    as crash.[pid] under the crash path, with the signal and faulting address
+    on the first line and the registers on the second
+
+    Args:
+        pid (int): pid of the process that crashed
+        log ((str) -> None): logging function used to report information
+        crash_path (str): path where the crash records are stored
+    Returns:
+        (dict): Registers and their values
+    """
+    try:
+        with open(os.path.join(crash_path, 'crash.{}'.format(pid)), 'r') as record:
+            lines = record.read().split('\n')
+    except IOError:
+        log('Crash record not found, was the challenge built with the crash handler?')
+        return
+
+    if len(lines) < 2:
+        log('Crash record incomplete')
+        return
+
+    regs = {}
+    for match in re.finditer(r'([a-z]+):([a-fA-F0-9]+)', lines[1]):
+        regs[match.group(1)] = match.group(2)
+
+    return regs
+
+
+def clean_crashes(procs, crash_path):
+    """ Delete all crash records
+
+    Args:
+        procs (list): List of all processes that may have recorded a crash
+        crash_path (str): path where the crash records are stored
+    """
+    map(try_delete, [os.path.join(crash_path, 'crash.{}'.format(p.pid)) for p in procs])
+
+
 def clean_cores(paths, procs, cores_path):
     """ Delete all generated core dumps
 
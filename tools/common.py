@@ -8,6 +8,9 @@ IS_DARWIN = sys.platform == 'darwin'
 IS_LINUX = 'linux' in sys.platform
 IS_WINDOWS = sys.platform == 'win32'
 
+# Directory where libcgc records the crashes of the CBs instead of dumping cores
+CRASH_ENV = 'CGC_CRASH_DIR'
+
 
 def debug(s):
     sys.stdout.write(str(s))